@@ -0,0 +1,357 @@
+import os
+import json
+import numpy as np
+
+chunk_rows = 256 # recorded states per chunk file
+n_levels = 3 # the full resolution level and its overviews
+overview_factor = 8 # each overview level keeps every overview_factor-th record and cell of the level below
+
+
+class AdvectionResultStore:
+    def __init__(self, store_dir):
+        """Open a store of recorded advection states written by append.
+
+        The states are split in time into chunk files of chunk_rows records. A chunk file is a raw
+        little-endian array of shape (rows, n_cells, n_fields), so the profile at one time is contiguous
+        and the history at one cell is a strided view, and both are memory-mapped without reading the
+        rest of the file. Overview level k keeps every overview_factor**k-th record and cell, so a whole
+        run can be plotted from a small file. A meta.json file lists the fields, the levels and the number
+        of records, an int64 file per level holds the UTC epoch timestamps in ns, and x.f64 holds the cell
+        locations.
+
+        Args:
+            store_dir (str): The directory of the store.
+        Returns:
+            None
+        Raises:
+            FileNotFoundError: If the directory does not contain a store.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.fields = self.meta["fields"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.x = np.fromfile(os.path.join(store_dir, "x.f64"), dtype="<f8")
+        self.n_rows = self.meta["n_rows"]
+        self.files = {}
+        self.last_timestamp = self.timestamps(0)[-1] if self.n_rows > 0 else None
+
+    @classmethod
+    def create(cls, store_dir, x, fields, dtype="<f4", chunk_rows=chunk_rows, n_levels=n_levels,
+               overview_factor=overview_factor):
+        """Create an empty store. An existing store in the directory is overwritten.
+
+        Args:
+            store_dir (str): The directory of the store, created if needed.
+            x (np.ndarray): The cell locations in m.
+            fields (list): The names of the fields, in the column order of the appended states.
+            dtype (str): The stored value type, float32 halves the size of float64 results.
+            chunk_rows (int): The number of records per chunk file.
+            n_levels (int): The number of levels, 1 for no overviews.
+            overview_factor (int): The decimation between consecutive levels.
+        Returns:
+            AdvectionResultStore: The store, ready to append.
+        Raises:
+            None
+        """
+        x = np.asarray(x, dtype="<f8")
+        meta = {"fields": list(fields), "dtype": np.dtype(dtype).str, "chunk_rows": chunk_rows, "n_rows": 0, "levels": []}
+        for level in range(n_levels):
+            step = overview_factor ** level
+            level_dir = "level%d" % level
+            os.makedirs(os.path.join(store_dir, level_dir), exist_ok=True)
+            for file_name in os.listdir(os.path.join(store_dir, level_dir)):
+                os.remove(os.path.join(store_dir, level_dir, file_name))
+            open(os.path.join(store_dir, level_dir, "timestamps.i64"), "wb").close()
+            meta["levels"].append({"dir": level_dir, "step": step, "n_cells": len(x[::step])})
+        x.tofile(os.path.join(store_dir, "x.f64"))
+        _write_meta(store_dir, meta)
+        return cls(store_dir)
+
+    def _path(self, level, file_name):
+        return os.path.join(self.store_dir, self.meta["levels"][level]["dir"], file_name)
+
+    def level_rows(self, level, n_rows=None):
+        """Get the number of records of a level.
+
+        Args:
+            level (int): The level.
+            n_rows (int): The number of full resolution records. None for the records of the store.
+        Returns:
+            int: The number of records of the level.
+        Raises:
+            None
+        """
+        if n_rows is None:
+            n_rows = self.n_rows
+        step = self.meta["levels"][level]["step"]
+        return (n_rows + step - 1) // step
+
+    def append(self, t, a):
+        """Append the state at one time, as the result of BatchedAdvection.solve or BatchTracker.solve.
+
+        Args:
+            t (np.datetime64): The time of the state, later than the last record.
+            a (np.ndarray): The values, shape (n_cells, n_fields).
+        Returns:
+            None
+        Raises:
+            ValueError: If t is not later than the last record or a has the wrong shape.
+        """
+        a = np.asarray(a)
+        if a.shape != (len(self.x), len(self.fields)):
+            raise ValueError('Expected a state of shape %s, got %s' % ((len(self.x), len(self.fields)), a.shape))
+        timestamp = np.datetime64(t, "ns").astype(np.int64)
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            raise ValueError('Records must be appended in time order, %s is not after the last record' % t)
+        for level, level_meta in enumerate(self.meta["levels"]):
+            step = level_meta["step"]
+            if self.n_rows % step != 0:
+                continue
+            row = self.n_rows // step
+            chunk_file = "chunk%06d.bin" % (row // self.meta["chunk_rows"])
+            if self.files.get(level, (None, None))[0] != chunk_file:
+                self._close_file(level)
+                self.files[level] = (chunk_file, open(self._path(level, chunk_file), "ab"),
+                                     open(self._path(level, "timestamps.i64"), "ab"))
+            _, values_file, timestamps_file = self.files[level]
+            np.ascontiguousarray(a[::step], dtype=self.dtype).tofile(values_file)
+            np.array([timestamp], dtype="<i8").tofile(timestamps_file)
+        self.n_rows += 1
+        self.last_timestamp = timestamp
+
+    def _close_file(self, level):
+        if level in self.files:
+            self.files[level][1].close()
+            self.files[level][2].close()
+            del self.files[level]
+
+    def flush(self):
+        """Write the appended records to disk and update meta.json, so they are visible to readers.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        for _, values_file, timestamps_file in self.files.values():
+            values_file.flush()
+            timestamps_file.flush()
+        self.meta["n_rows"] = self.n_rows
+        _write_meta(self.store_dir, self.meta)
+
+    def close(self):
+        """Flush the store and close its files.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.flush()
+        for level in list(self.files):
+            self._close_file(level)
+
+    def truncate_rows(self, n_rows):
+        """Keep the first n_rows full resolution records and drop the others.
+
+        Args:
+            n_rows (int): The number of records kept.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        for level in list(self.files):
+            self._close_file(level)
+        chunk_rows = self.meta["chunk_rows"]
+        for level, level_meta in enumerate(self.meta["levels"]):
+            rows = self.level_rows(level, n_rows)
+            row_size = level_meta["n_cells"] * len(self.fields) * self.dtype.itemsize
+            with open(self._path(level, "timestamps.i64"), "r+b") as f:
+                f.truncate(rows * 8)
+            chunk = 0
+            while os.path.exists(self._path(level, "chunk%06d.bin" % chunk)):
+                kept = min(max(rows - chunk * chunk_rows, 0), chunk_rows)
+                if kept == 0:
+                    os.remove(self._path(level, "chunk%06d.bin" % chunk))
+                else:
+                    with open(self._path(level, "chunk%06d.bin" % chunk), "r+b") as f:
+                        f.truncate(kept * row_size)
+                chunk += 1
+        self.n_rows = n_rows
+        self.last_timestamp = self.timestamps(0)[-1] if n_rows > 0 else None
+        self.flush()
+
+    def truncate(self, t):
+        """Drop the records after a time, e.g. the records of a run after the checkpoint it continues from.
+
+        Args:
+            t (np.datetime64): The time of the last record kept.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.truncate_rows(int(np.searchsorted(self.timestamps(0), np.datetime64(t, "ns").astype(np.int64), side="right")))
+
+    def timestamps(self, level=0):
+        """Get the timestamps of the records of a level.
+
+        Args:
+            level (int): The level.
+        Returns:
+            np.ndarray: The int64 UTC epoch timestamps in ns.
+        Raises:
+            None
+        """
+        rows = self.level_rows(level)
+        if level in self.files:
+            self.files[level][2].flush()
+        if rows == 0:
+            return np.empty(0, dtype="<i8")
+        return np.memmap(self._path(level, "timestamps.i64"), dtype="<i8", mode="r", shape=(rows,))
+
+    def level_x(self, level=0):
+        """Get the cell locations of a level.
+
+        Args:
+            level (int): The level.
+        Returns:
+            np.ndarray: The cell locations in m.
+        Raises:
+            None
+        """
+        return self.x[::self.meta["levels"][level]["step"]]
+
+    def _chunk(self, level, chunk):
+        rows = min(self.level_rows(level) - chunk * self.meta["chunk_rows"], self.meta["chunk_rows"])
+        if level in self.files:
+            self.files[level][1].flush()
+        shape = (rows, self.meta["levels"][level]["n_cells"], len(self.fields))
+        return np.memmap(self._path(level, "chunk%06d.bin" % chunk), dtype=self.dtype, mode="r", shape=shape)
+
+    def _field_index(self, field):
+        if field is None:
+            return slice(None)
+        if field not in self.fields:
+            raise KeyError('Field %s is not in the store' % field)
+        return self.fields.index(field)
+
+    def profile_at(self, t, field=None, level=0):
+        """Get the recorded profile at a time, as a memory-mapped view.
+
+        Args:
+            t (np.datetime64): The time. The last record at or before t is returned.
+            field (str): The field to get. None for all fields.
+            level (int): The level.
+        Returns:
+            tuple: The datetime64 time of the record, and the values at level_x(level) with shape (n_cells,)
+                for one field or (n_cells, n_fields).
+        Raises:
+            KeyError: If t is before the first record or field is not in the store.
+        """
+        timestamps = self.timestamps(level)
+        row = int(np.searchsorted(timestamps, np.datetime64(t, "ns").astype(np.int64), side="right")) - 1
+        if row < 0:
+            raise KeyError('No record at or before %s' % t)
+        chunk = self._chunk(level, row // self.meta["chunk_rows"])
+        return timestamps[row].view("datetime64[ns]"), chunk[row % self.meta["chunk_rows"], :, self._field_index(field)]
+
+    def history_at(self, x, field=None, start=None, end=None, level=0):
+        """Get the recorded history at the cell nearest to a location.
+
+        Only the records of the time range are read. The values are a view when the range is within one
+        chunk file, otherwise the views of the chunks are concatenated.
+
+        Args:
+            x (float): The location in m.
+            field (str): The field to get. None for all fields.
+            start (np.datetime64): The first time, included. None for the first record.
+            end (np.datetime64): The last time, included. None for the last record.
+            level (int): The level, overview levels cover long ranges with fewer records.
+        Returns:
+            tuple: The datetime64 times, and the values with shape (n_times,) for one field or
+                (n_times, n_fields).
+        Raises:
+            KeyError: If field is not in the store.
+        """
+        x_level = self.level_x(level)
+        cell = int(np.argmin(np.abs(x_level - x)))
+        timestamps = self.timestamps(level)
+        first = 0 if start is None else int(np.searchsorted(timestamps, np.datetime64(start, "ns").astype(np.int64), side="left"))
+        last = len(timestamps) if end is None else int(np.searchsorted(timestamps, np.datetime64(end, "ns").astype(np.int64), side="right"))
+        chunk_rows = self.meta["chunk_rows"]
+        field_index = self._field_index(field)
+        pieces = []
+        chunks = range(first // chunk_rows, (last + chunk_rows - 1) // chunk_rows) if last > first else range(0)
+        for chunk in chunks:
+            rows = slice(max(first - chunk * chunk_rows, 0), min(last - chunk * chunk_rows, chunk_rows))
+            pieces.append(self._chunk(level, chunk)[rows, cell, field_index])
+        if len(pieces) == 1:
+            values = pieces[0]
+        elif pieces:
+            values = np.concatenate(pieces)
+        else:
+            values = np.empty((0,) if field is not None else (0, len(self.fields)), dtype=self.dtype)
+        return timestamps[first:last].view("datetime64[ns]"), values
+
+    def blocks(self, field=None, start=None, end=None, level=0):
+        """Iterate over the records of a time range one chunk file at a time, as memory-mapped views.
+
+        Args:
+            field (str): The field to get. None for all fields.
+            start (np.datetime64): The first time, included. None for the first record.
+            end (np.datetime64): The last time, included. None for the last record.
+            level (int): The level.
+        Returns:
+            generator: The datetime64 times of each block, and its values with shape (n_times, n_cells) for one
+                field or (n_times, n_cells, n_fields).
+        Raises:
+            KeyError: If field is not in the store.
+        """
+        field_index = self._field_index(field)
+        timestamps = self.timestamps(level)
+        first = 0 if start is None else int(np.searchsorted(timestamps, np.datetime64(start, "ns").astype(np.int64), side="left"))
+        last = len(timestamps) if end is None else int(np.searchsorted(timestamps, np.datetime64(end, "ns").astype(np.int64), side="right"))
+        chunk_rows = self.meta["chunk_rows"]
+        for chunk in range(first // chunk_rows, (last + chunk_rows - 1) // chunk_rows) if last > first else range(0):
+            rows = slice(max(first - chunk * chunk_rows, 0), min(last - chunk * chunk_rows, chunk_rows))
+            yield (timestamps[chunk * chunk_rows:][rows].view("datetime64[ns]"),
+                   self._chunk(level, chunk)[rows, :, field_index])
+
+
+def _write_meta(store_dir, meta):
+    tmp_path = os.path.join(store_dir, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, os.path.join(store_dir, "meta.json"))
+
+
+def open_result_store(store_dir, x, fields, **kwargs):
+    """Open the store in a directory to append to it, or create it if there is none.
+
+    A run that does not continue from a checkpoint drops the records of the store first, see solve_windows.
+
+    Args:
+        store_dir (str): The directory of the store.
+        x (np.ndarray): The cell locations in m.
+        fields (list): The names of the fields.
+        **kwargs: Options of AdvectionResultStore.create for a new store.
+    Returns:
+        AdvectionResultStore: The store.
+    Raises:
+        ValueError: If the existing store has other cells or fields.
+    """
+    if not os.path.exists(os.path.join(store_dir, "meta.json")):
+        return AdvectionResultStore.create(store_dir, x, fields, **kwargs)
+    store = AdvectionResultStore(store_dir)
+    # Records appended after the last flush are not part of the store
+    store.truncate_rows(store.n_rows)
+    if store.fields != list(fields) or not np.array_equal(store.x, np.asarray(x, dtype=np.float64)):
+        raise ValueError('The store in %s has other cells or fields' % store_dir)
+    return store
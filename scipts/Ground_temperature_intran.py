@@ -0,0 +1,186 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from SPS_model_cache import load_model
+
+path_to_profiles = r"..\data\SimSuite_gound_temperature_profiles_March_24_2025.xlsx"
+path_to_model = r"..\sps_model"
+output_path = r"..\output\GROUND_TEMPERATURE.INC"
+profile_tolerance = 0.2 # DC, largest difference between a transfer line's monthly profile and its shared function
+profile_decimals = 2 # decimals of the temperatures written to the include file
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+# SimSuite sheets and the SPS paths they cover. With remove_offset the SimSuite kmposts are shifted to start at 0.
+segments = [
+    {'sheet': 'KSTAB', 'from': 'TAKE_HRDSY_REC', 'to': 'SALE_PTOKA_DEL', 'remove_offset': False},
+    {'sheet': 'STLCBtoNDRLD', 'from': 'HF_STLCB', 'to': 'SALE_NDRLD_DEL', 'remove_offset': False},
+    {'sheet': 'HSTNLtoHSTNT', 'from': 'NO_LIBRT_D', 'to': 'SALE_HSTNT_DEL', 'remove_offset': True},
+    {'sheet': 'CTGOItoCTGOD', 'from': 'NO_LIBRT_01A_S', 'to': 'SALE_CITGO_DEL', 'remove_offset': True},
+]
+
+INTRAN_HEADER = '''
+DEFINE N_DAYS_IN_MONTH =
++ (MONTH(TIME) = 1 ) ? 31 :
++ (MONTH(TIME) = 2 ) ? 29 :
++ (MONTH(TIME) = 3 ) ? 31 :
++ (MONTH(TIME) = 4 ) ? 30 :
++ (MONTH(TIME) = 5 ) ? 31 :
++ (MONTH(TIME) = 6 ) ? 30 :
++ (MONTH(TIME) = 7 ) ? 31 :
++ (MONTH(TIME) = 8 ) ? 31 :
++ (MONTH(TIME) = 9 ) ? 30 :
++ (MONTH(TIME) = 10) ? 31 :
++ (MONTH(TIME) = 11) ? 30 :
++ (MONTH(TIME) = 12) ? 31 : "NONE"
+DEFINE MONTH_LOOKUP = MONTH(TIME) + DAY(TIME)/N_DAYS_IN_MONTH + HOUR(TIME)/(N_DAYS_IN_MONTH*24) + MINUTE(TIME)/(N_DAYS_IN_MONTH*24*60)
+'''
+
+
+def transfer_line_profiles(df_profiles, model, from_loc, to_loc, remove_offset=False):
+    """Get the monthly ground temperature of each transfer line along a path from a SimSuite profile sheet.
+
+    The SimSuite kmposts are scaled to the SPS path length, the profile is interpolated at the ends of the
+    transfer lines, and each transfer line takes the mean of its two ends.
+
+    Args:
+        df_profiles (pd.DataFrame): The SimSuite profiles, a 'kmpost' column and one column per month.
+        model (CompiledModel): The SPS model, as returned by load_model.
+        from_loc (str): The element or node the path starts at.
+        to_loc (str): The element or node the path ends at.
+        remove_offset (bool): If True, shift the kmposts to start at 0 before scaling.
+    Returns:
+        pd.DataFrame: The monthly temperatures indexed by transfer line name in path order.
+    Raises:
+        ValueError: If there is no path from from_loc to to_loc.
+    """
+    df_profiles_scaled = df_profiles.set_index('kmpost')
+    if remove_offset:
+        df_profiles_scaled.index = df_profiles_scaled.index - df_profiles_scaled.index[0]
+    L = model.get_path_length(from_loc, to_loc)
+    df_profiles_scaled.index = df_profiles_scaled.index * L / df_profiles_scaled.index[-1]
+
+    T_loc_dict = model.get_device_location_in_path(from_loc, to_loc, 'T')
+    T_x = np.array([0] + list(T_loc_dict.values()))
+    df_T_temperature_profile = pd.DataFrame(index=list(T_loc_dict.keys()))
+    for month in months:
+        y = np.interp(T_x, df_profiles_scaled.index, df_profiles_scaled[month])
+        df_T_temperature_profile[month] = (y[:-1] + y[1:]) / 2
+    return df_T_temperature_profile
+
+
+def cluster_profiles(df_T_temperature_profile, tolerance=profile_tolerance, decimals=profile_decimals):
+    """Group transfer lines whose monthly profiles are within a tolerance of a shared profile.
+
+    The profiles are rounded to the decimals written to the include file. In path order, each transfer line
+    joins the closest existing group whose profile is within tolerance in every month, otherwise its profile
+    starts a new group, so no line is more than tolerance plus the rounding away from its group's profile.
+
+    Args:
+        df_T_temperature_profile (pd.DataFrame): The monthly temperatures indexed by transfer line name.
+        tolerance (float): The largest difference in DC between a line's rounded profile and its group's profile.
+        decimals (int): The decimals of the profiles.
+    Returns:
+        tuple: The group profiles with shape (n_groups, 12), and the group of each transfer line.
+    Raises:
+        None
+    """
+    profiles = df_T_temperature_profile[months].to_numpy(dtype=np.float64).round(decimals)
+    group_profiles = np.empty((0, len(months)))
+    groups = np.empty(len(profiles), dtype=int)
+    for i, profile in enumerate(profiles):
+        differences = np.abs(group_profiles - profile).max(axis=1)
+        if len(differences) > 0 and differences.min() <= tolerance:
+            groups[i] = int(differences.argmin())
+        else:
+            groups[i] = len(group_profiles)
+            group_profiles = np.vstack([group_profiles, profile])
+    return group_profiles, groups
+
+
+def write_intran_code_for_ground_temperature(group_profiles, groups, transfer_line_names, decimals=profile_decimals):
+    """Generate INTRAN code that paints the ground temperature with one function per distinct profile.
+
+    Args:
+        group_profiles (np.ndarray): The monthly profile of each group, shape (n_groups, 12), as returned by
+            cluster_profiles.
+        groups (np.ndarray): The group of each transfer line.
+        transfer_line_names (list): The transfer line names.
+        decimals (int): The decimals of the temperatures written.
+    Returns:
+        str: The INTRAN code, without the MONTH_LOOKUP header.
+    Raises:
+        None
+    """
+    INTRAN_CODE = ''
+    for group, profile in enumerate(group_profiles):
+        values = ['%.*f' % (decimals, value) for value in profile]
+        # The profile wraps around, December before January and January after December
+        Y = ' '.join([values[-1]] + values + [values[0]])
+        INTRAN_CODE += f"""
+DEFINE.FUNCTION GRND_MONTHLY_{group:03d},
++ Y = {Y},
++ X = 0 1 2 3 4 5 6 7 8 9 10 11 12 13,
++ REPEAT = YES
+"""
+        for transfer_line_name in np.asarray(transfer_line_names)[groups == group]:
+            INTRAN_CODE += f"""RAMP IF.EXISTS({transfer_line_name}:TG-) = GRND_MONTHLY_{group:03d}(MONTH_LOOKUP)
+RAMP IF.EXISTS({transfer_line_name}:TG+) = GRND_MONTHLY_{group:03d}(MONTH_LOOKUP)
+"""
+    return INTRAN_CODE
+
+
+def write_ground_temperature_intran(path_to_profiles, model, output_path, segments=segments, tolerance=profile_tolerance,
+                                    decimals=profile_decimals):
+    """Write the ground temperature include file of every segment in one run.
+
+    A transfer line on several segment paths keeps the profile of the first segment.
+
+    Args:
+        path_to_profiles (str): The SimSuite workbook, with '<sheet>_profiles' sheets.
+        model (CompiledModel): The SPS model, as returned by load_model.
+        output_path (str): The include file written.
+        segments (list): Dicts with the SimSuite 'sheet' name, the 'from' and 'to' of the SPS path and
+            'remove_offset', see transfer_line_profiles.
+        tolerance (float): The largest difference in DC between a line's rounded profile and its function.
+        decimals (int): The decimals of the temperatures written.
+    Returns:
+        dict: The number of transfer lines and functions, and the largest and mean absolute temperature error
+            in DC of the functions against the interpolated profiles.
+    Raises:
+        KeyError: If a segment sheet is not in the workbook.
+    """
+    temperature_profile_dict = pd.read_excel(path_to_profiles, sheet_name=None)
+    covered_sheets = ['%s_profiles' % segment['sheet'] for segment in segments]
+    for sheet_name in temperature_profile_dict:
+        if sheet_name.endswith('_profiles') and sheet_name not in covered_sheets:
+            print('WARNING: sheet %s has no segment and is not written' % sheet_name)
+
+    df_T_temperature_profile = pd.concat([
+        transfer_line_profiles(temperature_profile_dict['%s_profiles' % segment['sheet']], model, segment['from'],
+                               segment['to'], segment['remove_offset'])
+        for segment in segments
+    ])
+    df_T_temperature_profile = df_T_temperature_profile[~df_T_temperature_profile.index.duplicated()]
+
+    group_profiles, groups = cluster_profiles(df_T_temperature_profile, tolerance, decimals)
+    errors = np.abs(group_profiles[groups] - df_T_temperature_profile[months].to_numpy(dtype=np.float64))
+    INTRAN_CODE = '/* Generated by Ground_temperature_intran.py on %s\n' % datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    INTRAN_CODE += INTRAN_HEADER
+    INTRAN_CODE += write_intran_code_for_ground_temperature(group_profiles, groups, df_T_temperature_profile.index, decimals)
+    with open(output_path, 'w') as file:
+        file.write(INTRAN_CODE)
+
+    report = {
+        'n_transfer_lines': len(df_T_temperature_profile),
+        'n_functions': len(group_profiles),
+        'max_error': float(errors.max()) if errors.size else 0.0,
+        'mean_error': float(errors.mean()) if errors.size else 0.0,
+    }
+    print('%d transfer lines share %d functions instead of %d (%.0f%% fewer), temperature error max %.3f DC, mean %.3f DC'
+          % (report['n_transfer_lines'], report['n_functions'], report['n_transfer_lines'],
+             100 * (1 - report['n_functions'] / max(report['n_transfer_lines'], 1)), report['max_error'], report['mean_error']))
+    return report
+
+
+if __name__ == '__main__':
+    KS = load_model(path_to_model)
+    write_ground_temperature_intran(path_to_profiles, KS, output_path)
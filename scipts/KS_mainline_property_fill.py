@@ -5,23 +5,82 @@ Created on Mon Feb 10 17:14:21 2025
 @author: Zixiang.Chen
 """
 import numpy as np
-import sps_interface
 import pandas as pd
-from pipeline_simulation import Advection
 from memory_profiler import profile
 from line_profiler import LineProfiler
 from multiprocessing import Process
+from PI_data_store import pi_data_columns, read_pi_data
+from Linefill_advection import BatchedAdvection, FlowProfile, solve_windows
+from Advection_result_store import open_result_store
+from SPS_model_cache import load_model
 
-def get_HRDSY_painted_properties(path_to_PI_data):
+path_to_PI_data = r"..\data\PI_data_for_linefill_all" # the PI data get_DRA_concentrations reads
+painted_fields = ['rho_painted', 'mu_painted', 'Tref_painted'] # painted HRDSY properties
+DRA_ppm_column = 'HRDSY-A0-DRA-ppm' # the DRA concentration of get_DRA_concentrations injected at the path inlet
+fields = painted_fields + ['DRA_ppm'] # properties advected together
+solver = 'batched' # 'batched' for one BatchedAdvection solve, 'pipeline_simulation' for one Advection process per field
+data_file_size = 1e9 # bytes per result file written by pipeline_simulation.Advection
+record_every = 60 # the linefill is saved every record_every data times
+result_dir = '../output/KS_mainline_linefill' # the AdvectionResultStore of the recorded linefills
+window = np.timedelta64(7, 'D') # the run proceeds in windows of this length, checkpointed after each
+checkpoint_path = '../output/KS_mainline_linefill/checkpoint.npz' # the run continues from here if it exists
+
+def get_DRA_concentrations(path_to_PI_data, start=None, end=None):
     # Read data
-    df = pd.read_pickle(path_to_PI_data)
+    columns = [tag_name for tag_name in pi_data_columns(path_to_PI_data) if ('DRA' in tag_name) or (tag_name[-4:] == 'A0-Q') or (tag_name[-4:] == 'B0-Q')]
+    df = read_pi_data(path_to_PI_data, columns=columns, start=start, end=end)
+    df.index = df.index.tz_convert('MST').tz_localize(None)
+    df = df.bfill()
+
+    # Find DRA tags
+    DRA_Q_tags = []
+    DRA_MOV_tags = []
+    other_DRA_related_tags = []
+    pipeline_Q_tags = []
+    for tag_name in df.columns:
+        if 'DRA-Q' in tag_name:
+            DRA_Q_tags.append(tag_name)
+        elif 'DRA-MOV' in tag_name:
+            DRA_MOV_tags.append(tag_name)
+        elif 'DRA' in tag_name:
+            other_DRA_related_tags.append(tag_name)
+        elif (tag_name[-4:] == 'A0-Q') or (tag_name[-4:] == 'B0-Q'):
+            pipeline_Q_tags.append(tag_name)
+
+    if len(other_DRA_related_tags) != 0:
+        raise(ValueError('Unexpected DRA tag name found:/n%s'%(other_DRA_related_tags)))
+    for DRA_Q_tag in DRA_Q_tags:
+        if DRA_Q_tag.replace('Q', 'MOV') not in DRA_MOV_tags:
+            raise(ValueError('MOV tag associated with %s not found.'%(DRA_Q_tag)))
+    for DRA_Q_tag in DRA_Q_tags:
+        if DRA_Q_tag.replace('DRA-Q', 'Q') not in pipeline_Q_tags:
+            raise(ValueError('Mainline flowrate tag associated with %s not found.'%(DRA_Q_tag)))
+
+    # Get PPM
+    df_result = df.loc[:,DRA_Q_tags]
+    for DRA_Q_tag in DRA_Q_tags:
+        pipeline_Q_tag = DRA_Q_tag.replace('DRA-Q', 'Q')
+        df_result[DRA_Q_tag.replace('Q', 'ppm')] = df.loc[:, DRA_Q_tag] / df.loc[:, pipeline_Q_tag] * 1000
+
+    return(df_result)
+
+def get_HRDSY_painted_properties(path_to_painted_data, path_to_PI_data=path_to_PI_data):
+    # Read data, from the painted store written by Property_painting or a legacy pickle
+    df = read_pi_data(path_to_painted_data, columns=['Q'] + painted_fields)
+    if df.index.tz is not None:
+        df.index = df.index.tz_convert('MST').tz_localize(None)
+
+    # DRA injected at Hardisty, as get_DRA_concentrations computes it, held between its samples
+    df_DRA = get_DRA_concentrations(path_to_PI_data, start=df.index[0].tz_localize('MST'), end=df.index[-1].tz_localize('MST'))
+    df['DRA_ppm'] = df_DRA[DRA_ppm_column].reindex(df.index, method='ffill')
     
-    return(df.loc[:, ['Q', 'rho_painted', 'mu_painted', 'Tref_painted']])
+    return(df)
     
 def get_pipe_geometry(path_to_model, from_loc, to_loc, dx):
     
-    # Read model    
-    KS = sps_interface.model(path_to_model)
+    # Read model, from the compiled snapshot if the model CSV files did not change, or from sps_interface
+    # if the snapshot's paths differ from it
+    KS = load_model(path_to_model, fallback=True)
     L = KS.get_path_length(from_loc, to_loc)*1000
     nx = int(L // dx)
     x = np.linspace(0,L,nx)
@@ -33,48 +92,61 @@ def get_pipe_geometry(path_to_model, from_loc, to_loc, dx):
     return(L,dx,IA)
     
 def build_advection_velocity(df_Q, L):
-    Q_dict = {}
-    df_Q[df_Q<0] = 0
-    t = np.array(df_Q.index.to_pydatetime(), dtype=np.datetime64)
-    for idx, ti in enumerate(range(len(t))):
-        Q_dict[t[ti]] =  {'Q':np.array([df_Q[t[ti]]/3600, df_Q[t[ti]]/3600]), 'Q_x':np.array([0, L])}
-    return(Q_dict)
-    
-    
+    # Flow in m3/s at both ends of the path, negative flow is treated as no flow. A missing flow holds the
+    # previous flow as a NaN inlet value does in BatchedAdvection.solve, and is no flow before the first flow.
+    n_missing = int(df_Q.isna().sum())
+    if n_missing:
+        print('WARNING: %d missing flow values from %s, holding the previous flow' % (n_missing, df_Q.index[df_Q.isna().to_numpy()][0]))
+    Q = np.maximum(df_Q.ffill().fillna(0).to_numpy(dtype=np.float64), 0) / 3600
+    t = df_Q.index.to_numpy(dtype='datetime64[ns]')
+    return(FlowProfile(t, np.column_stack([Q, Q]), np.array([0, L])))
+
+def flow_profile_dict(flow, t):
+    # The Q_dict of pipeline_simulation.Advection, the flow 'Q' at the locations 'Q_x' keyed by the data times t
+    return({ti: {'Q': flow.Q[i], 'Q_x': flow.Q_x} for i, ti in enumerate(t)})
+
 def start_instance(instance, **kwargs):
     instance.solve(**kwargs)
+
+def run_pipeline_simulation(L, dx, IA, flow, df, t):
+    # The production solver, one pipeline_simulation.Advection process per field writing its own result files
+    from pipeline_simulation import Advection
+    Q_dict = flow_profile_dict(flow, t)
+    processes = []
+    for field in fields:
+        kwargs = {'Q_dict':Q_dict, 'a_x0_t':df.loc[:, field].bfill().values, 't':t, 'initialize':True, 'a_t0':999, 'a_t0_x':None, 't0':t[0], 'method':'flux limiter', 'limiter_function':'generalized_minmod', 'print_msgs':['ERROR', 'WARNING'], 'write_result':True, 'case_name':field.replace('_painted', ''), 'data_file_size':data_file_size}
+        p = Process(target=start_instance, args=(Advection(L,dx,IA),), kwargs=kwargs)
+        processes.append(p)
+        p.start()
+    for p in processes:
+        p.join()
+    
     
 if __name__ == '__main__':
     print('Get HRDSY properties')
-    df = get_HRDSY_painted_properties('../output/df_HRDSY.pkl')
+    df = get_HRDSY_painted_properties('../output/painted/HRDSY')
     
     print('Get pipe geometry')
-    L, dx, IA = get_pipe_geometry(r'C:\Users\Zixiang.Chen\development\sps_interface\sample_model', 'TAKE_HRDSY_REC', 'HF_STLCT', 100)
+    L, dx, IA = get_pipe_geometry(r'..\sps_model', 'TAKE_HRDSY_REC', 'HF_STLCT', 100)
 
     print(np.min(IA['IA']))
     
     print('Preparing for simulation')
-    Q_dict =  build_advection_velocity(df.loc[:, 'Q'], L)
+    flow = build_advection_velocity(df.loc[:, 'Q'], L)
     
     t = np.array(df.index.to_pydatetime(), dtype=np.datetime64)
-    
-    instances = [
-        Advection(L,dx,IA),
-        Advection(L,dx,IA),
-        Advection(L,dx,IA)
-    ]
-    
-    kwargs_list = [
-        {'Q_dict':Q_dict, 'a_x0_t':df.loc[:, 'rho_painted'].bfill().values, 't':t, 'initialize':True, 'a_t0':999, 'a_t0_x':None, 't0':t[0], 'method':'flux limiter', 'limiter_function':'generalized_minmod', 'print_msgs':['ERROR', 'WARNING'], 'write_result':True, 'case_name':'rho', 'data_file_size':1e9},
-        {'Q_dict':Q_dict, 'a_x0_t':df.loc[:, 'mu_painted'].bfill().values,  't':t, 'initialize':True, 'a_t0':999, 'a_t0_x':None, 't0':t[0], 'method':'flux limiter', 'limiter_function':'generalized_minmod', 'print_msgs':['ERROR', 'WARNING'], 'write_result':True, 'case_name':'mu', 'data_file_size':1e9},
-        {'Q_dict':Q_dict, 'a_x0_t':df.loc[:, 'Tref_painted'].bfill().values,  't':t, 'initialize':True, 'a_t0':999, 'a_t0_x':None, 't0':t[0], 'method':'flux limiter', 'limiter_function':'generalized_minmod', 'print_msgs':['ERROR', 'WARNING'], 'write_result':True, 'case_name':'Tref', 'data_file_size':1e9},
-    ]
-    
-    processes = []
-    for instance, kwargs in zip(instances, kwargs_list):
-        p = Process(target=start_instance, args=(instance,), kwargs=kwargs)
-        processes.append(p)
-        p.start()
-    
-    for p in processes:
-        p.join()
+
+    if solver == 'pipeline_simulation':
+        run_pipeline_simulation(L, dx, IA, flow, df, t)
+    else:
+        # One solve for every field, they share the flow, grid and time steps
+        advection = BatchedAdvection(L, dx, IA)
+        store = open_result_store(result_dir, advection.x, fields)
+        windows = solve_windows(advection, flow, df.loc[:, fields].bfill().values, t, window, checkpoint_path=checkpoint_path,
+                                a_t0=999, a_t0_x=None, method='flux limiter', limiter_function='generalized_minmod',
+                                print_msgs=['ERROR', 'WARNING'], record_every=record_every, result=store)
+        for t_start, t_end, _ in windows:
+            # Records are flushed before the window's checkpoint is written
+            store.flush()
+            print('Saved %s to %s, %d linefills in %s' % (t_start, t_end, store.n_rows, result_dir))
+        store.close()
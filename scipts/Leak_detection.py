@@ -0,0 +1,258 @@
+import numpy as np
+import pandas as pd
+from PI_data_store import pi_data_columns, read_pi_data
+from SPS_model_cache import load_model
+
+path_to_PI_data = r"..\data\PI_data_for_linefill_all"
+path_to_model = r"..\sps_model"
+result_path = r"..\output\mass_balance.pkl"
+sample_period = 60 # s, the interval the engine steps at, the period of the PI data store
+leak_windows = [300, 1800, 3600, 7200] # s, averaging windows evaluated together
+flow_uncertainty = 0.01 # flow meter uncertainty as a fraction of the flow
+linepack_uncertainty = 1 # fraction of the compressibility linepack swing left unexplained without a linepack estimate
+linepack_estimate_uncertainty = 0.08 # the same with a linepack estimate, see notes/Leak_detection_using_SPS.md
+delta_P = 5e6 # Pa, operating pressure range of a segment
+bulk_modulus = 1e9 # Pa
+reference_density = 1000 # kg/m3, converts mass imbalance to volume
+n_sigma = 3 # alarm threshold in standard deviations of the leak-free imbalance
+min_valid_fraction = 0.8 # windows with fewer valid samples than this fraction report NaN
+# Segments bounded by metered stations. Every inlet and outlet is a (flow tag in m3/h, density tag in kg/m3) pair,
+# 'path' gives the SPS path of the segment volume and 'linepack' an optional linepack tag in kg.
+# A segment must be closed: the Patoka and Cushing legs split downstream of the Steele City A0 meter, so
+# Hardisty to Steele City is bounded by the two station meters with only the DRA takes in between.
+leak_segments = [
+    {
+        'name': 'HRDSY_STLCT',
+        'inlets': [('HRDSY-A0-Q', 'HRDSY-A0-DEN')],
+        'outlets': [('STLCT-A0-Q', 'STLCT-A0-DEN')],
+        'path': ('TAKE_HRDSY_REC', 'HF_STLCT'),
+        'linepack': None,
+    },
+]
+
+
+def path_volume(model, from_loc, to_loc):
+    """Get the inner volume of an SPS path.
+
+    Args:
+        model (CompiledModel): The SPS model, as returned by load_model.
+        from_loc (str): The element or node the path starts at.
+        to_loc (str): The element or node the path ends at.
+    Returns:
+        float: The volume in m3 of the pipes and headers along the path.
+    Raises:
+        ValueError: If there is no path from from_loc to to_loc.
+    """
+    path = model.path(from_loc, to_loc)
+    pipes = path['end'] > path['start']
+    return float(np.sum(np.pi / 4 * (path['diameter'][pipes] / 1000) ** 2 * (path['end'] - path['start'])[pipes] * 1000))
+
+
+class MassBalanceEngine:
+    def __init__(self, segments, volumes, windows=leak_windows, sample_period=sample_period):
+        """Set up a streaming mass balance of many segments over many averaging windows at once.
+
+        Each sample gives the net mass flow m_in - m_out of every segment and the flow of every meter.
+        They are kept in a ring buffer as long as the longest window, and each window keeps running sums
+        that add the new sample and subtract the sample leaving the window, so a sample costs the same for
+        every window length. The sums are recomputed from the ring buffer each time it wraps, so rounding
+        errors do not accumulate. update takes one sample, for live input, and replay feeds historical data
+        through update.
+
+        Args:
+            segments (list): Dicts with the segment 'name', 'inlets' and 'outlets' as lists of (flow tag in m3/h,
+                density tag in kg/m3), and an optional 'linepack' tag in kg, as leak_segments.
+            volumes (dict): The volume in m3 of each segment, keyed by name, for the linepack term of the threshold.
+            windows (list): The averaging windows in s, multiples of sample_period.
+            sample_period (float): The sampling interval in s.
+        Returns:
+            None
+        Raises:
+            ValueError: If a window is shorter than sample_period.
+        """
+        self.segments = segments
+        self.names = [segment['name'] for segment in segments]
+        self.windows = list(windows)
+        self.sample_period = sample_period
+        self.n_samples = np.array([int(round(window / sample_period)) for window in self.windows])
+        if np.any(self.n_samples < 1):
+            raise ValueError('Windows must be at least one sample period long')
+
+        tags = []
+        meters = []
+        for s, segment in enumerate(segments):
+            for sign, meter_list in [(1.0, segment['inlets']), (-1.0, segment['outlets'])]:
+                for Q_tag, rho_tag in meter_list:
+                    meters.append((s, sign, Q_tag, rho_tag))
+                    tags += [Q_tag, rho_tag]
+            if segment.get('linepack') is not None:
+                tags.append(segment['linepack'])
+        self.tags = list(dict.fromkeys(tags))
+        self.meter_segment = np.array([meter[0] for meter in meters], dtype=int)
+        self.meter_sign = np.array([meter[1] for meter in meters])
+        self.meter_Q = np.array([self.tags.index(meter[2]) for meter in meters], dtype=int)
+        self.meter_rho = np.array([self.tags.index(meter[3]) for meter in meters], dtype=int)
+        self.has_linepack = np.array([segment.get('linepack') is not None for segment in segments])
+        self.linepack_columns = np.array([self.tags.index(segment['linepack']) if segment.get('linepack') is not None else 0
+                                          for segment in segments], dtype=int)
+
+        n_segments = len(segments)
+        # Leak-free imbalance variance in m3^2 from the linepack swing of a compressible fluid, per notes/Leak_detection_using_SPS.md
+        swing = np.array([volumes[name] * (np.exp(delta_P / bulk_modulus) - 1) for name in self.names])
+        swing *= np.where(self.has_linepack, linepack_estimate_uncertainty, linepack_uncertainty)
+        self.linepack_variance = 2 * swing ** 2
+        # Ring buffer columns: net mass flow of each segment in kg/s, flow of each meter in m3/s, linepack in kg
+        self.n_columns = 2 * n_segments + len(meters)
+        self.ring_length = int(self.n_samples.max()) + 1
+        self.ring = np.zeros((self.ring_length, self.n_columns))
+        self.ring_valid = np.zeros((self.ring_length, self.n_columns), dtype=bool)
+        self.sums = np.zeros((len(self.windows), self.n_columns))
+        self.counts = np.zeros((len(self.windows), self.n_columns))
+        self.k = 0
+        self.t = None
+
+    def _columns(self, values):
+        Q = values[self.meter_Q] / 3600
+        mass_flow = self.meter_sign * Q * values[self.meter_rho]
+        net_mass_flow = np.zeros(len(self.segments))
+        np.add.at(net_mass_flow, self.meter_segment, mass_flow)
+        # A segment is missing if any of its meters is missing
+        missing = np.zeros(len(self.segments), dtype=bool)
+        np.logical_or.at(missing, self.meter_segment, np.isnan(mass_flow))
+        net_mass_flow[missing] = np.nan
+        linepack = np.where(self.has_linepack, values[self.linepack_columns], np.nan)
+        return np.concatenate([net_mass_flow, Q, linepack])
+
+    def _resync(self):
+        for i, n in enumerate(self.n_samples):
+            rows = (self.k - np.arange(n)) % self.ring_length
+            self.sums[i] = self.ring[rows].sum(axis=0)
+            self.counts[i] = self.ring_valid[rows].sum(axis=0)
+
+    def step(self, values):
+        """Advance the engine by one sample period.
+
+        Args:
+            values (np.ndarray): The value of each tag of self.tags, NaN for a missing sample.
+        Returns:
+            dict: Arrays of shape (n_windows, n_segments): the 'imbalance' m_in - m_out - dM/dt averaged over
+                each window in m3/h at reference_density, the 'threshold' in m3/h and the 'alarm' flags.
+        Raises:
+            None
+        """
+        x = self._columns(np.asarray(values, dtype=np.float64))
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, 0)
+        self.k += 1
+        row = self.k % self.ring_length
+        self.ring[row] = x
+        self.ring_valid[row] = valid
+        leaving = (self.k - self.n_samples) % self.ring_length
+        self.sums += x - self.ring[leaving]
+        self.counts += valid.astype(float) - self.ring_valid[leaving]
+        if row == 0:
+            self._resync()
+        return self.evaluate()
+
+    def evaluate(self):
+        """Evaluate the imbalance and alarm threshold of every window and segment from the running sums.
+
+        Args:
+            None
+        Returns:
+            dict: As returned by step.
+        Raises:
+            None
+        """
+        n_segments = len(self.segments)
+        n_meters = len(self.meter_sign)
+        T = self.n_samples[:, None] * self.sample_period
+        enough = self.counts >= min_valid_fraction * self.n_samples[:, None]
+        means = np.where(enough, self.sums / np.maximum(self.counts, 1), np.nan)
+        net_mass_flow = means[:, :n_segments]
+
+        # Linepack change over each window, from the linepack now and one window ago
+        linepack = self.ring[self.k % self.ring_length, n_segments + n_meters:]
+        lagged_rows = (self.k - self.n_samples) % self.ring_length
+        lagged = self.ring[lagged_rows][:, n_segments + n_meters:]
+        linepack_valid = self.ring_valid[self.k % self.ring_length, n_segments + n_meters:] & self.ring_valid[lagged_rows][:, n_segments + n_meters:]
+        dM_dt = np.where(self.has_linepack, np.where(linepack_valid, (linepack - lagged) / T, np.nan), 0)
+        imbalance = (net_mass_flow - dM_dt) / reference_density * 3600
+
+        # Threshold from the volume error of each meter summed over the window, at its mean flow, and the linepack term
+        meter_variance = (flow_uncertainty * means[:, n_segments:n_segments + n_meters] * self.sample_period) ** 2 * self.n_samples[:, None]
+        segment_variance = np.zeros((len(self.windows), n_segments))
+        for m, s in enumerate(self.meter_segment):
+            segment_variance[:, s] += meter_variance[:, m]
+        threshold = n_sigma * np.sqrt(segment_variance + self.linepack_variance) / T * 3600
+        return {'imbalance': imbalance, 'threshold': threshold, 'alarm': imbalance > threshold}
+
+    def update(self, t, values):
+        """Feed the sample at one time, stepping over missing sample periods since the previous sample.
+
+        Args:
+            t (datetime): The time of the sample.
+            values (dict or np.ndarray): The value of each tag, keyed by tag or in the order of self.tags.
+        Returns:
+            dict: As returned by step.
+        Raises:
+            KeyError: If a tag is missing from values.
+        """
+        if isinstance(values, dict):
+            values = np.array([values[tag] for tag in self.tags], dtype=np.float64)
+        t = pd.Timestamp(t)
+        if self.t is not None:
+            n_missing = int(round((t - self.t).total_seconds() / self.sample_period)) - 1
+            for _ in range(min(max(n_missing, 0), self.ring_length)):
+                self.step(np.full(len(self.tags), np.nan))
+        self.t = t
+        return self.step(values)
+
+    def replay(self, df):
+        """Run historical data through the engine, as if each row arrived live.
+
+        Args:
+            df (pd.DataFrame): The tags of self.tags indexed by time, on the sample_period grid.
+        Returns:
+            pd.DataFrame: The imbalance, threshold and alarm of each window and segment at each time, with
+                (segment, window in s, quantity) columns.
+        Raises:
+            KeyError: If a tag is not in df.
+        """
+        values = df.loc[:, self.tags].to_numpy(dtype=np.float64)
+        quantities = ['imbalance', 'threshold', 'alarm']
+        results = np.empty((len(df), len(quantities), len(self.windows), len(self.segments)))
+        for i, t in enumerate(df.index):
+            result = self.update(t, values[i])
+            for q, quantity in enumerate(quantities):
+                results[i, q] = result[quantity]
+        df_result = pd.DataFrame({
+            (name, window, quantity): results[:, q, w, s].astype(bool) if quantity == 'alarm' else results[:, q, w, s]
+            for s, name in enumerate(self.names) for w, window in enumerate(self.windows) for q, quantity in enumerate(quantities)
+        }, index=df.index)
+        df_result.columns.names = ['segment', 'window', 'quantity']
+        return df_result
+
+
+if __name__ == '__main__':
+    KS = load_model(path_to_model)
+    volumes = {segment['name']: path_volume(KS, *segment['path']) for segment in leak_segments}
+    engine = MassBalanceEngine(leak_segments, volumes)
+
+    # Every meter tag must be in the PI data, a tag missing from PI_tag_for_linefill.csv fails before the replay
+    available_tags = pi_data_columns(path_to_PI_data)
+    tag_not_found_list = [tag for tag in engine.tags if tag not in available_tags]
+    if tag_not_found_list != []:
+        raise ValueError('These tags of leak_segments are not found in %s:\n%s' % (path_to_PI_data, '\n'.join(tag_not_found_list)))
+
+    print('Read %s' % path_to_PI_data)
+    df = read_pi_data(path_to_PI_data, columns=engine.tags)
+    df = df.resample('%ds' % sample_period).mean()
+
+    print('Replay %d samples' % len(df))
+    df_result = engine.replay(df)
+    df_result.to_pickle(result_path)
+    for name in engine.names:
+        for window in engine.windows:
+            n_alarms = int(df_result[(name, window, 'alarm')].astype(bool).sum())
+            print('%s %d s window: %d samples in alarm' % (name, window, n_alarms))
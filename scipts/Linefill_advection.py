@@ -0,0 +1,818 @@
+import os
+import numpy as np
+from collections import deque
+from multiprocessing import shared_memory
+
+cfl_max = 0.9 # largest Courant number of a solver sub-step
+minmod_theta = 1.5 # generalized minmod parameter, 1 is minmod and 2 is the monotonized central limiter
+
+
+def generalized_minmod(r, theta=minmod_theta):
+    """Generalized minmod flux limiter.
+
+    Args:
+        r (np.ndarray): The ratio of consecutive gradients.
+        theta (float): The limiter parameter between 1 and 2.
+    Returns:
+        np.ndarray: The limiter value.
+    Raises:
+        None
+    """
+    return np.maximum(0, np.minimum(np.minimum(theta * r, (1 + r) / 2), theta))
+
+
+def minmod(r):
+    """Minmod flux limiter, see generalized_minmod."""
+    return generalized_minmod(r, 1)
+
+
+def van_leer(r):
+    """Van Leer flux limiter, see generalized_minmod."""
+    return (r + np.abs(r)) / (1 + np.abs(r))
+
+
+limiter_functions = {
+    'generalized_minmod': generalized_minmod,
+    'minmod': minmod,
+    'van_leer': van_leer,
+}
+
+
+def write_checkpoint(path, **arrays):
+    """Write arrays to an npz checkpoint, replacing the previous checkpoint only once the new one is complete.
+
+    Args:
+        path (str): The checkpoint file.
+        **arrays: The arrays saved.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path, engine):
+    """Read an npz checkpoint written by an advection engine.
+
+    Args:
+        path (str): The checkpoint file.
+        engine (str): The class name of the engine loading the checkpoint.
+    Returns:
+        dict: The saved arrays.
+    Raises:
+        FileNotFoundError: If the checkpoint does not exist.
+        ValueError: If the checkpoint was written by another engine.
+    """
+    with np.load(path) as checkpoint:
+        arrays = {key: checkpoint[key] for key in checkpoint.files}
+    if str(arrays['engine']) != engine:
+        raise ValueError('%s is a %s checkpoint, not %s' % (path, arrays['engine'], engine))
+    return arrays
+
+
+class FlowProfile:
+    def __init__(self, t, Q, Q_x):
+        """Hold the flow along a path at every data time as arrays.
+
+        Args:
+            t (np.ndarray): The datetime64 times, in time order.
+            Q (np.ndarray): The flow in m3/s, shape (len(t), len(Q_x)).
+            Q_x (np.ndarray): The locations of the flow in m.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.t = np.asarray(t).astype('datetime64[ns]')
+        self.Q = np.asarray(Q, dtype=np.float64)
+        self.Q_x = np.asarray(Q_x, dtype=np.float64)
+        self.shm = None
+
+    def rows(self, t):
+        """Find the rows of times.
+
+        Args:
+            t (np.ndarray): datetime64 times that are in the profile.
+        Returns:
+            np.ndarray: The row of each time.
+        Raises:
+            KeyError: If a time is not in the profile.
+        """
+        t = np.asarray(t).astype('datetime64[ns]')
+        rows = np.minimum(np.searchsorted(self.t, t), len(self.t) - 1)
+        if len(t) and (len(self.t) == 0 or np.any(self.t[rows] != t)):
+            raise KeyError('Times not found in the flow profile')
+        return rows
+
+    def to_shared_memory(self):
+        """Copy the profile to a shared memory block that other processes can attach to without copying.
+
+        The block stays allocated until close is called on this profile with unlink=True.
+
+        Args:
+            None
+        Returns:
+            dict: A small picklable description of the block, for FlowProfile.from_shared_memory.
+        Raises:
+            None
+        """
+        n_t, n_x = self.Q.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(8 * (n_t + n_t * n_x + n_x), 1))
+        description = {'name': self.shm.name, 'n_t': n_t, 'n_x': n_x}
+        t, Q, Q_x = FlowProfile._views(self.shm, n_t, n_x)
+        t[:] = self.t.view(np.int64)
+        Q[:] = self.Q
+        Q_x[:] = self.Q_x
+        return description
+
+    @staticmethod
+    def _views(shm, n_t, n_x):
+        t = np.ndarray((n_t,), dtype=np.int64, buffer=shm.buf)
+        Q = np.ndarray((n_t, n_x), dtype=np.float64, buffer=shm.buf, offset=8 * n_t)
+        Q_x = np.ndarray((n_x,), dtype=np.float64, buffer=shm.buf, offset=8 * (n_t + n_t * n_x))
+        return t, Q, Q_x
+
+    @classmethod
+    def from_shared_memory(cls, description):
+        """Attach to a profile copied to shared memory by to_shared_memory.
+
+        Args:
+            description (dict): As returned by to_shared_memory.
+        Returns:
+            FlowProfile: A profile whose arrays are views of the shared block.
+        Raises:
+            FileNotFoundError: If the block does not exist.
+        """
+        shm = shared_memory.SharedMemory(name=description['name'])
+        t, Q, Q_x = cls._views(shm, description['n_t'], description['n_x'])
+        profile = cls(t.view('datetime64[ns]'), Q, Q_x)
+        profile.shm = shm
+        return profile
+
+    def close(self, unlink=False):
+        """Release the shared memory block of the profile, if any.
+
+        Args:
+            unlink (bool): If True, also free the block. Only the process that created it should unlink it.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if self.shm is not None:
+            self.t = self.t.copy()
+            self.Q = self.Q.copy()
+            self.Q_x = self.Q_x.copy()
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+            self.shm = None
+
+
+class ResultBuffer:
+    def __init__(self):
+        """Collect the recorded states of a solve in memory.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.t = []
+        self.a = []
+
+    def append(self, t, a):
+        """Record the state at one time.
+
+        Args:
+            t (np.datetime64): The time of the state.
+            a (np.ndarray): The cell values, shape (n_cells, n_fields).
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.t.append(t)
+        self.a.append(a.copy())
+
+    def arrays(self):
+        """Get the recorded states as arrays.
+
+        Args:
+            None
+        Returns:
+            tuple: The times, and the cell values with shape (n_times, n_cells, n_fields).
+        Raises:
+            None
+        """
+        return np.array(self.t, dtype='datetime64[ns]'), np.stack(self.a) if self.a else np.empty((0, 0, 0))
+
+    def truncate(self, t):
+        """Drop the states recorded after a time.
+
+        Args:
+            t (np.datetime64): The time of the last state kept.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.truncate_rows(int(np.searchsorted(np.array(self.t, dtype='datetime64[ns]'), np.datetime64(t, 'ns'), side='right')))
+
+    def truncate_rows(self, n_rows):
+        """Keep the first n_rows recorded states and drop the others.
+
+        Args:
+            n_rows (int): The number of states kept.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        del self.t[n_rows:]
+        del self.a[n_rows:]
+
+
+class BatchedAdvection:
+    def __init__(self, L, dx, IA):
+        """Set up a finite-volume advection solver along a pipe path for several scalar fields at once.
+
+        Every field, e.g. density, viscosity, reference temperature and DRA concentration, is a column of one
+        (n_cells, n_fields) array. The flow, time steps, Courant numbers and limiter ratios are shared, so
+        an extra field costs one more column instead of another solve.
+
+        Args:
+            L (float): The length of the path in m.
+            dx (float): The cell length in m.
+            IA (dict): The inner area of the path, 'IA' in m2 at the locations 'IA_x' in m, as returned by
+                get_pipe_geometry.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.L = L
+        self.dx = dx
+        self.x = np.arange(0.5 * dx, L, dx)
+        self.x_faces = np.concatenate([[0], 0.5 * (self.x[1:] + self.x[:-1]), [L]])
+        self.area = np.interp(self.x, IA['IA_x'], IA['IA'])
+        self.volume = self.area * np.diff(self.x_faces)
+        self.a = None
+        self.t = None
+        self.a_in = None
+        self.n_steps = 0
+
+    def initialize(self, a_t0, a_t0_x=None, n_fields=1):
+        """Set the initial cell values.
+
+        Args:
+            a_t0 (float or np.ndarray): A value for all fields, one value per field, or values at a_t0_x with
+                shape (len(a_t0_x), n_fields).
+            a_t0_x (np.ndarray): The locations in m of a_t0, None if a_t0 is uniform.
+            n_fields (int): The number of fields.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if a_t0_x is None:
+            self.a = np.empty((len(self.x), n_fields))
+            self.a[:] = np.broadcast_to(np.asarray(a_t0, dtype=np.float64), (n_fields,))
+        else:
+            a_t0 = np.asarray(a_t0, dtype=np.float64).reshape(len(a_t0_x), -1)
+            self.a = np.column_stack([np.interp(self.x, a_t0_x, a_t0[:, i]) for i in range(a_t0.shape[1])])
+        self.a_in = self.a[0].copy()
+        self.n_steps = 0
+
+    def save_checkpoint(self, path):
+        """Save the full solver state, so a later solve with initialize=False continues from it.
+
+        Args:
+            path (str): The checkpoint file, replaced atomically.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        write_checkpoint(path, engine='BatchedAdvection', x=self.x, a=self.a, a_in=self.a_in,
+                         t=np.datetime64(self.t, 'ns'), n_steps=self.n_steps)
+
+    def load_checkpoint(self, path):
+        """Restore the solver state saved by save_checkpoint.
+
+        Args:
+            path (str): The checkpoint file.
+        Returns:
+            np.datetime64: The time of the state.
+        Raises:
+            FileNotFoundError: If the checkpoint does not exist.
+            ValueError: If the checkpoint is not from a BatchedAdvection with the same cells.
+        """
+        checkpoint = read_checkpoint(path, 'BatchedAdvection')
+        if not np.array_equal(checkpoint['x'], self.x):
+            raise ValueError('%s was saved on a different grid' % path)
+        self.a = checkpoint['a']
+        self.a_in = checkpoint['a_in']
+        self.t = checkpoint['t'][()]
+        self.n_steps = int(checkpoint['n_steps'])
+        return self.t
+
+    def face_flows(self, Q, Q_x):
+        """Interpolate a flow profile to the cell faces.
+
+        Args:
+            Q (np.ndarray): The flow in m3/s at the locations Q_x, negative flow is treated as no flow.
+            Q_x (np.ndarray): The locations of Q in m.
+        Returns:
+            np.ndarray: The flow at each face, shape (n_cells + 1, 1).
+        Raises:
+            None
+        """
+        return np.maximum(np.interp(self.x_faces, Q_x, Q), 0)[:, None]
+
+    def step(self, Q_faces, dt, a_in, limiter):
+        """Advance the cell values by one sub-step.
+
+        Face values are reconstructed upwind with a TVD flux limiter. The update is written so a uniform
+        field stays uniform when the flow varies along the path.
+
+        Args:
+            Q_faces (np.ndarray): The flow at each face in m3/s, shape (n_cells + 1, 1).
+            dt (float): The sub-step in s, with Q_faces * dt / volume <= 1.
+            a_in (np.ndarray): The values flowing in at x=0, one per field.
+            limiter (callable): The flux limiter, None for first order upwind.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        a = self.a
+        a_in = a_in[None, :]
+        up = a[:-1]
+        delta = a[1:] - up
+        if limiter is None or len(a) < 2:
+            face_interior = up
+        else:
+            upup = np.vstack([a_in, a[:-2]])
+            r = np.divide(up - upup, delta, out=np.zeros_like(delta), where=delta != 0)
+            courant = Q_faces[1:-1] * dt / self.volume[:-1, None]
+            face_interior = up + 0.5 * limiter(r) * (1 - courant) * delta
+        faces = np.vstack([a_in, face_interior, a[-1:]])
+        a += dt / self.volume[:, None] * (Q_faces[:-1] * (faces[:-1] - a) - Q_faces[1:] * (faces[1:] - a))
+
+    def solve(self, Q_dict, a_x0_t, t, initialize=True, a_t0=None, a_t0_x=None, t0=None, method='flux limiter',
+              limiter_function='generalized_minmod', print_msgs=('ERROR', 'WARNING'), result=None, record_every=1,
+              checkpoint_path=None, checkpoint_every=None):
+        """Advect the fields through the data times.
+
+        Between t[k] and t[k+1] the flow Q_dict[t[k]] and the inlet values a_x0_t[k] are held, and the
+        interval is split into the fewest sub-steps with a Courant number below cfl_max. To continue a run
+        with later data, call solve again with initialize=False, or load_checkpoint first in a new process.
+
+        Args:
+            Q_dict (FlowProfile or dict): The flow at each time of t, as returned by build_advection_velocity,
+                or a dict of {'Q': flow in m3/s, 'Q_x': locations in m} keyed by each time of t.
+            a_x0_t (np.ndarray): The inlet values at each time of t, shape (len(t),) or (len(t), n_fields).
+                A NaN inlet value holds the previous inlet value.
+            t (np.ndarray): The datetime64 times of the data.
+            initialize (bool): If True, start from a_t0, else continue from the current state.
+            a_t0 (float or np.ndarray): The initial values, see initialize.
+            a_t0_x (np.ndarray): The locations of a_t0, None if a_t0 is uniform.
+            t0 (np.datetime64): Data before t0 is skipped. None to start at t[0].
+            method (str): 'flux limiter' or 'upwind'.
+            limiter_function (str): A key of limiter_functions, used by the 'flux limiter' method.
+            print_msgs (list): The message levels printed, of 'ERROR', 'WARNING' and 'INFO'.
+            result (object): Receives result.append(time, cell values) at the recorded times. A new
+                ResultBuffer if None.
+            record_every (int): The state is recorded every record_every data steps since initialization,
+                and at initialization, so continued solves do not record a time twice.
+            checkpoint_path (str): The file save_checkpoint writes to at the end of the solve, None for no
+                checkpoint.
+            checkpoint_every (int): Also checkpoint every checkpoint_every data steps since initialization.
+        Returns:
+            object: result.
+        Raises:
+            ValueError: If method or limiter_function is unknown.
+            KeyError: If a time of t is not in Q_dict.
+        """
+        if method == 'flux limiter':
+            if limiter_function not in limiter_functions:
+                raise ValueError('Unknown limiter function %s' % limiter_function)
+            limiter = limiter_functions[limiter_function]
+        elif method == 'upwind':
+            limiter = None
+        else:
+            raise ValueError('Unknown method %s' % method)
+        a_x0_t = np.asarray(a_x0_t, dtype=np.float64)
+        if a_x0_t.ndim == 1:
+            a_x0_t = a_x0_t[:, None]
+        t = np.asarray(t)
+        if result is None:
+            result = ResultBuffer()
+        t_ns = t.astype('datetime64[ns]')
+        first = 0 if t0 is None else int(np.searchsorted(t_ns, np.datetime64(t0, 'ns')))
+        if initialize or self.a is None:
+            self.initialize(a_t0, a_t0_x, a_x0_t.shape[1])
+            self.t = t[first]
+            result.append(t[first], self.a)
+
+        dt_data = np.diff(t_ns).astype(np.float64) / 1e9
+        if isinstance(Q_dict, FlowProfile):
+            flow_rows = Q_dict.rows(t_ns)
+        nan_warned = False
+        for k in range(first, len(t) - 1):
+            inlet = a_x0_t[k]
+            if np.isnan(inlet).any():
+                if not nan_warned and 'WARNING' in print_msgs:
+                    print('WARNING: NaN inlet value at %s, holding the previous inlet value' % t[k])
+                    nan_warned = True
+                inlet = np.where(np.isnan(inlet), self.a_in, inlet)
+            self.a_in = inlet
+
+            if isinstance(Q_dict, FlowProfile):
+                Q_faces = self.face_flows(Q_dict.Q[flow_rows[k]], Q_dict.Q_x)
+            else:
+                Q_faces = self.face_flows(Q_dict[t[k]]['Q'], Q_dict[t[k]]['Q_x'])
+            max_courant = np.max(Q_faces[:-1, 0] * dt_data[k] / self.volume)
+            n_sub = max(int(np.ceil(max_courant / cfl_max)), 1)
+            for _ in range(n_sub):
+                self.step(Q_faces, dt_data[k] / n_sub, inlet, limiter)
+            self.t = t[k + 1]
+            self.n_steps += 1
+            if self.n_steps % record_every == 0:
+                result.append(t[k + 1], self.a)
+            if checkpoint_path is not None and checkpoint_every and self.n_steps % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
+            if 'INFO' in print_msgs and (k - first) % 10000 == 0:
+                print('INFO: %s, %d sub-steps' % (t[k], n_sub))
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
+        return result
+
+    def values_at(self, x):
+        """Get the current field values at locations along the path.
+
+        Args:
+            x (np.ndarray): Locations in m.
+        Returns:
+            np.ndarray: The values, shape (len(x), n_fields).
+        Raises:
+            None
+        """
+        x = np.atleast_1d(x)
+        return np.column_stack([np.interp(x, self.x, self.a[:, i]) for i in range(self.a.shape[1])])
+
+
+class BatchTracker:
+    def __init__(self, L, dx, IA, tolerance=0):
+        """Set up a Lagrangian batch tracker along a pipe path, an alternative to BatchedAdvection.
+
+        The fluid is a queue of batches, each labelled by the cumulative volume injected at the inlet when it
+        entered. A location x holds the fluid injected when the cumulative volume was the current injected
+        volume minus the pipe volume between the inlet and x, so interfaces move without numerical diffusion.
+        A step only appends a batch when the inlet values change and drops the batches that left the path.
+        The flow is taken at the inlet, the fluid is treated as incompressible.
+
+        Args:
+            L (float): The length of the path in m.
+            dx (float): The spacing in m of the locations x recorded by solve, as the cells of BatchedAdvection.
+            IA (dict): The inner area of the path, 'IA' in m2 at the locations 'IA_x' in m, as returned by
+                get_pipe_geometry.
+            tolerance (float or np.ndarray): A new batch starts when an inlet value differs from the last batch
+                by more than this, one value for all fields or one per field.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.L = L
+        self.x = np.arange(0.5 * dx, L, dx)
+        IA_x = np.asarray(IA['IA_x'], dtype=np.float64)
+        IA_area = np.asarray(IA['IA'], dtype=np.float64)
+        self.volume_x = IA_x
+        self.cumulative_volume = np.concatenate([[0], np.cumsum(np.diff(IA_x) * 0.5 * (IA_area[1:] + IA_area[:-1]))])
+        self.total_volume = self.cumulative_volume[-1]
+        self.tolerance = tolerance
+        self.batches = deque()
+        self.injected = 0.0
+        self.t = None
+        self.a_in = None
+        self.n_steps = 0
+
+    def volume_to(self, x):
+        """Get the pipe volume between the inlet and locations.
+
+        Args:
+            x (np.ndarray): Locations in m.
+        Returns:
+            np.ndarray: The volume in m3.
+        Raises:
+            None
+        """
+        return np.interp(x, self.volume_x, self.cumulative_volume)
+
+    def initialize(self, a_t0, a_t0_x=None, n_fields=1):
+        """Fill the path with initial batches.
+
+        Args:
+            a_t0 (float or np.ndarray): A value for all fields, one value per field, or values at a_t0_x with
+                shape (len(a_t0_x), n_fields). Each value holds from its location to the next one downstream.
+            a_t0_x (np.ndarray): The locations in m of a_t0, None if a_t0 is uniform.
+            n_fields (int): The number of fields.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.injected = 0.0
+        self.batches = deque()
+        if a_t0_x is None:
+            values = np.empty(n_fields)
+            values[:] = np.broadcast_to(np.asarray(a_t0, dtype=np.float64), (n_fields,))
+            self.batches.append((-self.total_volume, values))
+        else:
+            a_t0 = np.asarray(a_t0, dtype=np.float64).reshape(len(a_t0_x), -1)
+            volume_ends = np.concatenate([self.volume_to(np.asarray(a_t0_x, dtype=np.float64))[1:], [self.total_volume]])
+            for i in range(len(a_t0_x) - 1, -1, -1):
+                self.batches.append((-volume_ends[i], a_t0[i].copy()))
+        self.a_in = self.batches[-1][1]
+        self.n_steps = 0
+
+    def save_checkpoint(self, path):
+        """Save the batches and the injected volume, so a later solve with initialize=False continues from them.
+
+        Args:
+            path (str): The checkpoint file, replaced atomically.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        write_checkpoint(path, engine='BatchTracker', total_volume=self.total_volume,
+                         starts=np.array([batch[0] for batch in self.batches]),
+                         values=np.array([batch[1] for batch in self.batches]), injected=self.injected,
+                         a_in=self.a_in, t=np.datetime64(self.t, 'ns'), n_steps=self.n_steps)
+
+    def load_checkpoint(self, path):
+        """Restore the state saved by save_checkpoint.
+
+        Args:
+            path (str): The checkpoint file.
+        Returns:
+            np.datetime64: The time of the state.
+        Raises:
+            FileNotFoundError: If the checkpoint does not exist.
+            ValueError: If the checkpoint is not from a BatchTracker with the same path volume.
+        """
+        checkpoint = read_checkpoint(path, 'BatchTracker')
+        if not np.isclose(checkpoint['total_volume'], self.total_volume):
+            raise ValueError('%s was saved for a different path' % path)
+        self.batches = deque(zip(checkpoint['starts'].tolist(), checkpoint['values']))
+        self.injected = float(checkpoint['injected'])
+        self.a_in = checkpoint['a_in']
+        self.t = checkpoint['t'][()]
+        self.n_steps = int(checkpoint['n_steps'])
+        return self.t
+
+    def step(self, Q, dt, a_in):
+        """Inject the fluid of one time step.
+
+        Args:
+            Q (float): The inlet flow in m3/s, negative flow is treated as no flow.
+            dt (float): The time step in s.
+            a_in (np.ndarray): The inlet values, one per field.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if np.any(np.abs(a_in - self.batches[-1][1]) > self.tolerance):
+            self.batches.append((self.injected, a_in.copy()))
+        self.injected += max(Q, 0) * dt
+        # A batch has left when the next batch has passed the outlet
+        while len(self.batches) > 1 and self.injected - self.batches[1][0] >= self.total_volume:
+            self.batches.popleft()
+
+    def values_at(self, x):
+        """Get the current field values at locations along the path.
+
+        Args:
+            x (np.ndarray): Locations in m.
+        Returns:
+            np.ndarray: The values, shape (len(x), n_fields).
+        Raises:
+            None
+        """
+        starts = np.array([batch[0] for batch in self.batches])
+        values = np.array([batch[1] for batch in self.batches])
+        labels = self.injected - self.volume_to(np.atleast_1d(x))
+        return values[np.maximum(np.searchsorted(starts, labels, side='right') - 1, 0)]
+
+    def interfaces(self):
+        """Get the locations of the batch interfaces in the path.
+
+        Args:
+            None
+        Returns:
+            tuple: The interface locations in m from downstream to upstream, and the values of the batch
+                downstream of each interface followed by the values of the newest batch.
+        Raises:
+            None
+        """
+        starts = np.array([batch[0] for batch in self.batches])
+        values = np.array([batch[1] for batch in self.batches])
+        x = np.interp(self.injected - starts[1:], self.cumulative_volume, self.volume_x)
+        return x, values
+
+    def solve(self, Q_dict, a_x0_t, t, initialize=True, a_t0=None, a_t0_x=None, t0=None, print_msgs=('ERROR', 'WARNING'),
+              result=None, record_every=1, checkpoint_path=None, checkpoint_every=None):
+        """Track the batches through the data times, with the inputs of BatchedAdvection.solve.
+
+        Between t[k] and t[k+1] the inlet flow of Q_dict at t[k] and the inlet values a_x0_t[k] are held.
+        The recorded states are the values at the locations x, the cell centres of BatchedAdvection with
+        the same dx, so the results can be compared directly.
+
+        Args:
+            Q_dict (FlowProfile or dict): The flow at each time of t, see BatchedAdvection.solve.
+            a_x0_t (np.ndarray): The inlet values at each time of t, shape (len(t),) or (len(t), n_fields).
+                A NaN inlet value holds the previous inlet value.
+            t (np.ndarray): The datetime64 times of the data.
+            initialize (bool): If True, start from a_t0, else continue from the current state.
+            a_t0 (float or np.ndarray): The initial values, see initialize.
+            a_t0_x (np.ndarray): The locations of a_t0, None if a_t0 is uniform.
+            t0 (np.datetime64): Data before t0 is skipped. None to start at t[0].
+            print_msgs (list): The message levels printed, of 'ERROR', 'WARNING' and 'INFO'.
+            result (object): Receives result.append(time, values at x) at the recorded times. A new
+                ResultBuffer if None.
+            record_every (int): The state is recorded every record_every data steps since initialization,
+                and at initialization.
+            checkpoint_path (str): The file save_checkpoint writes to at the end of the solve, None for no
+                checkpoint.
+            checkpoint_every (int): Also checkpoint every checkpoint_every data steps since initialization.
+        Returns:
+            object: result.
+        Raises:
+            KeyError: If a time of t is not in Q_dict.
+        """
+        a_x0_t = np.asarray(a_x0_t, dtype=np.float64)
+        if a_x0_t.ndim == 1:
+            a_x0_t = a_x0_t[:, None]
+        t = np.asarray(t)
+        if result is None:
+            result = ResultBuffer()
+        t_ns = t.astype('datetime64[ns]')
+        first = 0 if t0 is None else int(np.searchsorted(t_ns, np.datetime64(t0, 'ns')))
+        if initialize or not self.batches:
+            self.initialize(a_t0, a_t0_x, a_x0_t.shape[1])
+            self.t = t[first]
+            result.append(t[first], self.values_at(self.x))
+
+        dt_data = np.diff(t_ns).astype(np.float64) / 1e9
+        # The flow at the first location of the profile, the inlet
+        if isinstance(Q_dict, FlowProfile):
+            inlet_flows = Q_dict.Q[Q_dict.rows(t_ns), 0]
+        else:
+            inlet_flows = np.array([Q_dict[ti]['Q'][0] if k >= first else 0 for k, ti in enumerate(t[:-1])])
+        nan_warned = False
+        for k in range(first, len(t) - 1):
+            inlet = a_x0_t[k]
+            if np.isnan(inlet).any():
+                if not nan_warned and 'WARNING' in print_msgs:
+                    print('WARNING: NaN inlet value at %s, holding the previous inlet value' % t[k])
+                    nan_warned = True
+                inlet = np.where(np.isnan(inlet), self.a_in, inlet)
+            self.a_in = inlet
+            self.step(inlet_flows[k], dt_data[k], inlet)
+            self.t = t[k + 1]
+            self.n_steps += 1
+            if self.n_steps % record_every == 0:
+                result.append(t[k + 1], self.values_at(self.x))
+            if checkpoint_path is not None and checkpoint_every and self.n_steps % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
+            if 'INFO' in print_msgs and (k - first) % 10000 == 0:
+                print('INFO: %s, %d batches' % (t[k], len(self.batches)))
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
+        return result
+
+
+def solve_windows(engine, Q_dict, a_x0_t, t, window, checkpoint_path=None, a_t0=None, a_t0_x=None, record_every=1,
+                  result=None, **solve_kwargs):
+    """Run an advection engine through the data in fixed time windows that continue from each other.
+
+    Each window is one solve continuing from the state at the end of the previous window, so the result is
+    the same as a single solve. If checkpoint_path exists, the run continues from the checkpointed state
+    and skips the data before it, e.g. after a failure or to add a new month of data, otherwise it starts
+    from a_t0 and drops every record of result, so a fresh start overwrites the store. The checkpoint of a window is written when the next window is requested, after the caller
+    has saved the results of the window.
+
+    Args:
+        engine (object): A BatchedAdvection or BatchTracker.
+        Q_dict (FlowProfile or dict): The flow at each time of t, see BatchedAdvection.solve.
+        a_x0_t (np.ndarray): The inlet values at each time of t, shape (len(t),) or (len(t), n_fields).
+        t (np.ndarray): The datetime64 times of the data.
+        window (np.timedelta64): The length of a window. Windows end at the last data time within the window.
+        checkpoint_path (str): The checkpoint file, None to run without checkpoints.
+        a_t0 (float or np.ndarray): The initial values when there is no checkpoint, see BatchedAdvection.initialize.
+        a_t0_x (np.ndarray): The locations of a_t0, None if a_t0 is uniform.
+        record_every (int): The state is recorded every record_every data steps since initialization.
+        result (object): Receives the records of every window, e.g. an AdvectionResultStore. Its truncate(t)
+            drops the records after the checkpoint when the run continues from one, and truncate_rows(0) every
+            record on a fresh start. A new ResultBuffer per window if None.
+        **solve_kwargs: Other arguments of the engine's solve, e.g. method and print_msgs.
+    Returns:
+        generator: Yields the start time, end time and result of each window.
+    Raises:
+        ValueError: If window is not positive.
+    """
+    window = np.timedelta64(window, 'ns')
+    if window <= np.timedelta64(0, 'ns'):
+        raise ValueError('The window must be positive')
+    t = np.asarray(t)
+    a_x0_t = np.asarray(a_x0_t, dtype=np.float64)
+    t_ns = t.astype('datetime64[ns]')
+    initialize = True
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        engine.load_checkpoint(checkpoint_path)
+        initialize = False
+        print('Continuing from the checkpoint at %s' % engine.t)
+        if result is not None:
+            result.truncate(engine.t)
+        i0 = int(np.searchsorted(t_ns, np.datetime64(engine.t, 'ns')))
+        if i0 < len(t) and t_ns[i0] != np.datetime64(engine.t, 'ns'):
+            print('WARNING: the data has no time at the checkpoint, continuing from %s' % t[i0])
+    else:
+        i0 = 0
+        # Without a checkpoint the records of an earlier run do not continue into this one
+        if result is not None:
+            result.truncate_rows(0)
+    while i0 < len(t) - 1:
+        i1 = max(int(np.searchsorted(t_ns, t_ns[i0] + window, side='right')) - 1, i0 + 1)
+        window_result = engine.solve(Q_dict, a_x0_t[i0:i1 + 1], t[i0:i1 + 1], initialize=initialize, a_t0=a_t0,
+                                     a_t0_x=a_t0_x, result=result, record_every=record_every, **solve_kwargs)
+        initialize = False
+        yield t[i0], t[i1], window_result
+        if checkpoint_path is not None:
+            engine.save_checkpoint(checkpoint_path)
+        i0 = i1
+
+
+def check_step_front(engine_class=BatchedAdvection, L=20000, dx=100, Q=1.0, dt=60, tolerance=0.02, **solve_kwargs):
+    """Check an advection engine against the analytic transit time of a step front at constant flow.
+
+    The inlet steps from 0 to 1 at the first data time and the front is advected through a path whose inner
+    area halves at mid-length. Each cell must see the front, where its value crosses 0.5, when the flow has
+    swept the pipe volume between the inlet and the cell, and stay within [0, 1].
+
+    Args:
+        engine_class (type): BatchedAdvection or BatchTracker.
+        L (float): The length of the path in m.
+        dx (float): The cell length in m.
+        Q (float): The flow in m3/s.
+        dt (float): The data time step in s.
+        tolerance (float): The largest arrival time error as a fraction of the transit time of the path.
+        **solve_kwargs: Other arguments of the engine's solve, e.g. method.
+    Returns:
+        bool: True if the front arrives within tolerance at every cell and the values stay within bounds.
+    Raises:
+        None
+    """
+    IA = {'IA_x': np.array([0, L / 2, L / 2 + dx, L]), 'IA': np.array([0.6, 0.6, 0.3, 0.3])}
+    engine = engine_class(L, dx, IA)
+    cumulative_volume = np.concatenate([[0], np.cumsum(np.diff(IA['IA_x']) * 0.5 * (IA['IA'][1:] + IA['IA'][:-1]))])
+    transit_time = cumulative_volume[-1] / Q
+    n_t = int(np.ceil(1.5 * transit_time / dt)) + 1
+    t = np.datetime64('2025-01-01T00:00:00', 'ns') + np.arange(n_t) * np.timedelta64(int(dt * 1e9), 'ns')
+    profile = FlowProfile(t, np.full((n_t, 2), Q), np.array([0, L]))
+    t_result, a = engine.solve(profile, np.ones(n_t), t, a_t0=0.0, print_msgs=(), **solve_kwargs).arrays()
+    a = a[:, :, 0]
+
+    # The time each cell crosses 0.5, interpolated between the recorded times
+    seconds = (t_result - t_result[0]) / np.timedelta64(1, 's')
+    arrival = np.full(a.shape[1], np.nan)
+    for cell in range(a.shape[1]):
+        crossed = np.flatnonzero(a[:, cell] >= 0.5)
+        if len(crossed) and crossed[0] > 0:
+            i = crossed[0]
+            arrival[cell] = np.interp(0.5, a[i - 1:i + 1, cell], seconds[i - 1:i + 1])
+    expected = np.interp(engine.x, IA['IA_x'], cumulative_volume) / Q
+    error = np.nanmax(np.abs(arrival - expected)) / transit_time if not np.isnan(arrival).all() else np.inf
+    bounded = a.min() >= -1e-9 and a.max() <= 1 + 1e-9
+    passed = bool(not np.isnan(arrival).any() and error <= tolerance and bounded)
+    print('%s step front: largest arrival time error %.2f%% of the %.0f s transit time, values in [%.3g, %.3g]'
+          % (engine_class.__name__, 100 * error, transit_time, a.min(), a.max()))
+    if not passed:
+        print('WARNING: %s does not advect a step front at the analytic transit time' % engine_class.__name__)
+    return passed
+
+
+if __name__ == '__main__':
+    check_step_front(BatchedAdvection)
+    check_step_front(BatchedAdvection, method='upwind', tolerance=0.05)
+    check_step_front(BatchTracker)
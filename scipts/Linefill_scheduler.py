@@ -0,0 +1,233 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from KS_mainline_property_fill import get_HRDSY_painted_properties, get_pipe_geometry, build_advection_velocity, fields
+from Linefill_advection import BatchedAdvection, FlowProfile
+from Advection_result_store import AdvectionResultStore
+from PI_data_store import pi_data_columns, read_pi_data
+
+path_to_model = r'..\sps_model'
+path_to_painted_data = '../output/painted/HRDSY'
+path_to_PI_data = r"..\data\PI_data_for_linefill_all" # the PI data of the segment flow tags
+result_dir = '../output/KS_linefill' # one AdvectionResultStore per segment and property
+dx = 100 # cell length in m
+record_every = 60 # the linefill is saved every record_every data times
+n_workers = os.cpu_count() # segment x property jobs run concurrently
+# Path segments in flow order, a segment with an upstream segment takes the upstream outlet as its inlet.
+# The NDRLD and PTOKA branches both start at Steele City, each carries the flow of its own meter flow_tag.
+segments = [
+    {'name': 'HRDSY_STLCT', 'from': 'TAKE_HRDSY_REC', 'to': 'HF_STLCT', 'upstream': None, 'flow_tag': 'HRDSY-A0-Q'},
+    {'name': 'STLCB_NDRLD', 'from': 'HF_STLCB', 'to': 'SALE_NDRLD_DEL', 'upstream': 'HRDSY_STLCT', 'flow_tag': 'STLCT-B0-Q'},
+    {'name': 'STLCT_PTOKA', 'from': 'HF_STLCT', 'to': 'SALE_PTOKA_DEL', 'upstream': 'HRDSY_STLCT', 'flow_tag': 'PTOKA-A0-MB1-Q'},
+]
+
+
+def share_arrays(arrays):
+    """Copy arrays to one shared memory block that worker processes attach to without copying.
+
+    Args:
+        arrays (dict): float64 arrays keyed by name.
+    Returns:
+        tuple: The SharedMemory block, to close and unlink when the workers are done, and a small picklable
+            description of the block for attach_arrays.
+    Raises:
+        None
+    """
+    arrays = {key: np.ascontiguousarray(values, dtype=np.float64) for key, values in arrays.items()}
+    shm = shared_memory.SharedMemory(create=True, size=max(sum(values.nbytes for values in arrays.values()), 1))
+    description = {'name': shm.name, 'arrays': []}
+    offset = 0
+    for key, values in arrays.items():
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf, offset=offset)[...] = values
+        description['arrays'].append((key, values.shape, offset))
+        offset += values.nbytes
+    return shm, description
+
+
+def attach_arrays(description):
+    """Attach to arrays copied to shared memory by share_arrays.
+
+    Args:
+        description (dict): As returned by share_arrays.
+    Returns:
+        tuple: The SharedMemory block, to close when done, and the arrays as views of the block keyed by name.
+    Raises:
+        FileNotFoundError: If the block does not exist.
+    """
+    shm = shared_memory.SharedMemory(name=description['name'])
+    arrays = {key: np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)
+              for key, shape, offset in description['arrays']}
+    return shm, arrays
+
+
+class OutletRecorder:
+    def __init__(self, store, record_every):
+        """Record the outlet value at every data time, and pass every record_every-th state to a store.
+
+        Args:
+            store (AdvectionResultStore): Receives the recorded linefills.
+            record_every (int): The linefill is saved every record_every data times.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.store = store
+        self.record_every = record_every
+        self.outlet = []
+
+    def append(self, t, a):
+        """Record the state at one time, see ResultBuffer.append."""
+        if len(self.outlet) % self.record_every == 0:
+            self.store.append(t, a)
+        self.outlet.append(a[-1].copy())
+
+
+def run_job(job):
+    """Advect one property along one segment, in a worker process.
+
+    Args:
+        job (dict): The segment 'L', 'dx', shared 'geometry' and 'flow' descriptions, the 'inlet' values at
+            each data time or the shared 'inlet_data' description and its 'column', the 'field' name,
+            'a_t0', 'record_every' and the 'store_dir' of the results.
+    Returns:
+        np.ndarray: The outlet values at each data time, the inlet of a downstream segment.
+    Raises:
+        None
+    """
+    flow = FlowProfile.from_shared_memory(job['flow'])
+    geometry_shm, geometry = attach_arrays(job['geometry'])
+    inlet_shm = None
+    try:
+        if job['inlet'] is None:
+            inlet_shm, inlet_data = attach_arrays(job['inlet_data'])
+            inlet = inlet_data['a'][:, job['column']].copy()
+        else:
+            inlet = job['inlet']
+        advection = BatchedAdvection(job['L'], job['dx'], {'IA': geometry['IA'], 'IA_x': geometry['IA_x']})
+        store = AdvectionResultStore.create(job['store_dir'], advection.x, [job['field']])
+        recorder = OutletRecorder(store, job['record_every'])
+        advection.solve(flow, inlet, flow.t, initialize=True, a_t0=job['a_t0'], method='flux limiter',
+                        limiter_function='generalized_minmod', print_msgs=['ERROR', 'WARNING'], result=recorder)
+        store.close()
+        return np.concatenate(recorder.outlet)
+    finally:
+        flow.close()
+        geometry_shm.close()
+        if inlet_shm is not None:
+            inlet_shm.close()
+
+
+def get_segment_flows(segments, index, path_to_PI_data=path_to_PI_data):
+    """Read the flow of every segment from the PI data of its meter.
+
+    Args:
+        segments (list): The segments, with the PI tag of the segment flow in m3/h as 'flow_tag'.
+        index (pd.DatetimeIndex): The naive MST data times, each flow holds its last sample at or before them.
+        path_to_PI_data (str): The PI data store, or the path of a pickled DataFrame.
+    Returns:
+        dict: The flow in m3/h of each segment as a Series indexed by index, keyed by name.
+    Raises:
+        ValueError: If the flow tag of a segment is not in the PI data.
+    """
+    tags = list(dict.fromkeys(segment['flow_tag'] for segment in segments))
+    available_tags = pi_data_columns(path_to_PI_data)
+    tag_not_found_list = [tag for tag in tags if tag not in available_tags]
+    if tag_not_found_list != []:
+        raise ValueError('The flow tags of these segments are not found in %s:\n%s' % (path_to_PI_data, '\n'.join(
+            '%s: %s' % (segment['name'], segment['flow_tag']) for segment in segments if segment['flow_tag'] in tag_not_found_list)))
+    df = read_pi_data(path_to_PI_data, columns=tags, start=index[0].tz_localize('MST'), end=index[-1].tz_localize('MST'))
+    df.index = df.index.tz_convert('MST').tz_localize(None)
+    df = df.reindex(pd.DatetimeIndex(index), method='ffill')
+    return {segment['name']: df.loc[:, segment['flow_tag']] for segment in segments}
+
+
+def run_segments(segments, geometries, flows, inlet_values, fields, result_dir, n_workers=n_workers, a_t0=999,
+                 record_every=record_every):
+    """Advect properties along connected path segments, one job per segment and property on a process pool.
+
+    The geometry and flow of each segment and the inlet data are copied to shared memory once and the jobs
+    attach to them. A job starts when the job of the same property on the upstream segment has finished,
+    and takes its outlet values as inlet values, so properties of different segments and independent
+    properties run concurrently.
+
+    Args:
+        segments (list): Dicts with the segment 'name' and the 'upstream' segment name, None for a segment
+            fed by inlet_values. An upstream segment must come before the segments it feeds.
+        geometries (dict): The (L, dx, IA) of each segment as returned by get_pipe_geometry, keyed by name.
+        flows (dict): The flow in m3/h of each segment as a Series indexed by the data times, keyed by name.
+        inlet_values (np.ndarray): The property values at the inlet of the first segments at each data time,
+            shape (n_times, len(fields)).
+        fields (list): The names of the properties.
+        result_dir (str): The directory of the result stores, one per segment and property.
+        n_workers (int): The number of worker processes.
+        a_t0 (float): The initial property value in every segment.
+        record_every (int): The linefill is saved every record_every data times.
+    Returns:
+        dict: The outlet values at each data time keyed by (segment name, field).
+    Raises:
+        ValueError: If an upstream segment is unknown or comes after the segment it feeds.
+    """
+    names = []
+    for segment in segments:
+        if segment['upstream'] is not None and segment['upstream'] not in names:
+            raise ValueError('Upstream segment %s of %s must come before it' % (segment['upstream'], segment['name']))
+        names.append(segment['name'])
+
+    blocks = []
+    flow_profiles = []
+    try:
+        inlet_shm, inlet_description = share_arrays({'a': inlet_values})
+        blocks.append(inlet_shm)
+        jobs = {}
+        for segment in segments:
+            L, segment_dx, IA = geometries[segment['name']]
+            geometry_shm, geometry_description = share_arrays({'IA': IA['IA'], 'IA_x': IA['IA_x']})
+            blocks.append(geometry_shm)
+            flow = build_advection_velocity(flows[segment['name']], L)
+            flow_profiles.append(flow)
+            flow_description = flow.to_shared_memory()
+            for column, field in enumerate(fields):
+                jobs[(segment['name'], field)] = {
+                    'L': L, 'dx': segment_dx, 'geometry': geometry_description, 'flow': flow_description,
+                    'inlet': None, 'inlet_data': inlet_description, 'column': column, 'field': field, 'a_t0': a_t0,
+                    'record_every': record_every, 'store_dir': os.path.join(result_dir, segment['name'], field),
+                    'upstream': None if segment['upstream'] is None else (segment['upstream'], field),
+                }
+
+        outlets = {}
+        running = {}
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            while jobs or running:
+                for key in [key for key, job in jobs.items() if job['upstream'] is None or job['upstream'] in outlets]:
+                    job = jobs.pop(key)
+                    if job['upstream'] is not None:
+                        job['inlet'] = outlets[job['upstream']]
+                    running[executor.submit(run_job, job)] = key
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    outlets[key] = future.result()
+                    print('%s %s done' % key)
+        return outlets
+    finally:
+        for flow in flow_profiles:
+            flow.close(unlink=True)
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+if __name__ == '__main__':
+    # Build the geometry first so a segment without a path in the model fails before the data is read
+    print('Get pipe geometry')
+    geometries = {segment['name']: get_pipe_geometry(path_to_model, segment['from'], segment['to'], dx) for segment in segments}
+
+    print('Get HRDSY properties')
+    df = get_HRDSY_painted_properties(path_to_painted_data)
+
+    print('Get segment flows')
+    flows = get_segment_flows(segments, df.index)
+    run_segments(segments, geometries, flows, df.loc[:, fields].bfill().values, fields, result_dir)
@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import pandas as pd
+from KS_mainline_property_fill import get_pipe_geometry
+from Advection_result_store import AdvectionResultStore
+
+path_to_model = r'..\sps_model'
+result_dir = '../output/KS_linefill' # the result stores of Linefill_scheduler, one per segment and property
+output_path = '../output/KS_linepack.pkl'
+density_field = 'rho_painted' # kg/m3 at the temperature of temperature_field and atmospheric pressure
+temperature_field = 'Tref_painted' # DC, the temperature the painted density was measured at
+bulk_modulus = 1e9 # Pa
+thermal_expansion = 9e-4 # 1/DC, volumetric expansion coefficient of crude oil
+dx = 100 # cell length in m, as the advection runs
+initial_value = 999 # the a_t0 the linefills start from, a cell holding it has not been reached by data yet
+segments = [
+    {'name': 'HRDSY_STLCT', 'from': 'TAKE_HRDSY_REC', 'to': 'HF_STLCT'},
+    {'name': 'STLCB_NDRLD', 'from': 'HF_STLCB', 'to': 'SALE_NDRLD_DEL'},
+    {'name': 'STLCT_PTOKA', 'from': 'HF_STLCT', 'to': 'SALE_PTOKA_DEL'},
+]
+
+
+def cell_volumes(x, IA):
+    """Get the volume each cell of a linefill grid stands for.
+
+    A cell covers half the distance to each neighbouring cell, so summing density times volume is the
+    trapezoidal integral of rho A along the path.
+
+    Args:
+        x (np.ndarray): The cell locations in m, e.g. AdvectionResultStore.level_x.
+        IA (dict): The inner area 'IA' in m2 at the locations 'IA_x' in m, as returned by get_pipe_geometry.
+    Returns:
+        np.ndarray: The volume of each cell in m3.
+    Raises:
+        None
+    """
+    x = np.asarray(x, dtype=np.float64)
+    widths = np.zeros_like(x)
+    if len(x) > 1:
+        widths[:-1] += np.diff(x) / 2
+        widths[1:] += np.diff(x) / 2
+    return np.interp(x, IA['IA_x'], IA['IA']) * widths
+
+
+class ConditionCorrection:
+    def __init__(self, t, x, P=None, T=None):
+        """Correct the density of a linefill for pressure and temperature given on a coarse grid.
+
+        The density at pressure P and temperature T is rho * exp(P / bulk_modulus) * (1 - thermal_expansion *
+        (T - T_ref)), with rho the density at atmospheric pressure and T_ref. Each record takes the conditions of
+        the last correction time at or before it, interpolated linearly from the coarse grid to the cells.
+
+        Args:
+            t (np.ndarray): The datetime64 times of the conditions.
+            x (np.ndarray): The coarse grid locations in m, increasing.
+            P (np.ndarray): The gauge pressure in Pa, shape (len(t), len(x)). None for no pressure correction.
+            T (np.ndarray): The temperature in DC, shape (len(t), len(x)). None for no temperature correction.
+        Returns:
+            None
+        Raises:
+            ValueError: If P or T does not have shape (len(t), len(x)).
+        """
+        self.t = np.asarray(t, dtype='datetime64[ns]')
+        self.x = np.asarray(x, dtype=np.float64)
+        self.P = None if P is None else np.asarray(P, dtype=np.float64)
+        self.T = None if T is None else np.asarray(T, dtype=np.float64)
+        for name, values in (('P', self.P), ('T', self.T)):
+            if values is not None and values.shape != (len(self.t), len(self.x)):
+                raise ValueError('Expected %s of shape %s, got %s' % (name, (len(self.t), len(self.x)), values.shape))
+
+    def factor(self, t, x, T_ref=None):
+        """Get the correction factor of the density at every record and cell of a block.
+
+        Args:
+            t (np.ndarray): The datetime64 times of the records.
+            x (np.ndarray): The cell locations in m.
+            T_ref (np.ndarray): The temperature the density is given at in DC, shape (len(t), len(x)). None for no
+                temperature correction.
+        Returns:
+            np.ndarray: The factor, shape (len(t), len(x)).
+        Raises:
+            None
+        """
+        rows = np.maximum(np.searchsorted(self.t, np.asarray(t, dtype='datetime64[ns]'), side='right') - 1, 0)
+        # Cells between coarse grid points i and j = i + 1 weigh the two by (1 - w) and w
+        i = np.clip(np.searchsorted(self.x, x, side='right') - 1, 0, max(len(self.x) - 2, 0))
+        j = np.minimum(i + 1, len(self.x) - 1)
+        w = np.clip((x - self.x[i]) / np.maximum(self.x[j] - self.x[i], 1e-12), 0, 1)
+        factor = np.ones((len(rows), len(x)))
+        if self.P is not None:
+            P = self.P[rows]
+            factor *= np.exp((P[:, i] * (1 - w) + P[:, j] * w) / bulk_modulus)
+        if self.T is not None and T_ref is not None:
+            T = self.T[rows]
+            factor *= 1 - thermal_expansion * (T[:, i] * (1 - w) + T[:, j] * w - T_ref)
+        return factor
+
+
+def linepack(density_store, IA, field=density_field, temperature_store=None, temperature_field=temperature_field,
+             correction=None, start=None, end=None, level=0, initial_value=initial_value):
+    """Get the linepack of a segment and its rate of change from recorded density profiles.
+
+    The store is read one chunk file at a time, and each chunk is reduced to the linepack of its records with
+    one matrix product of the (time x cell) densities and the cell volumes, so only one chunk is in memory.
+    dM/dt is the central difference of the linepack between records, one-sided at the ends.
+
+    Until the first data has travelled through the whole segment some cells still hold the initial value of
+    the advection, which is not a density, so the linepack of those records is NaN, and so is dM/dt next to
+    them. Overview levels keep a subset of the cells, so they may turn valid a few records earlier.
+
+    Args:
+        density_store (AdvectionResultStore): The store with the density field.
+        IA (dict): The inner area 'IA' in m2 at the locations 'IA_x' in m, as returned by get_pipe_geometry.
+        field (str): The density field in kg/m3.
+        temperature_store (AdvectionResultStore): The store with the temperature field, recorded at the same
+            times. None for density_store.
+        temperature_field (str): The temperature field in DC the density is given at, used with the temperature
+            of the correction.
+        correction (ConditionCorrection): The pressure and temperature along the segment. None for the linepack
+            at the density of the field.
+        start (np.datetime64): The first time, included. None for the first record.
+        end (np.datetime64): The last time, included. None for the last record.
+        level (int): The store level, overview levels give a fast coarse linepack.
+        initial_value (float): The a_t0 the advection started from. None to integrate every record.
+    Returns:
+        pd.DataFrame: The linepack 'M' in kg and 'dM_dt' in kg/s indexed by the naive record times of the store,
+            NaN while a cell holds initial_value.
+    Raises:
+        KeyError: If a field is not in its store.
+        ValueError: If the temperature store is not recorded at the density record times.
+    """
+    x = density_store.level_x(level)
+    volumes = cell_volumes(x, IA)
+    use_temperature = correction is not None and correction.T is not None
+    if temperature_store is None:
+        temperature_store = density_store
+    temperature_blocks = temperature_store.blocks(temperature_field, start, end, level) if use_temperature else None
+
+    times = []
+    M = []
+    for t, rho in density_store.blocks(field, start, end, level):
+        rho = np.asarray(rho, dtype=np.float64)
+        unfilled = np.any(rho == initial_value, axis=1) if initial_value is not None else np.zeros(len(rho), dtype=bool)
+        if correction is not None:
+            T_ref = None
+            if use_temperature:
+                t_temperature, T_ref = next(temperature_blocks, (None, None))
+                if t_temperature is None or not np.array_equal(t_temperature, t):
+                    raise ValueError('The temperature store is not recorded at the density record times')
+                T_ref = np.asarray(T_ref, dtype=np.float64)
+            rho = rho * correction.factor(t, x, T_ref)
+        times.append(np.array(t))
+        M.append(np.where(unfilled, np.nan, rho @ volumes))
+
+    t = np.concatenate(times) if times else np.empty(0, dtype='datetime64[ns]')
+    M = np.concatenate(M) if M else np.empty(0)
+    seconds = (t - t[0]) / np.timedelta64(1, 's') if len(t) else t.astype(np.float64)
+    dM_dt = np.gradient(M, seconds) if len(t) > 1 else np.full(len(t), np.nan)
+    return pd.DataFrame({'M': M, 'dM_dt': dM_dt}, index=pd.DatetimeIndex(t))
+
+
+def segments_linepack(segments, geometries, result_dir, corrections=None, level=0):
+    """Get the linepack of every segment advected by Linefill_scheduler.
+
+    Args:
+        segments (list): Dicts with the segment 'name'.
+        geometries (dict): The (L, dx, IA) of each segment as returned by get_pipe_geometry, keyed by name.
+        result_dir (str): The directory of the result stores, one per segment and property.
+        corrections (dict): The ConditionCorrection of each segment keyed by name, segments without one are
+            not corrected. None for no corrections.
+        level (int): The store level.
+    Returns:
+        pd.DataFrame: The 'M' in kg and 'dM_dt' in kg/s of each segment, with (segment, quantity) columns.
+    Raises:
+        FileNotFoundError: If a segment has no density store.
+    """
+    if corrections is None:
+        corrections = {}
+    results = {}
+    for segment in segments:
+        name = segment['name']
+        density_store = AdvectionResultStore(os.path.join(result_dir, name, density_field))
+        temperature_store = None
+        if name in corrections and corrections[name].T is not None:
+            temperature_store = AdvectionResultStore(os.path.join(result_dir, name, temperature_field))
+        results[name] = linepack(density_store, geometries[name][2], temperature_store=temperature_store,
+                                 correction=corrections.get(name), level=level)
+        print('%s linepack %.0f t to %.0f t' % (name, results[name]['M'].min() / 1000, results[name]['M'].max() / 1000))
+    return pd.concat(results, axis=1, names=['segment', 'quantity'])
+
+
+if __name__ == '__main__':
+    print('Get pipe geometry')
+    geometries = {segment['name']: get_pipe_geometry(path_to_model, segment['from'], segment['to'], dx) for segment in segments}
+
+    print('Integrate linepack')
+    df_linepack = segments_linepack(segments, geometries, result_dir)
+    df_linepack.to_pickle(output_path)
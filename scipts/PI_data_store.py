@@ -0,0 +1,246 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+missing_value = -9999
+
+
+class PIDataStore:
+    def __init__(self, store_dir):
+        """Open a columnar store of PI data written by write_store or write_frame.
+
+        The store is a directory with one raw little-endian file per column, an int64 file of UTC epoch
+        timestamps in ns, and a meta.json file listing the columns and the number of rows. Columns are
+        memory-mapped, so only the columns and rows that are used are read from disk.
+
+        Args:
+            store_dir (str): The directory of the store.
+        Returns:
+            None
+        Raises:
+            FileNotFoundError: If the directory does not contain a store.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.n_rows = self.meta["n_rows"]
+        self.columns = list(self.meta["columns"].keys())
+        self.timestamps = self._map(self.meta["timestamps_file"], "<i8")
+
+    def _map(self, file_name, dtype):
+        if self.n_rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.store_dir, file_name), dtype=dtype, mode="r", shape=(self.n_rows,))
+
+    def time_slice(self, start=None, end=None):
+        """Get the rows between two times.
+
+        Args:
+            start (datetime): The timezone aware start time, included. None for the first row.
+            end (datetime): The timezone aware end time, included. None for the last row.
+        Returns:
+            slice: The slice of the rows in the time range.
+        Raises:
+            None
+        """
+        first = 0 if start is None else np.searchsorted(self.timestamps, pd.Timestamp(start).as_unit("ns").value, side="left")
+        last = self.n_rows if end is None else np.searchsorted(self.timestamps, pd.Timestamp(end).as_unit("ns").value, side="right")
+        return slice(int(first), int(last))
+
+    def arrays(self, columns=None, start=None, end=None):
+        """Get memory-mapped views of columns over a time range, without copying.
+
+        Args:
+            columns (list): The columns to get. None for all columns.
+            start (datetime): The timezone aware start time, included. None for the first row.
+            end (datetime): The timezone aware end time, included. None for the last row.
+        Returns:
+            tuple: The int64 UTC epoch timestamps in ns, and a dict of float64 column views keyed by column name.
+        Raises:
+            KeyError: If a column is not in the store.
+        """
+        rows = self.time_slice(start, end)
+        if columns is None:
+            columns = self.columns
+        views = {}
+        for column in columns:
+            views[column] = self._map(self.meta["columns"][column]["file"], "<f8")[rows]
+        return self.timestamps[rows], views
+
+    def read(self, columns=None, start=None, end=None):
+        """Read columns over a time range into a DataFrame.
+
+        Args:
+            columns (list): The columns to read. None for all columns.
+            start (datetime): The timezone aware start time, included. None for the first row.
+            end (datetime): The timezone aware end time, included. None for the last row.
+        Returns:
+            pd.DataFrame: The columns indexed by UTC timestamps.
+        Raises:
+            KeyError: If a column is not in the store.
+        """
+        timestamps, views = self.arrays(columns, start, end)
+        return pd.DataFrame(views, index=pd.to_datetime(np.asarray(timestamps), utc=True))
+
+
+def _column_file(column, used_files=()):
+    # Columns that sanitize to the same name, also ignoring case for Windows, get a numbered suffix
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in column)
+    file_name = name + ".f64"
+    suffix = 1
+    while file_name.lower() in used_files:
+        suffix += 1
+        file_name = "%s_%d.f64" % (name, suffix)
+    return file_name
+
+
+def _write_columns(store_dir, timestamps, columns):
+    os.makedirs(store_dir, exist_ok=True)
+    np.asarray(timestamps, dtype="<i8").tofile(os.path.join(store_dir, "timestamps.i64"))
+    meta = {"n_rows": len(timestamps), "timestamps_file": "timestamps.i64", "columns": {}}
+    used_files = set()
+    for column, values in columns:
+        file_name = _column_file(column, used_files)
+        used_files.add(file_name.lower())
+        np.asarray(values, dtype="<f8").tofile(os.path.join(store_dir, file_name))
+        meta["columns"][column] = {"file": file_name}
+    with open(os.path.join(store_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+
+
+def write_store(store_dir, data):
+    """Write the series fetched from Seeq to a columnar store, one column per tag.
+
+    The series are aligned on the union of their timestamps. Missing samples (-9999) and timestamps a
+    tag has no sample for are stored as NaN. Tags are written one at a time, so no wide DataFrame is built.
+
+    Args:
+        store_dir (str): The directory of the store, created if needed. An existing store is overwritten.
+        data (dict): DataFrames with a 'values' column indexed by timezone aware timestamps, keyed by PI tag.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    tag_timestamps = {pi_tag: df.index.as_unit("ns").asi8 for pi_tag, df in data.items()}
+    if tag_timestamps:
+        timestamps = np.unique(np.concatenate(list(tag_timestamps.values())))
+    else:
+        timestamps = np.empty(0, dtype=np.int64)
+
+    def aligned_columns():
+        for pi_tag, df in data.items():
+            values = np.full(len(timestamps), np.nan)
+            source = df["values"].to_numpy(dtype=np.float64)
+            values[np.searchsorted(timestamps, tag_timestamps[pi_tag])] = np.where(source == missing_value, np.nan, source)
+            yield pi_tag, values
+
+    _write_columns(store_dir, timestamps, aligned_columns())
+
+
+def write_frame(store_dir, df):
+    """Write a wide DataFrame of PI data, e.g. a legacy linefill pickle, to a columnar store.
+
+    Args:
+        store_dir (str): The directory of the store, created if needed. An existing store is overwritten.
+        df (pd.DataFrame): PI data with one column per tag, indexed by timezone aware timestamps in time order.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    _write_columns(store_dir, df.index.as_unit("ns").asi8, ((column, df[column].to_numpy(dtype=np.float64)) for column in df.columns))
+
+
+def append_frame(store_dir, df, replace_from=None):
+    """Append the rows of a wide DataFrame to a columnar store, creating the store if needed.
+
+    Rows of the store at or after replace_from are dropped first, so rows that were written before their
+    inputs were complete can be rewritten. Column files are truncated and appended in place, the rows before
+    replace_from are not rewritten.
+
+    Args:
+        store_dir (str): The directory of the store.
+        df (pd.DataFrame): Rows with the same columns as the store, indexed by timezone aware timestamps in
+            time order and later than the rows that are kept.
+        replace_from (datetime): The timezone aware time of the first row to replace. None to keep every row.
+    Returns:
+        int: The number of rows of the store.
+    Raises:
+        ValueError: If the columns differ from the store, or the rows are not later than the kept rows.
+    """
+    if not os.path.exists(os.path.join(store_dir, "meta.json")):
+        write_frame(store_dir, df)
+        return len(df)
+    with open(os.path.join(store_dir, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if list(meta["columns"].keys()) != list(df.columns):
+        raise ValueError('The columns do not match the store in %s' % store_dir)
+    timestamps_path = os.path.join(store_dir, meta["timestamps_file"])
+    stored_timestamps = np.fromfile(timestamps_path, dtype="<i8", count=meta["n_rows"])
+    n_kept = meta["n_rows"]
+    if replace_from is not None:
+        n_kept = int(np.searchsorted(stored_timestamps, pd.Timestamp(replace_from).as_unit("ns").value, side="left"))
+    new_timestamps = df.index.as_unit("ns").asi8
+    if n_kept > 0 and len(new_timestamps) > 0 and new_timestamps[0] <= stored_timestamps[n_kept - 1]:
+        raise ValueError('The appended rows must be later than the last kept row of %s' % store_dir)
+
+    files = [(timestamps_path, new_timestamps, "<i8")]
+    files += [(os.path.join(store_dir, meta["columns"][column]["file"]), df[column].to_numpy(), "<f8") for column in df.columns]
+    for path, values, dtype in files:
+        with open(path, "r+b") as f:
+            f.truncate(n_kept * 8)
+            f.seek(0, os.SEEK_END)
+            np.asarray(values, dtype=dtype).tofile(f)
+    meta["n_rows"] = n_kept + len(df)
+    with open(os.path.join(store_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    return meta["n_rows"]
+
+
+def pi_data_columns(path_to_PI_data):
+    """Get the column names of PI data without reading the data of a columnar store.
+
+    Args:
+        path_to_PI_data (str): The directory of a columnar store, or the path of a pickled DataFrame.
+    Returns:
+        list: The column names.
+    Raises:
+        None
+    """
+    if path_to_PI_data.endswith(".pkl"):
+        return list(pd.read_pickle(path_to_PI_data).columns)
+    return PIDataStore(path_to_PI_data).columns
+
+
+def read_pi_data(path_to_PI_data, columns=None, start=None, end=None):
+    """Read PI data from a columnar store, or from a legacy pickle if the path ends with .pkl.
+
+    Args:
+        path_to_PI_data (str): The directory of a columnar store, or the path of a pickled DataFrame.
+        columns (list): The columns to read, duplicates are read once. None for all columns.
+        start (datetime): The timezone aware start time, included. None for the first row.
+        end (datetime): The timezone aware end time, included. None for the last row.
+    Returns:
+        pd.DataFrame: The columns indexed by UTC timestamps.
+    Raises:
+        ValueError: If a column is not in the data.
+    """
+    if path_to_PI_data.endswith(".pkl"):
+        df = pd.read_pickle(path_to_PI_data)
+        available_columns = df.columns
+    else:
+        store = PIDataStore(path_to_PI_data)
+        available_columns = store.columns
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+        tag_not_found_list = [column for column in columns if column not in available_columns]
+        if tag_not_found_list != []:
+            raise ValueError('These tags are not found in the data set:\n' + '\n'.join(tag_not_found_list))
+
+    if path_to_PI_data.endswith(".pkl"):
+        if columns is not None:
+            df = df.loc[:, columns]
+        return df.loc[start:end]
+    return store.read(columns, start, end)
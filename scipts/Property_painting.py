@@ -0,0 +1,294 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from PI_data_store import read_pi_data, append_frame
+
+path_to_PI_data = r"..\data\PI_data_for_linefill_all"
+painted_dir = r"..\output\painted" # painted properties are appended to one columnar store per station
+open_status = 1 # MOV state of an open valve
+tank_flow_threshold = 100 # m3/h, station flow above the open meter banks that is taken from tank
+tank_mu_heavy = 300 # cSt, viscosity assumed for tank flow heavier than the station's heavy_density
+tank_mu_light = 150 # cSt, viscosity assumed for other tank flow
+mu_max = 500 # cSt, painted viscosities above this are replaced by the heavy reference ASTM line
+astm_a_heavy = 6.72 # ASTM D341 A of the heavy reference crude
+astm_b = 2.58 # ASTM D341 B used for all crudes
+
+# Topology of each painted station. A meter bank, the tank or the tightline is open when every valve of
+# any of its open_paths is open. Painted properties are the flow weighted blend of the open meter banks
+# and the tank. The tank takes the station flow when it exceeds the tank's metered_flow by tank_flow_threshold:
+# the flow of the open meter banks ('open'), or of every meter bank whether open or not ('all').
+station_topology = {
+    'HRDSY': {
+        'Q': 'HRDSY-A0-Q',
+        'Ts': 'HRDSY-A0-TS',
+        'rho': 'HRDSY-A0-DEN',
+        'DRA_Q': 'HRDSY-A0-DRA-Q',
+        'meter_banks': {
+            'MB1': {
+                'Q': 'HRDST-A0-MB1-Q', 'rho': 'HRDST-A0-QMU1-DEN', 'mu': 'HRDST-A0-QMU1-VISCLN', 'T': 'HRDST-A0-MB1-TS',
+                'open_paths': [
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5110', 'HRDST-A0-TM-MOV2461'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5111', 'HRDST-A0-TM-MOV2460'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5112', 'HRDST-A0-TM-MOV2462', 'HRDST-A0-TM-MOV2005'],
+                ],
+            },
+            'MB2': {
+                'Q': 'HRDST-A0-MB2-Q', 'rho': 'HRDST-A0-QMU2-DEN', 'mu': 'HRDST-A0-QMU2-VISCLN', 'T': 'HRDST-A0-MB2-TS',
+                'open_paths': [
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5120', 'HRDST-A0-TM-MOV2461'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5121', 'HRDST-A0-TM-MOV2460'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5122', 'HRDST-A0-TM-MOV2462', 'HRDST-A0-TM-MOV2005'],
+                ],
+            },
+            'MB3': {
+                'Q': 'HRDST-A0-MB3-Q', 'rho': 'HRDST-A0-QMU3-DEN', 'mu': 'HRDST-A0-QMU3-VISCLN', 'T': 'HRDST-A0-MB3-TS',
+                'open_paths': [
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5130', 'HRDST-A0-TM-MOV2461'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5131', 'HRDST-A0-TM-MOV2460'],
+                    ['HRDST-A0-TM-MOV2469', 'HRDST-A0-DM-MOV5132', 'HRDST-A0-TM-MOV2462', 'HRDST-A0-TM-MOV2005'],
+                ],
+            },
+        },
+        'tank': {'open_paths': None, 'heavy_density': 880, 'metered_flow': 'open'},
+        'tightline': None,
+    },
+    'CSHNG': {
+        'Q': 'CSHSP-B0-Q',
+        'Ts': 'CSHSP-B0-TS',
+        'rho': 'CSHSP-B0-DEN',
+        'DRA_Q': None,
+        'meter_banks': {
+            'MB11': {
+                'Q': 'CSHTT-B0-MB11-Q', 'rho': 'CSHTT-B0-QMU11-DEN', 'mu': 'CSHTT-B0-QMU11-VISCLN', 'T': 'CSHTT-B0-QMU11-T',
+                'open_paths': [['CSHTT-B0-MOV7408', 'CSHNG-B0-MOV2408']],
+            },
+            'MB12': {
+                'Q': 'CSHTT-B0-MB12-Q', 'rho': 'CSHTT-B0-QMU12-DEN', 'mu': 'CSHTT-B0-QMU12-VISCLN', 'T': 'CSHTT-B0-QMU12-T',
+                'open_paths': [['CSHTT-B0-MOV7410', 'CSHNG-B0-MOV2408']],
+            },
+        },
+        'tank': {'open_paths': [['CSHNG-B0-MOV2408']], 'heavy_density': 870, 'metered_flow': 'all'},
+        'tightline': {
+            'open_paths': [
+                ['CSHSP-B0-MOV0100', 'CSHSP-B0-RTP-MOVBP'],
+                ['CSHSP-B0-MOV0100', 'CSHSP-B0-RTP-MOVIN', 'CSHSP-B0-RTP-MOVKCK'],
+            ],
+        },
+    },
+}
+
+
+def ASTM_viscosity(A, B, T):
+    """Get the kinematic viscosity in cSt on an ASTM D341 line at temperature T in degC."""
+    return(10**(10**(A - B * np.log10(T+273.15))))
+
+
+def ASTM_a(mu, B, T):
+    """Get the ASTM D341 A of a viscosity mu in cSt at temperature T in degC."""
+    return(np.log10(np.log10(mu)) + B * np.log10(T+273.15))
+
+
+def station_tags(topology):
+    """Get every PI tag a station topology reads.
+
+    Args:
+        topology (dict): The topology of one station, as in station_topology.
+    Returns:
+        list: The PI tags, without duplicates.
+    Raises:
+        None
+    """
+    tags = [topology['Q'], topology['Ts'], topology['rho']]
+    if topology.get('DRA_Q'):
+        tags.append(topology['DRA_Q'])
+    paths = []
+    for meter_bank in topology['meter_banks'].values():
+        tags.extend([meter_bank['Q'], meter_bank['rho'], meter_bank['mu'], meter_bank['T']])
+        paths.extend(meter_bank['open_paths'])
+    for name in ('tank', 'tightline'):
+        if topology.get(name) and topology[name].get('open_paths'):
+            paths.extend(topology[name]['open_paths'])
+    for path in paths:
+        tags.extend(path)
+    return list(dict.fromkeys(tags))
+
+
+def open_path_mask(columns, open_paths):
+    """Find the rows where every valve of any of the paths is open.
+
+    Args:
+        columns (dict): Arrays of the valve states keyed by PI tag.
+        open_paths (list): Lists of valve tags.
+    Returns:
+        np.ndarray: A boolean mask, True where a path is open.
+    Raises:
+        None
+    """
+    is_open = {}
+    mask = None
+    for path in open_paths:
+        path_mask = None
+        for valve in path:
+            if valve not in is_open:
+                is_open[valve] = columns[valve] == open_status
+            path_mask = is_open[valve] if path_mask is None else path_mask & is_open[valve]
+        mask = path_mask if mask is None else mask | path_mask
+    return mask
+
+
+def paint_station(columns, index, station, topology):
+    """Paint the density, viscosity and reference temperature of the flow leaving a station.
+
+    Args:
+        columns (dict): Back-filled float arrays keyed by PI tag, covering every tag of station_tags(topology).
+        index (pd.DatetimeIndex): The time of the rows.
+        station (str): The station name, used in error messages.
+        topology (dict): The topology of the station, as in station_topology.
+    Returns:
+        pd.DataFrame: Q, Ts, rho, the open path and flow of each meter bank, the tank and the tightline,
+            rho_painted, mu_painted, Tref_painted, mu_filtered and ASTM_A.
+    Raises:
+        ValueError: If the tightline is open, which the painting does not account for.
+    """
+    Q = columns[topology['Q']]
+    zeros = np.zeros(len(index))
+    result = {'Q': Q, 'Ts': columns[topology['Ts']], 'rho': columns[topology['rho']]}
+    if topology.get('DRA_Q'):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['DRA_ppm'] = columns[topology['DRA_Q']] / Q * 1000
+
+    meter_banks = topology['meter_banks']
+    for name, meter_bank in meter_banks.items():
+        is_open = open_path_mask(columns, meter_bank['open_paths'])
+        result[f'{name}_openpath'] = is_open.astype(float)
+        result[f'{name}_Q'] = np.where(is_open, columns[meter_bank['Q']], zeros)
+
+    tightline_open = np.zeros(len(index), dtype=bool)
+    if topology.get('tightline'):
+        tightline_open = open_path_mask(columns, topology['tightline']['open_paths'])
+        result['tightline_openpath'] = tightline_open.astype(float)
+        result['tightline_Q'] = np.where(tightline_open, Q, zeros)
+        if tightline_open.any():
+            raise ValueError('Current approach does not account for tightline operation at %s. Please modify this script by reading results from upstream advection simulation for tightline case.' % station)
+
+    tank = topology['tank']
+    metered_Q = sum(result[f'{name}_Q'] for name in meter_banks)
+    if tank.get('metered_flow', 'open') == 'all':
+        tank_metered_Q = sum(columns[meter_bank['Q']] for meter_bank in meter_banks.values())
+    else:
+        tank_metered_Q = metered_Q
+    tank_open = ((Q - tank_metered_Q) > tank_flow_threshold) & ~tightline_open
+    if tank.get('open_paths'):
+        tank_open &= open_path_mask(columns, tank['open_paths'])
+    result['TNK_openpath'] = tank_open.astype(float)
+    result['TNK_Q'] = np.where(tank_open, Q, zeros)
+    result['TNK_VISC'] = np.where(result['rho'] > tank['heavy_density'], tank_mu_heavy, tank_mu_light).astype(float)
+
+    total_Q = metered_Q + result['TNK_Q']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for painted, meter_bank_tag, tank_value in (('rho_painted', 'rho', result['rho']), ('mu_painted', 'mu', result['TNK_VISC']), ('Tref_painted', 'T', result['Ts'])):
+            weighted = sum(columns[meter_bank[meter_bank_tag]] * result[f'{name}_Q'] for name, meter_bank in meter_banks.items())
+            result[painted] = (weighted + tank_value * result['TNK_Q']) / total_Q
+
+        mu_out_of_range = result['mu_painted'] > mu_max
+        result['mu_filtered'] = np.where(mu_out_of_range, ASTM_viscosity(astm_a_heavy, astm_b, result['Tref_painted']), result['mu_painted'])
+        result['ASTM_A'] = ASTM_a(result['mu_filtered'], astm_b, result['Tref_painted'])
+    return pd.DataFrame(result, index=index)
+
+
+def paint_stations(path_to_PI_data, stations=None, start=None, end=None, topology=station_topology):
+    """Paint the properties of several stations from one read of the PI data.
+
+    The tags of every station are read together from the columnar store and back-filled once, then each
+    station is painted with whole-column array operations.
+
+    Args:
+        path_to_PI_data (str): The directory of a columnar store, or the path of a pickled DataFrame.
+        stations (list): The stations to paint. None for every station in topology.
+        start (datetime): The timezone aware start time, included. None for the first row.
+        end (datetime): The timezone aware end time, included. None for the last row.
+        topology (dict): The station topologies, as in station_topology.
+    Returns:
+        dict: The painted DataFrames, as returned by paint_station and indexed by MST time, keyed by station.
+    Raises:
+        ValueError: If a tag is not in the data, or a tightline is open.
+    """
+    if stations is None:
+        stations = list(topology.keys())
+    tags = list(dict.fromkeys(tag for station in stations for tag in station_tags(topology[station])))
+    df = read_pi_data(path_to_PI_data, columns=tags, start=start, end=end)
+    df.index = df.index.tz_convert('MST').tz_localize(None)
+    df = df.bfill()
+    columns = {tag: df[tag].to_numpy(dtype=np.float64) for tag in tags}
+    return {station: paint_station(columns, df.index, station, topology[station]) for station in stations}
+
+
+def paint_incremental(path_to_PI_data, output_dir=painted_dir, stations=None, end=None, topology=station_topology):
+    """Paint only the PI data that arrived since the last run and append it to the painted stores.
+
+    Painting is row by row except for the back-fill of missing inputs, which needs later data. Each run
+    records in painting_state.json the first row of each station that had an input still missing at the
+    end of the data. The next run reads the data from that row on, and replaces the painted rows from
+    there, so the painted stores match a full recompute with paint_stations.
+
+    Args:
+        path_to_PI_data (str): The directory of a columnar store, or the path of a pickled DataFrame.
+        output_dir (str): The directory holding one painted columnar store per station and the state file.
+        stations (list): The stations to paint. None for every station in topology.
+        end (datetime): The timezone aware end time, included. None for the last row.
+        topology (dict): The station topologies, as in station_topology.
+    Returns:
+        dict: The number of rows painted in this run, keyed by station.
+    Raises:
+        ValueError: If a tag is not in the data, or a tightline is open.
+    """
+    if stations is None:
+        stations = list(topology.keys())
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, 'painting_state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+
+    resume_from = {station: pd.Timestamp(state[station]['resume_from']) if station in state else None for station in stations}
+    start = None if any(time is None for time in resume_from.values()) else min(resume_from.values())
+    tags = list(dict.fromkeys(tag for station in stations for tag in station_tags(topology[station])))
+    df = read_pi_data(path_to_PI_data, columns=tags, start=start, end=end)
+    if len(df) == 0:
+        return {station: 0 for station in stations}
+    utc_index = df.index
+    df.index = df.index.tz_convert('MST').tz_localize(None)
+
+    # Position after the last valid value of every tag; rows from there on were back-filled without later data
+    values = df.to_numpy(dtype=np.float64)
+    is_valid = ~np.isnan(values)
+    resolved_until = np.where(is_valid.any(axis=0), len(df) - np.argmax(is_valid[::-1], axis=0), 0)
+    tag_resolved_until = dict(zip(tags, resolved_until.tolist()))
+
+    df = df.bfill()
+    columns = {tag: df[tag].to_numpy(dtype=np.float64) for tag in tags}
+    n_rows = {}
+    for station in stations:
+        first = 0 if resume_from[station] is None else int(utc_index.searchsorted(resume_from[station], side='left'))
+        df_painted = paint_station(columns, df.index, station, topology[station]).iloc[first:]
+        df_painted.index = utc_index[first:]
+        append_frame(os.path.join(output_dir, station), df_painted, replace_from=resume_from[station])
+        n_rows[station] = len(df_painted)
+
+        # Without pending rows, the last row is painted again next run so the next window starts inclusive
+        pending = min(tag_resolved_until[tag] for tag in station_tags(topology[station]))
+        state[station] = {'resume_from': utc_index[min(pending, len(df) - 1)].isoformat(), 'last_time': utc_index[-1].isoformat()}
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    return n_rows
+
+
+if __name__ == '__main__':
+    print('Painting %s from %s...' % (', '.join(station_topology.keys()), path_to_PI_data))
+    n_rows = paint_incremental(path_to_PI_data)
+    for station, n in n_rows.items():
+        print('Painted %d rows of %s to %s' % (n, station, os.path.join(painted_dir, station)))
+    print('DONE.')
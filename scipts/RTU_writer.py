@@ -0,0 +1,402 @@
+import os
+import json
+import heapq
+import hashlib
+import fnmatch
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+rtu_utc_offset = timedelta(hours=-7) # rtugen input is in MST
+missing_value = -9999
+record_batch_size = 1000 # number of records of one tag formatted at a time
+cov_heartbeat = timedelta(hours=1) # in change-of-value mode a tag is written at least this often
+cov_search_length = 127 # samples after each sample searched for a change at once, longer runs are searched per kept sample
+cov_deadbands = [ # (tag pattern, 'exact', 'absolute' or 'percent', deadband), the first matching pattern applies
+    ('*-MOV*', 'exact', 0),
+    ('*-DRA-Q', 'absolute', 0.05),
+    ('*-Q', 'absolute', 1.0),
+    ('*-DEN', 'absolute', 0.1),
+    ('*-TS', 'absolute', 0.1),
+    ('*', 'exact', 0),
+]
+
+
+def tag_deadband(pi_tag, deadbands):
+    """Get the deadband of a tag from the first matching pattern.
+
+    Args:
+        pi_tag (str): The PI tag name.
+        deadbands (list): (tag pattern, kind, deadband) tuples, patterns are fnmatch patterns.
+    Returns:
+        tuple: The kind ('exact', 'absolute' or 'percent') and the deadband.
+    Raises:
+        ValueError: If no pattern matches the tag.
+    """
+    for pattern, kind, deadband in deadbands:
+        if fnmatch.fnmatchcase(pi_tag, pattern):
+            return kind, deadband
+    raise ValueError('No deadband pattern matches %s' % pi_tag)
+
+
+def change_of_value_mask(timestamps, values, kind, deadband, heartbeat=cov_heartbeat):
+    """Select the samples a tag has to be written at to be replayed with the same held values.
+
+    A sample is kept if it differs from the last kept sample by more than the deadband, if it goes to or
+    from missing, or if heartbeat has passed since the last kept sample. The first and last samples are
+    always kept, so the series covers the same time span.
+
+    For 'exact' the changes are found with array operations on neighbouring samples. For the deadband kinds
+    the maximum and minimum of every run of 2**k samples are tabulated, and the next change after every
+    sample is found with array operations by testing runs of 2**k samples from the longest down. Only the
+    kept samples are then followed in Python.
+
+    Args:
+        timestamps (np.ndarray): The int64 epoch timestamps in ns, in time order.
+        values (np.ndarray): The values, missing samples are -9999.
+        kind (str): 'exact' keeps any change, 'absolute' changes larger than deadband, and 'percent' changes
+            larger than deadband percent of the last kept value.
+        deadband (float): The deadband, ignored for 'exact'.
+        heartbeat (timedelta): The longest time between kept samples, None for no heartbeat.
+    Returns:
+        np.ndarray: A boolean mask of the samples to keep.
+    Raises:
+        ValueError: If kind is not 'exact', 'absolute' or 'percent'.
+    """
+    if kind not in ('exact', 'absolute', 'percent'):
+        raise ValueError('Unknown deadband kind %s' % kind)
+    n = len(values)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values)
+    missing = values == missing_value
+    keep[0] = True
+    # The index of the sample the heartbeat keeps after each sample, n if there is none
+    if heartbeat is None:
+        heartbeat_index = np.full(n, n)
+    else:
+        heartbeat_ns = heartbeat // timedelta(microseconds=1) * 1000
+        heartbeat_index = np.maximum(np.searchsorted(timestamps, timestamps + heartbeat_ns, side='left'), np.arange(1, n + 1))
+
+    if kind == 'exact':
+        # The last kept value is always the previous value, so a change is a difference to the previous sample
+        keep[1:] = (values[1:] != values[:-1]) | (missing[1:] != missing[:-1])
+        if heartbeat is not None:
+            _add_heartbeats(keep, heartbeat_index)
+        keep[-1] = True
+        return keep
+
+    # Maximum and minimum of every run of 2**k samples, a missing sample is outside the deadband of any value
+    values = values.astype(np.float64)
+    threshold = np.full(n, float(deadband)) if kind == 'absolute' else np.abs(values) * deadband / 100
+    highs = [np.where(missing, np.inf, values)]
+    lows = [np.where(missing, -np.inf, values)]
+    longest_search = int((heartbeat_index - np.arange(n)).max()) - 1
+    width = 1
+    while 2 * width <= longest_search:
+        highs.append(np.maximum(highs[-1][:-width], highs[-1][width:]))
+        lows.append(np.minimum(lows[-1][:-width], lows[-1][width:]))
+        width *= 2
+
+    # The next change after every sample, searched with array operations up to cov_search_length samples ahead
+    search_end = np.minimum(heartbeat_index, np.arange(n) + 1 + cov_search_length)
+    next_change = np.arange(1, n + 1)
+    for k in range(min(len(highs), cov_search_length.bit_length()) - 1, -1, -1):
+        start = np.minimum(next_change, len(highs[k]) - 1)
+        next_change += (1 << k) * (_within(highs[k][start], lows[k][start], values, threshold)
+                                   & (next_change + (1 << k) <= search_end))
+    # After a missing sample the next change is the next present sample
+    next_present = np.where(missing, n, np.arange(n))
+    next_present = np.append(np.minimum.accumulate(next_present[::-1])[::-1][1:], n)
+    next_change = np.where(missing, np.minimum(next_present, heartbeat_index), next_change)
+    # Searches that reached search_end before the heartbeat are continued for the kept samples only
+    unresolved = (next_change == search_end) & (search_end < heartbeat_index) & ~missing
+
+    next_change_list = next_change.tolist()
+    i = 0
+    while True:
+        j = next_change_list[i]
+        if unresolved[i]:
+            j = _continue_search(highs, lows, values[i], threshold[i], j, int(heartbeat_index[i]))
+        if j >= n:
+            break
+        keep[j] = True
+        i = j
+    keep[-1] = True
+    return keep
+
+
+def _within(highs, lows, last_value, threshold):
+    # Rounding of the difference is monotonic, so this is the same test as abs(value - last_value) <= threshold
+    return (highs - last_value <= threshold) & (last_value - lows <= threshold)
+
+
+def _continue_search(highs, lows, last_value, threshold, j, stop):
+    # Skip runs within the deadband of doubling and then halving length from j, ends at the first change or at stop
+    k = 0
+    while k < len(highs) and j + (1 << k) <= stop and _within(highs[k][j], lows[k][j], last_value, threshold):
+        j += 1 << k
+        k += 1
+    for k in range(k - 1, -1, -1):
+        if j + (1 << k) <= stop and _within(highs[k][j], lows[k][j], last_value, threshold):
+            j += 1 << k
+    return j
+
+
+def _add_heartbeats(keep, heartbeat_index):
+    # Add the samples kept by the heartbeat between kept samples, one heartbeat of every gap at a time
+    last = np.flatnonzero(keep)
+    next_kept = np.append(last[1:], len(keep))
+    while len(last):
+        candidates = heartbeat_index[last]
+        inside = candidates < next_kept
+        last = candidates[inside]
+        next_kept = next_kept[inside]
+        keep[last] = True
+
+
+def float_values(data):
+    """Check whether the baseline writer, which concatenated every tag into one column, wrote floats.
+
+    The combined column is of object type if a tag holds string values, e.g. valve status, and every value
+    is written like the column of its own tag. Otherwise it is float64 if any tag is, and every value of
+    every tag is written as a float, e.g. 2.0 for an integer sample.
+
+    Args:
+        data (dict): DataFrames with a 'values' column, keyed by PI tag. Tags decoded from string samples have
+            attrs['is_string'] set.
+    Returns:
+        bool: True if every value is written as a float.
+    Raises:
+        None
+    """
+    frames = list(data.values())
+    if any(df.attrs.get('is_string', False) or df['values'].dtype == object for df in frames):
+        return False
+    return any(np.issubdtype(df['values'].dtype, np.floating) for df in frames)
+
+
+def iter_tag_records(tag_order, pi_tag, df, keep=None, as_float=False):
+    """Yield the RTU records of one tag in time order.
+
+    Args:
+        tag_order (int): The position of the tag in the output, used to order records with the same timestamp.
+        pi_tag (str): The PI tag name.
+        df (pd.DataFrame): A DataFrame with a 'values' column indexed by timezone aware timestamps in time order.
+        keep (np.ndarray): A boolean mask of the samples to write, None to write every sample.
+        as_float (bool): If True every value is written as a float, as returned by float_values.
+    Yields:
+        tuple: The epoch timestamp in ns, tag_order, and the record text after the date and time.
+    Raises:
+        None
+    """
+    timestamps = df.index.as_unit('ns').asi8
+    values = df['values'].to_numpy()
+    if keep is not None:
+        timestamps = timestamps[keep]
+        values = values[keep]
+    # Values are written like the column of the tag in DataFrame.to_csv: 5 and -9999 for integer tags, 5.0 and
+    # -9999.0 for float tags or when every value is written as a float
+    is_integer = np.issubdtype(values.dtype, np.integer) and not as_float
+    if as_float:
+        values = values.astype(np.float64)
+    missing_text = str(missing_value) if is_integer else repr(float(missing_value))
+    for start in range(0, len(values), record_batch_size):
+        records = []
+        for value in values[start:start + record_batch_size].tolist():
+            if value == missing_value:
+                records.append(f"{pi_tag} {missing_text} BAD\n")
+            elif is_integer:
+                records.append(f"{pi_tag} {value} GOOD\n")
+            else:
+                records.append(f"{pi_tag} {value!r} GOOD\n")
+        yield from zip(timestamps[start:start + record_batch_size].tolist(), [tag_order] * len(records), records)
+
+
+def write_rtu_file(data, rtu_file_path, utc_offset=rtu_utc_offset, deadbands=None, heartbeat=cov_heartbeat, tag_counts=None,
+                   as_float=None):
+    """Write the rtugen input file by merging the time-ordered series of every tag.
+
+    The per-tag series are heap-merged and written line by line through a buffered file, so no combined
+    DataFrame is built. Records with the same timestamp are written in the order of data, and the date and
+    time text is formatted once per distinct timestamp.
+
+    With deadbands, the file is written in change-of-value mode: a tag is only written when its value
+    changes by more than its deadband, goes to or from missing, or heartbeat has passed since it was last
+    written. SPS holds the last value of a tag, so the replayed values stay within the deadbands.
+
+    Args:
+        data (dict): DataFrames with a 'values' column indexed by timezone aware timestamps, keyed by PI tag.
+        rtu_file_path (str): The path of the rtugen input file.
+        utc_offset (timedelta): The offset from UTC of the times written to the file.
+        deadbands (list): (tag pattern, kind, deadband) tuples as in cov_deadbands, None to write every sample.
+        heartbeat (timedelta): The longest time between records of a tag in change-of-value mode.
+        tag_counts (dict): If given, updated with the number of records written per tag.
+        as_float (bool): If True every value is written as a float. None to write the values like the baseline
+            writer, as returned by float_values(data).
+    Returns:
+        int: The number of records written.
+    Raises:
+        ValueError: If no deadband pattern matches a tag.
+    """
+    if as_float is None:
+        as_float = float_values(data)
+    epoch = datetime(1970, 1, 1) + utc_offset
+    streams = []
+    for tag_order, (pi_tag, df) in enumerate(data.items()):
+        keep = None
+        if deadbands is not None:
+            kind, deadband = tag_deadband(pi_tag, deadbands)
+            keep = change_of_value_mask(df.index.as_unit('ns').asi8, df['values'].to_numpy(), kind, deadband, heartbeat)
+        streams.append(iter_tag_records(tag_order, pi_tag, df, keep, as_float))
+    tag_records = [0] * len(streams)
+    last_timestamp = None
+    time_string = ''
+    with open(rtu_file_path, 'w', buffering=1 << 20) as f:
+        for timestamp, tag_order, record in heapq.merge(*streams):
+            if timestamp != last_timestamp:
+                time_string = (epoch + timedelta(microseconds=timestamp // 1000)).strftime('%Y/%m/%d %H:%M:%S ')
+                last_timestamp = timestamp
+            f.write(time_string + record)
+            tag_records[tag_order] += 1
+    if tag_counts is not None:
+        tag_counts.update(zip(data.keys(), tag_records))
+    return sum(tag_records)
+
+
+def file_sha256(file_path):
+    """Get the SHA-256 checksum of a file.
+
+    Args:
+        file_path (str): The path of the file.
+    Returns:
+        str: The hex digest.
+    Raises:
+        None
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def partition_slice(df, start_ns, end_ns, seed=False):
+    """Get the samples of a tag in a partition.
+
+    Args:
+        df (pd.DataFrame): A DataFrame with a 'values' column indexed by timezone aware timestamps in time order.
+        start_ns (int): The epoch time in ns the partition starts at, included.
+        end_ns (int): The epoch time in ns the partition ends at, excluded.
+        seed (bool): If True and there is no sample at start_ns, the last sample before start_ns is added at
+            start_ns, so the tag has its held value from the start of the partition.
+    Returns:
+        pd.DataFrame: The samples of the partition.
+    Raises:
+        None
+    """
+    timestamps = df.index.as_unit('ns').asi8
+    first_row, end_row = np.searchsorted(timestamps, [start_ns, end_ns], side='left')
+    df_partition = df.iloc[first_row:end_row]
+    if seed and first_row > 0 and (first_row == len(timestamps) or timestamps[first_row] != start_ns):
+        seed_index = pd.to_datetime([start_ns], utc=True).tz_convert(df.index.tz)
+        df_partition = pd.concat([df.iloc[first_row - 1:first_row].set_axis(seed_index), df_partition])
+    return df_partition
+
+
+# The data of write_rtu_partitions, set once in each worker process
+_partition_data = None
+
+
+def _init_partition_worker(data):
+    global _partition_data
+    _partition_data = data
+
+
+def _write_partition(label, start_ns, end_ns, rtu_file_path, utc_offset, deadbands, heartbeat, as_float):
+    data = {pi_tag: partition_slice(df, start_ns, end_ns, seed=deadbands is not None) for pi_tag, df in _partition_data.items()}
+    tag_counts = {}
+    n_records = write_rtu_file(data, rtu_file_path, utc_offset, deadbands, heartbeat, tag_counts, as_float)
+    return label, n_records, tag_counts, file_sha256(rtu_file_path)
+
+
+def write_rtu_partitions(data, partition_dir, partition='D', utc_offset=rtu_utc_offset, deadbands=None, heartbeat=cov_heartbeat,
+                         n_workers=4, labels=None, file_prefix='rtu'):
+    """Write the rtugen input as one file per day or month, generated in parallel, with a manifest.
+
+    Partitions are calendar periods in the time of the file (UTC plus utc_offset) covering every sample of
+    data. Each partition is written with write_rtu_file in a worker process, which gets data once and cuts
+    its partitions from it. In change-of-value mode every tag is seeded with its last value at or before the
+    partition start, written at the start, so a partition can be replayed on its own.
+
+    manifest.json in partition_dir lists each partition with its file, start and end time in file time
+    (end excluded), number of records, number of records per tag, and SHA-256 checksum. When labels is
+    given, only those partitions are written and their manifest entries replaced, so a bad partition can
+    be regenerated without rewriting the others.
+
+    Args:
+        data (dict): DataFrames with a 'values' column indexed by timezone aware timestamps, keyed by PI tag.
+        partition_dir (str): The directory of the partition files and the manifest, created if needed.
+        partition (str): 'D' for daily or 'M' for monthly partitions.
+        utc_offset (timedelta): The offset from UTC of the times written to the files.
+        deadbands (list): (tag pattern, kind, deadband) tuples as in cov_deadbands, None to write every sample.
+        heartbeat (timedelta): The longest time between records of a tag in change-of-value mode.
+        n_workers (int): The number of partitions written concurrently.
+        labels (list): Labels of the partitions to write, e.g. ['2025-01-15'] or ['2025-01']. None for all.
+        file_prefix (str): The partition files are named <file_prefix>_<label>.rtu.
+    Returns:
+        dict: The manifest.
+    Raises:
+        ValueError: If partition is not 'D' or 'M', or no deadband pattern matches a tag.
+    """
+    if partition not in ('D', 'M'):
+        raise ValueError('Unknown partition %s, expected D or M' % partition)
+    os.makedirs(partition_dir, exist_ok=True)
+    offset_ns = utc_offset // timedelta(microseconds=1) * 1000
+    tag_timestamps = {pi_tag: df.index.as_unit('ns').asi8 for pi_tag, df in data.items()}
+    non_empty = [timestamps for timestamps in tag_timestamps.values() if len(timestamps)]
+    if non_empty:
+        first = pd.Timestamp(min(timestamps[0] for timestamps in non_empty) + offset_ns)
+        last = pd.Timestamp(max(timestamps[-1] for timestamps in non_empty) + offset_ns)
+        periods = pd.period_range(first, last, freq=partition)
+    else:
+        periods = pd.PeriodIndex([], freq=partition)
+    if labels is not None:
+        labels = set(labels)
+        periods = [period for period in periods if str(period) in labels]
+
+    manifest_path = os.path.join(partition_dir, 'manifest.json')
+    manifest = {'partition': partition, 'utc_offset_hours': utc_offset / timedelta(hours=1), 'partitions': []}
+    if labels is not None and os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    # Every partition writes the values like the whole data, not like the tags of its own slice
+    as_float = float_values(data)
+    entries = {}
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_partition_worker, initargs=(data,)) as executor:
+        futures = []
+        for period in periods:
+            start, end = period.start_time, (period + 1).start_time
+            file_name = f"{file_prefix}_{period}.rtu"
+            entries[str(period)] = {'label': str(period), 'file': file_name, 'start': start.isoformat(), 'end': end.isoformat()}
+            futures.append(executor.submit(_write_partition, str(period), start.value - offset_ns, end.value - offset_ns,
+                                           os.path.join(partition_dir, file_name), utc_offset, deadbands, heartbeat, as_float))
+        for future in futures:
+            label, n_records, tag_counts, sha256 = future.result()
+            entries[label].update({
+                'n_records': n_records,
+                'n_tags': sum(1 for count in tag_counts.values() if count > 0),
+                'tag_counts': tag_counts,
+                'sha256': sha256,
+            })
+
+    partitions = {entry['label']: entry for entry in manifest['partitions']}
+    partitions.update(entries)
+    manifest['partitions'] = [partitions[label] for label in sorted(partitions)]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
@@ -0,0 +1,319 @@
+import os
+import glob
+import heapq
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+cache_dir = r"..\output\sps_model_cache" # compiled snapshots, one per hash of the model CSV files
+# Tables of the elements that connect a FROM node to a TO node, keyed by the element type
+element_tables = {
+    'T': 'Transfer Lines, T.csv',
+    'H': 'Headers, H.csv',
+    'B': 'Block Valves, B.csv',
+    'BC': 'Check Valves, BC.csv',
+    'HF': 'HF Elements.csv',
+}
+sale_take_table = 'Sale-Take, E.csv'
+define_paths_table = 'Define Paths, DP.csv'
+# Paths indexed in the snapshot on top of the defined paths
+cached_paths = [
+    ('TAKE_HRDSY_REC', 'HF_STLCT'),
+    ('TAKE_HRDSY_REC', 'SALE_PTOKA_DEL'),
+    ('HF_STLCB', 'SALE_NDRLD_DEL'),
+    ('HF_STLCT', 'SALE_PTOKA_DEL'),
+    ('NO_LIBRT_D', 'SALE_HSTNT_DEL'),
+    ('NO_LIBRT_01A_S', 'SALE_CITGO_DEL'),
+]
+
+
+def model_hash(model_dir):
+    """Hash the CSV tables of an SPS model.
+
+    Args:
+        model_dir (str): The directory of the model CSV files.
+    Returns:
+        str: The sha256 hex digest of the file names and contents.
+    Raises:
+        None
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(model_dir, '*.csv'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_table(model_dir, file_name):
+    """Read an SPS model table, indexed by element name without the units row."""
+    return pd.read_csv(os.path.join(model_dir, file_name), skiprows=[1], index_col=0, low_memory=False)
+
+
+class CompiledModel:
+    def __init__(self, model_dir):
+        """Compile the pipe network of an SPS model from its CSV tables.
+
+        Every element is an edge from its FROM node to its TO node with a length in km and, for pipes and
+        headers, an inner diameter of OD - 2 WT in mm. A take is an edge from the take into its node and a
+        sale an edge from its node to the sale, so paths can start and end at elements or nodes. Every
+        defined path and cached path is indexed once: the elements along the path in flow order with their
+        start and end distance in km and diameter in mm.
+
+        Args:
+            model_dir (str): The directory of the model CSV files.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.hash = model_hash(model_dir)
+        self.checked = False # True once check_paths passed on this snapshot
+        names, types, from_nodes, to_nodes, lengths, diameters = [], [], [], [], [], []
+        for element_type, file_name in element_tables.items():
+            df = read_table(model_dir, file_name)
+            names += list(df.index)
+            types += [element_type] * len(df)
+            from_nodes += list(df['FROM'])
+            to_nodes += list(df['TO'])
+            if 'LEN' in df.columns:
+                lengths += list(df['LEN'].fillna(0).astype(float))
+                diameters += list((df['OD'] - 2 * df['WT']).astype(float))
+            else:
+                lengths += [0.0] * len(df)
+                diameters += [np.nan] * len(df)
+        df_sale_take = read_table(model_dir, sale_take_table)
+        for name, row in df_sale_take.iterrows():
+            names.append(name)
+            types.append(row['STYPE'])
+            from_nodes.append(name if row['STYPE'] == 'TAKE' else row['CNC'])
+            to_nodes.append(row['CNC'] if row['STYPE'] == 'TAKE' else name)
+            lengths.append(0.0)
+            diameters.append(np.nan)
+
+        self.elements = {name: i for i, name in enumerate(names)}
+        self.names = np.array(names)
+        self.types = np.array(types)
+        self.from_nodes = from_nodes
+        self.to_nodes = to_nodes
+        self.lengths = np.array(lengths)
+        self.diameters = np.array(diameters)
+        self.adjacency = {}
+        for i, node in enumerate(from_nodes):
+            self.adjacency.setdefault(node, []).append(i)
+
+        self.paths = {}
+        self.defined_paths = {}
+        for name, expression in read_table(model_dir, define_paths_table)['PATH EXPRESSION'].items():
+            from_loc, to_loc = [loc.strip() for loc in expression.strip()[len('PATH('):-1].split(',')]
+            self.defined_paths[name] = (from_loc, to_loc)
+        for from_loc, to_loc in list(self.defined_paths.values()) + cached_paths:
+            try:
+                self.path(from_loc, to_loc)
+            except ValueError as e:
+                print('WARNING: %s' % e)
+
+    def _endpoints(self, from_loc, to_loc):
+        if from_loc in self.elements:
+            source = self.from_nodes[self.elements[from_loc]]
+        elif from_loc in self.adjacency:
+            source = from_loc
+        else:
+            raise KeyError('%s is not an element or node of the model' % from_loc)
+        if to_loc in self.elements:
+            target = self.to_nodes[self.elements[to_loc]]
+        elif to_loc in self.to_nodes:
+            target = to_loc
+        else:
+            raise KeyError('%s is not an element or node of the model' % to_loc)
+        return source, target
+
+    def path(self, from_loc, to_loc):
+        """Get the index of the shortest path between two elements or nodes, computed once.
+
+        Args:
+            from_loc (str): The element or node the path starts at. A starting element is part of the path.
+            to_loc (str): The element or node the path ends at. An ending element is part of the path.
+        Returns:
+            dict: Arrays along the path in flow order, the element 'names' and 'types', the 'start' and 'end'
+                distance of each element in km, and the 'diameter' of each element in mm, NaN for valves.
+        Raises:
+            KeyError: If from_loc or to_loc is not in the model.
+            ValueError: If there is no path from from_loc to to_loc.
+        """
+        if (from_loc, to_loc) in self.paths:
+            return self.paths[(from_loc, to_loc)]
+        source, target = self._endpoints(from_loc, to_loc)
+        distances = {source: 0.0}
+        previous = {}
+        queue = [(0.0, source)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if distance > distances[node]:
+                continue
+            for i in self.adjacency.get(node, []):
+                next_node = self.to_nodes[i]
+                if distance + self.lengths[i] < distances.get(next_node, np.inf):
+                    distances[next_node] = distance + self.lengths[i]
+                    previous[next_node] = i
+                    heapq.heappush(queue, (distances[next_node], next_node))
+        if target not in distances:
+            raise ValueError('There is no path from %s to %s' % (from_loc, to_loc))
+        indices = []
+        node = target
+        while node != source:
+            indices.append(previous[node])
+            node = self.from_nodes[previous[node]]
+        indices = np.array(indices[::-1], dtype=int)
+        end = np.cumsum(self.lengths[indices])
+        self.paths[(from_loc, to_loc)] = {
+            'names': self.names[indices],
+            'types': self.types[indices],
+            'start': end - self.lengths[indices],
+            'end': end,
+            'diameter': self.diameters[indices],
+        }
+        return self.paths[(from_loc, to_loc)]
+
+    def get_path_length(self, from_loc, to_loc):
+        """Get the length of a path in km, as sps_interface.model.get_path_length."""
+        return float(self.path(from_loc, to_loc)['end'][-1])
+
+    def get_path_diameter_as_array(self, from_loc, to_loc, x):
+        """Get the inner diameter along a path, as sps_interface.model.get_path_diameter_as_array.
+
+        Args:
+            from_loc (str): The element or node the path starts at.
+            to_loc (str): The element or node the path ends at.
+            x (np.ndarray): Distances along the path in km.
+        Returns:
+            np.ndarray: The inner diameter in mm of the pipe or header at each distance.
+        Raises:
+            KeyError: If from_loc or to_loc is not in the model.
+            ValueError: If there is no path from from_loc to to_loc.
+        """
+        path = self.path(from_loc, to_loc)
+        pipes = path['end'] > path['start']
+        pipe_ends = path['end'][pipes]
+        return path['diameter'][pipes][np.minimum(np.searchsorted(pipe_ends, np.asarray(x), side='left'), len(pipe_ends) - 1)]
+
+    def get_device_location_in_path(self, from_loc, to_loc, device_type):
+        """Get the location of the elements of one type along a path, as sps_interface.model.get_device_location_in_path.
+
+        Args:
+            from_loc (str): The element or node the path starts at.
+            to_loc (str): The element or node the path ends at.
+            device_type (str): The element type, e.g. 'HF', 'T', 'B' or 'H'.
+        Returns:
+            dict: The distance in km of the downstream end of each element, keyed by element name in flow order.
+        Raises:
+            KeyError: If from_loc or to_loc is not in the model.
+            ValueError: If there is no path from from_loc to to_loc.
+        """
+        path = self.path(from_loc, to_loc)
+        devices = path['types'] == device_type
+        return dict(zip(path['names'][devices].tolist(), path['end'][devices].tolist()))
+
+
+def check_paths(model, model_dir, device_types=('HF', 'B', 'H'), tolerance=1e-6):
+    """Check the path index of a compiled model against sps_interface on every defined and cached path.
+
+    The path length and the location of every device of device_types along the path must match
+    sps_interface.model on the same model CSV files. The notebooks ran on an older sps_model, so their printed
+    lengths are not a reference, e.g. their HRTFD and HSTNT stations have valves where sps_model/ has headers.
+
+    Args:
+        model (CompiledModel): The model, as returned by load_model.
+        model_dir (str): The directory of the model CSV files, read by sps_interface.
+        device_types (tuple): The element types whose locations are compared.
+        tolerance (float): The largest difference of a length or location in km.
+    Returns:
+        bool: True if every path matches.
+    Raises:
+        ImportError: If sps_interface is not installed.
+    """
+    import sps_interface
+    reference = sps_interface.model(model_dir)
+    passed = True
+    for from_loc, to_loc in dict.fromkeys(list(model.defined_paths.values()) + cached_paths):
+        try:
+            expected = {'length': reference.get_path_length(from_loc, to_loc)}
+        except Exception as e:
+            print('WARNING: sps_interface has no path from %s to %s: %s' % (from_loc, to_loc, e))
+            continue
+        for device_type in device_types:
+            expected.update(reference.get_device_location_in_path(from_loc, to_loc, device_type))
+        try:
+            actual = {'length': model.get_path_length(from_loc, to_loc)}
+            for device_type in device_types:
+                actual.update(model.get_device_location_in_path(from_loc, to_loc, device_type))
+        except (KeyError, ValueError) as e:
+            print('WARNING: %s' % e)
+            passed = False
+            continue
+        mismatches = [key for key in expected if key not in actual or abs(actual[key] - expected[key]) > tolerance]
+        mismatches += [key for key in actual if key not in expected]
+        if mismatches:
+            passed = False
+            print('WARNING: %s to %s differs from sps_interface at %s' % (from_loc, to_loc, ', '.join(
+                '%s (%s vs %s km)' % (key, actual.get(key), expected.get(key)) for key in mismatches)))
+    return passed
+
+
+def save_snapshot(model, snapshot_path):
+    """Pickle a compiled model, replacing the snapshot at once so a reader never sees a partial file."""
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    with open(snapshot_path + '.tmp', 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(snapshot_path + '.tmp', snapshot_path)
+
+
+def load_model(model_dir, cache_dir=cache_dir, fallback=False):
+    """Load the compiled snapshot of an SPS model, compiling and saving it if the CSV files changed.
+
+    sps_interface stays the reference until check_paths has passed on the snapshot. While it has not, the
+    paths are checked on load if sps_interface is installed, and a passed check is saved with the snapshot.
+    Without sps_interface the snapshot is used unchecked, with a WARNING.
+
+    Args:
+        model_dir (str): The directory of the model CSV files.
+        cache_dir (str): The directory of the snapshots, created if needed.
+        fallback (bool): If True, sps_interface.model is returned when a path differs from it, for callers
+            that only use the methods the two models share.
+    Returns:
+        CompiledModel: The model, or sps_interface.model if fallback is True and the check failed.
+    Raises:
+        ValueError: If a path differs from sps_interface and fallback is False.
+    """
+    snapshot_path = os.path.join(cache_dir, 'sps_model_%s.pkl' % model_hash(model_dir))
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, 'rb') as f:
+            model = pickle.load(f)
+    else:
+        model = CompiledModel(model_dir)
+        save_snapshot(model, snapshot_path)
+    if getattr(model, 'checked', False):
+        return model
+
+    try:
+        passed = check_paths(model, model_dir)
+    except ImportError:
+        print('WARNING: sps_interface is not installed, the paths of %s are not checked against it' % snapshot_path)
+        return model
+    if passed:
+        model.checked = True
+        save_snapshot(model, snapshot_path)
+        return model
+    if not fallback:
+        raise ValueError('The paths of %s differ from sps_interface on %s' % (snapshot_path, model_dir))
+    import sps_interface
+    print('WARNING: using sps_interface.model for %s' % model_dir)
+    return sps_interface.model(model_dir)
+
+
+if __name__ == '__main__':
+    model_dir = r"..\sps_model"
+    check_paths(load_model(model_dir), model_dir)
@@ -8,7 +8,8 @@ import urllib.parse
 import os
 from datetime import datetime, timedelta, timezone
 import time
-import pickle
+from Seeq_to_RTU import decode_samples
+from PI_data_store import write_store
 
 class SeeqAPIClient:
     def __init__(self):
@@ -308,11 +309,10 @@ if __name__ == "__main__":
         elapsed_time = end_time - start_time
         print(f"Elapsed time: {elapsed_time:.3f} seconds for {len(response['samples'])} sample points.")
         print('')
-        data[pi_tag] = response['samples']
+        data[pi_tag] = decode_samples(response)
 
 
     # Close the session
     client.close()
 
-    with open('data_2024.pkl', 'wb') as file:
-         pickle.dump(data, file)
\ No newline at end of file
+    write_store('data_2024', data)
\ No newline at end of file
@@ -0,0 +1,411 @@
+import os
+import io
+import re
+import filecmp
+import json
+import time
+import tempfile
+import tracemalloc
+import contextlib
+import multiprocessing
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import numpy as np
+import pandas as pd
+from Seeq_to_RTU import SeeqAPIClient, fetch_all_data, decode_samples, encode_time, n_chunk_workers, chunk_size
+from RTU_writer import write_rtu_file
+
+benchmark_results_path = r"..\data\seeq_benchmark.csv"
+recorded_payload_dir = None # directory of recorded samples responses saved as <signal ID>.json, None for synthetic samples
+from_time = datetime(2025, 1, 1, 7, 0, 0, tzinfo=timezone.utc)
+to_time = datetime(2025, 1, 8, 7, 0, 0, tzinfo=timezone.utc)
+tag_counts = [10, 50] # number of tags fetched in one run
+periods = ['1h', '60s', '5s'] # sampling periods requested from the server
+worker_counts = [1, 10] # number of tags fetched concurrently
+stream_modes = [False, True] # whole-body and streamed response parsing
+string_tag_fraction = 0.1 # fraction of the synthetic tags that are valve status (string) signals
+mock_latency = 0.05 # seconds before the mock server answers a request
+mock_bandwidth = 50e6 # bytes/s the mock server sends a response body at, None for no limit
+mock_rate_limit = 50 # requests/s above which the mock server answers 429, None for no limit
+# Signal kinds of the tag sets of the golden check: S valve status, I integer, M mixed integer and float, N float
+golden_tag_sets = ['SIMN', 'IN', 'IM', 'I', 'N', 'M']
+
+
+class MockSeeqHandler(BaseHTTPRequestHandler):
+    """Answer /api/auth/login and /api/signals/{id}/samples like the Seeq server.
+
+    Signal IDs starting with 'S' are served as valve status signals with string values, IDs starting with
+    'I' as signals with integer values, IDs starting with 'M' as numeric signals with every other value a
+    JSON integer, and other IDs as numeric signals, with every 7th sample missing. If a recorded payload exists for the ID it is served
+    instead, sliced to the requested window.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status_code, body=b"", headers=None):
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        for start in range(0, len(body), 1 << 20):
+            self.wfile.write(body[start:start + (1 << 20)])
+            if bandwidth:
+                time.sleep(min(len(body) - start, 1 << 20) / bandwidth)
+
+    def _throttled(self):
+        with self.server.lock:
+            now = time.time()
+            requests_in_window = self.server.request_times
+            while requests_in_window and now - requests_in_window[0] > 1:
+                requests_in_window.pop(0)
+            if self.server.rate_limit and len(requests_in_window) >= self.server.rate_limit:
+                return True
+            requests_in_window.append(now)
+            return False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != "/api/auth/login":
+            self._send(404)
+            return
+        self._send(200, headers={"x-sq-auth": "benchmark-token"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.split("/")
+        if len(parts) != 5 or parts[1:3] != ["api", "signals"] or parts[4] != "samples":
+            self._send(404)
+            return
+        if self._throttled():
+            self._send(429, headers={"Retry-After": "1"})
+            return
+        time.sleep(self.server.latency)
+
+        query = parse_qs(url.query)
+        signal_id = parts[3]
+        start = pd.Timestamp(query["start"][0])
+        end = pd.Timestamp(query["end"][0])
+        period = pd.Timedelta(query["period"][0]) if "period" in query else pd.Timedelta("60s")
+        body = json.dumps(self.server.samples(signal_id, start, end, period)).encode()
+        self._send(200, body, {"Content-Type": "application/vnd.seeq.v1+json"})
+
+
+def synthetic_samples(signal_id, start, end, period):
+    """Generate a samples response on the period grid, including one sample outside each bound.
+
+    Args:
+        signal_id (str): The Seeq ID, IDs starting with 'S' get string values, 'I' integer values and 'M' numeric
+            values with every other value a JSON integer.
+        start (pd.Timestamp): The start of the window.
+        end (pd.Timestamp): The end of the window.
+        period (pd.Timedelta): The sampling period.
+    Returns:
+        dict: A response with 'samples' and 'valueUnitOfMeasure' like the Seeq samples endpoint.
+    Raises:
+        None
+    """
+    timestamps = pd.date_range(start.floor(period) - period, end.ceil(period) + period, freq=period)
+    keys = timestamps.strftime("%Y-%m-%dT%H:%M:%SZ")
+    offset = timestamps.asi8 // period.value
+    if signal_id.startswith("S"):
+        states = ["CLOSED 0", "OPEN 1"]
+        samples = [{"key": key, "value": states[(i // 1000) % 2]} for key, i in zip(keys, offset.tolist())]
+        return {"samples": samples, "valueUnitOfMeasure": "string"}
+    if signal_id.startswith("I"):
+        values = ((offset // 60) % 4).tolist()
+    else:
+        values = (1000 + 100 * np.sin(offset / 1440)).tolist()
+        if signal_id.startswith("M"):
+            values = [int(round(value)) if i % 2 else value for value, i in zip(values, offset.tolist())]
+    samples = [
+        {"key": key, "value": value} if i % 7 else {"key": key}
+        for key, value, i in zip(keys, values, offset.tolist())
+    ]
+    return {"samples": samples, "valueUnitOfMeasure": "m3/h"}
+
+
+class RecordedSamples:
+    def __init__(self, payload_dir):
+        """Serve recorded samples responses, falling back to synthetic samples for unknown IDs.
+
+        Args:
+            payload_dir (str): A directory of samples responses saved as <signal ID>.json.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.payload_dir = payload_dir
+        self.payloads = {}
+
+    def __call__(self, signal_id, start, end, period):
+        path = os.path.join(self.payload_dir, f"{signal_id}.json")
+        if not os.path.exists(path):
+            return synthetic_samples(signal_id, start, end, period)
+        if signal_id not in self.payloads:
+            with open(path, "r") as f:
+                payload = json.load(f)
+            timestamps = pd.to_datetime([sample["key"] for sample in payload["samples"]], utc=True, format="ISO8601")
+            self.payloads[signal_id] = (timestamps, payload)
+        timestamps, payload = self.payloads[signal_id]
+        first = max(timestamps.searchsorted(start, side="left") - 1, 0)
+        last = timestamps.searchsorted(end, side="right") + 1
+        return {"samples": payload["samples"][first:last], "valueUnitOfMeasure": payload.get("valueUnitOfMeasure")}
+
+
+def serve_mock(port_queue, latency=mock_latency, bandwidth=mock_bandwidth, rate_limit=mock_rate_limit, payload_dir=recorded_payload_dir):
+    """Run the mock Seeq server until the process is terminated.
+
+    Args:
+        port_queue (multiprocessing.Queue): Receives the port the server listens on.
+        latency (float): Seconds before each samples request is answered.
+        bandwidth (float): Bytes/s the response bodies are sent at, None for no limit.
+        rate_limit (int): Requests/s above which 429 is answered, None for no limit.
+        payload_dir (str): A directory of recorded <signal ID>.json responses, None for synthetic samples.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockSeeqHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.bandwidth = bandwidth
+    server.rate_limit = rate_limit
+    server.request_times = []
+    server.lock = threading.Lock()
+    server.samples = synthetic_samples if payload_dir is None else RecordedSamples(payload_dir)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_mock_server(**kwargs):
+    """Start the mock Seeq server in a separate process, so it does not count towards the measured memory.
+
+    Args:
+        **kwargs: Passed to serve_mock.
+    Returns:
+        tuple: The server process and its base URL.
+    Raises:
+        None
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_mock, args=(port_queue,), kwargs=kwargs, daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get()}"
+
+
+def baseline_frame(response):
+    """Decode a samples response like the baseline Seeq_to_RTU, every value keeps its JSON type.
+
+    Args:
+        response (dict): A samples response.
+    Returns:
+        pd.DataFrame: A 'values' column indexed by timestamp, missing values are the integer -9999 and the
+            values of string signals are the strings of their integers.
+    Raises:
+        None
+    """
+    timestamps = []
+    values = []
+    for item in response['samples']:
+        timestamps.append(item['key'])
+        if 'value' not in item:
+            values.append(int(-9999))
+        elif response['valueUnitOfMeasure'] == 'string':
+            values.append(re.findall(r'\d+', item['value'])[0])
+        else:
+            values.append(item['value'])
+    return pd.DataFrame(values, columns=['values'], index=pd.to_datetime(timestamps))
+
+
+def write_baseline_rtu_file(data, rtu_file_path):
+    """Write the rtugen input file like the baseline Seeq_to_RTU, with a stable sort.
+
+    The baseline sorted with quicksort, which does not fix the order of records sharing a timestamp, so the
+    stable sort gives the tag order write_rtu_file writes them in.
+
+    Args:
+        data (dict): DataFrames as returned by baseline_frame, keyed by PI tag.
+        rtu_file_path (str): The path of the rtugen input file.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    data = {pi_tag: df.copy() for pi_tag, df in data.items()}
+    for pi_tag in data.keys():
+        data[pi_tag].insert(0, 'tag_name', [pi_tag] * len(data[pi_tag]))
+        data[pi_tag].insert(2, 'quality', ['GOOD'] * len(data[pi_tag]))
+        data[pi_tag].loc[data[pi_tag]['values'] == int(-9999), 'quality'] = 'BAD'
+        data[pi_tag].index = data[pi_tag].index.tz_convert('MST').tz_localize(None)
+    df = pd.concat([data[key] for key in data.keys()])
+    df.insert(0, 'date_string', df.index.strftime('%Y/%m/%d'))
+    df.insert(1, 'time_string', df.index.strftime('%H:%M:%S'))
+    df.sort_index(inplace=True, kind='stable')
+    df.to_csv(rtu_file_path, index=False, header=False, sep=" ")
+
+
+def check_rtu_golden(n_tags=10, period='60s', tag_sets=golden_tag_sets):
+    """Compare the rtugen file of write_rtu_file with the golden file of the baseline writer for the same responses.
+
+    The baseline writer concatenated every tag into one values column. With a valve status tag the column is
+    of object type, so every tag is written like its own column, e.g. 5 for integer and -9999.0 for float
+    signals. With numeric tags only it is float64 as soon as one tag is a float signal, and integer values
+    are written as 2.0. Each tag set is checked on its own.
+
+    Args:
+        n_tags (int): The number of tags of each kind.
+        period (str): The sampling period of the synthetic responses.
+        tag_sets (list): Strings of the signal kinds of each tag set, as in golden_tag_sets.
+    Returns:
+        bool: True if the files of every tag set are byte-identical.
+    Raises:
+        None
+    """
+    identical = True
+    for kinds in tag_sets:
+        signal_ids = [f"{kind}{i}" for kind in kinds for i in range(n_tags)]
+        responses = {f"GOLDEN-{signal_id}": synthetic_samples(signal_id, pd.Timestamp(from_time), pd.Timestamp(to_time), pd.Timedelta(period))
+                     for signal_id in signal_ids}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            golden_path = os.path.join(temp_dir, "golden.rtu")
+            rtu_path = os.path.join(temp_dir, "test.rtu")
+            write_baseline_rtu_file({pi_tag: baseline_frame(response) for pi_tag, response in responses.items()}, golden_path)
+            write_rtu_file({pi_tag: decode_samples(response) for pi_tag, response in responses.items()}, rtu_path)
+            if not filecmp.cmp(golden_path, rtu_path, shallow=False):
+                identical = False
+                with open(golden_path, "r") as golden_file, open(rtu_path, "r") as rtu_file:
+                    for line_number, (golden_line, line) in enumerate(zip(golden_file, rtu_file), 1):
+                        if golden_line != line:
+                            print(f"WARNING: tags {kinds} line {line_number} differs from the baseline writer: {line.strip()} instead of {golden_line.strip()}")
+                            break
+    return identical
+
+
+def benchmark_tags(n_tags):
+    """Build a tag table like found_pi_tags_KS.csv for the mock server.
+
+    Args:
+        n_tags (int): The number of tags, string_tag_fraction of them valve status tags.
+    Returns:
+        pd.DataFrame: The 'ID' and 'Name' of each tag.
+    Raises:
+        None
+    """
+    n_string_tags = int(round(n_tags * string_tag_fraction))
+    ids = [f"S{i}" for i in range(n_string_tags)] + [f"N{i}" for i in range(n_tags - n_string_tags)]
+    names = [f"BENCH-A0-MOV{i}" for i in range(n_string_tags)] + [f"BENCH-A0-Q{i}" for i in range(n_tags - n_string_tags)]
+    return pd.DataFrame({"ID": ids, "Name": names})
+
+
+def run_case(n_tags, deltaT, n_workers, stream):
+    """Fetch, parse and write one benchmark case against the server in the TC_SEEQ_SERVER environment variable.
+
+    Args:
+        n_tags (int): The number of tags fetched.
+        deltaT (str): The sampling period, e.g. '60s'.
+        n_workers (int): The number of tags fetched concurrently.
+        stream (bool): If True, responses are parsed incrementally into arrays.
+    Returns:
+        dict: The measured throughput, parse time, peak memory and RTU write time.
+    Raises:
+        None
+    """
+    df_pi_tags = benchmark_tags(n_tags)
+    client = SeeqAPIClient(pool_size=n_workers * n_chunk_workers)
+    log = io.StringIO()
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        data, failed_tags = fetch_all_data(client, df_pi_tags, from_time, to_time, deltaT, n_workers=n_workers, chunk_size=chunk_size, stream=stream)
+    fetch_time = time.perf_counter() - start_time
+    _, fetch_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report = client.governor.report()
+
+    with contextlib.redirect_stdout(log):
+        response = client.get_time_series(df_pi_tags["ID"].iloc[-1], encode_time(from_time), encode_time(to_time), deltaT)
+        start_time = time.perf_counter()
+        decode_samples(response)
+        parse_time = time.perf_counter() - start_time
+        client.close()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rtu_path = os.path.join(temp_dir, "benchmark.rtu")
+        start_time = time.perf_counter()
+        n_records = write_rtu_file(data, rtu_path)
+        rtu_write_time = time.perf_counter() - start_time
+        rtu_size = os.path.getsize(rtu_path)
+
+    n_samples = sum(len(df) for df in data.values())
+    return {
+        "n_tags": n_tags,
+        "period": deltaT,
+        "n_workers": n_workers,
+        "stream": stream,
+        "n_samples": n_samples,
+        "failed_tags": len(failed_tags),
+        "fetch_s": fetch_time,
+        "samples_per_s": n_samples / fetch_time,
+        "requests_per_s": report["requests_per_s"],
+        "MB_per_s": report["MB_per_s"],
+        "n_throttled": report["n_throttled"],
+        "parse_s_per_tag": parse_time,
+        "fetch_peak_MB": fetch_peak / 1e6,
+        "n_records": n_records,
+        "rtu_write_s": rtu_write_time,
+        "rtu_MB": rtu_size / 1e6,
+    }
+
+
+def run_benchmark(server_url, tag_counts=tag_counts, periods=periods, worker_counts=worker_counts, stream_modes=stream_modes):
+    """Run every combination of tag count, period, concurrency and parsing mode against a server.
+
+    Args:
+        server_url (str): The base URL of the mock Seeq server.
+        tag_counts (list): Numbers of tags fetched in one run.
+        periods (list): Sampling periods, e.g. ['60s', '5s'].
+        worker_counts (list): Numbers of tags fetched concurrently.
+        stream_modes (list): Parsing modes, True for streamed parsing.
+    Returns:
+        pd.DataFrame: One row of measurements per case.
+    Raises:
+        None
+    """
+    os.environ["TC_SEEQ_SERVER"] = server_url
+    os.environ["TC_SEEQ_ACCESS_KEY"] = "benchmark"
+    os.environ["TC_SEEQ_ACCESS_KEY_PASSWORD"] = "benchmark"
+    results = []
+    for n_tags in tag_counts:
+        for deltaT in periods:
+            for n_workers in worker_counts:
+                for stream in stream_modes:
+                    result = run_case(n_tags, deltaT, n_workers, stream)
+                    print(f"{n_tags} tags, {deltaT}, {n_workers} workers, stream={stream}: "
+                          f"{result['samples_per_s']:.0f} samples/s, {result['MB_per_s']:.1f} MB/s, "
+                          f"parse {result['parse_s_per_tag']:.3f} s/tag, peak {result['fetch_peak_MB']:.0f} MB, "
+                          f"RTU write {result['rtu_write_s']:.3f} s")
+                    results.append(result)
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    if check_rtu_golden():
+        print('rtugen output is byte-identical to the baseline writer')
+    server_process, server_url = start_mock_server()
+    print('Mock Seeq server running at %s' % (server_url))
+    try:
+        df_results = run_benchmark(server_url)
+    finally:
+        server_process.terminate()
+
+    print('Saving benchmark results to %s...' % (benchmark_results_path))
+    df_results.to_csv(benchmark_results_path, index=False)
+    print('DONE.')
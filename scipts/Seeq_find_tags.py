@@ -10,31 +10,16 @@ from datetime import datetime, timedelta, timezone
 import time
 import pickle
 import re
+from Seeq_tag_catalog import SeeqTagCatalog
 
 env_path = r"C:\Users\zixiang.chen\.env"
 tag_list_path = r"..\data\all_pi_tags_KS.txt"
 tag_list_found_path = r"..\data\found_pi_tags_KS.csv"
 tag_list_not_found_path = r"..\data\missing_pi_tags_KS.txt"
+tag_catalog_path = r"..\data\pi_tag_catalog.sqlite"
 
 
 
-def search_tag(tag):
-    try:
-        search_result = spy.search({"Name": tag})
-        filtered = search_result[
-            (search_result["Name"] == tag)
-            & (search_result["Datasource Name"] == "DSSHISTLIQ2")
-        ]
- 
-        if filtered.empty:
-            return None, tag  # No exact match found
-        else:
-            return filtered, None
-    except Exception as e:
-        print(f"Error processing tag '{tag}': {e}")
-        return None, tag
-    
-
 if __name__ == "__main__":
     load_dotenv(env_path)
  
@@ -49,23 +34,12 @@ if __name__ == "__main__":
     with open(tag_list_path, "r") as file:
         tag_names = [line.strip() for line in file if line.strip()]
  
-    all_results = []
-    missing_tags = []
- 
-    # Use ThreadPoolExecutor for parallel searching
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(search_tag, tag) for tag in tag_names]
- 
-        for future in as_completed(futures):
-            result, missing = future.result()
-            if result is not None:
-                all_results.append(result)
-            if missing is not None:
-                missing_tags.append(missing)
+    # Resolve the tags from the local catalog, searching Seeq once per station for tags not in it yet
+    catalog = SeeqTagCatalog(tag_catalog_path)
+    df_pi_tags, missing_tags = catalog.resolve(tag_names)
+    catalog.close()
  
-    # Concatenate all results into a single DataFrame
-    if all_results:
-        df_pi_tags = pd.concat(all_results, ignore_index=True)
+    if not df_pi_tags.empty:
         df_pi_tags.to_csv(tag_list_found_path)
         print('Found %d tags. Written to %s'%(len(df_pi_tags.index), tag_list_found_path))
     else:
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+import pandas as pd
+
+
+class SeeqSampleCache:
+    def __init__(self, cache_dir, max_size=10e9):
+        """Initialize an on-disk cache of decoded Seeq samples.
+
+        Each signal ID and sampling period pair is stored as one pickled DataFrame covering a contiguous
+        time range. Requests that overlap or touch the cached range only fetch the missing leading and
+        trailing intervals. The least recently used entries are evicted when the cache grows above max_size.
+
+        Args:
+            cache_dir (str): The directory holding the cached DataFrames and the index file.
+            max_size (float): The maximum total size of the cached files in bytes.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def get(self, signal_id, dt, from_time, to_time, fetch):
+        """Get the samples of a signal, fetching only the intervals that are not cached yet.
+
+        Args:
+            signal_id (str): The Seeq ID of the signal.
+            dt (str): The sampling period, e.g. '60s'.
+            from_time (datetime): The timezone aware start time.
+            to_time (datetime): The timezone aware end time.
+            fetch (callable): Called as fetch(from_time, to_time) for a missing interval, returns a DataFrame
+                indexed by timezone aware timestamps.
+        Returns:
+            pd.DataFrame: The samples from from_time to to_time, plus the closest sample outside each bound.
+        Raises:
+            Exception: Any exception raised by fetch.
+        """
+        key = f"{signal_id}|{dt}"
+        with self.lock:
+            entry = self.index.get(key)
+        from_time = pd.Timestamp(from_time)
+        to_time = pd.Timestamp(to_time)
+
+        df = None
+        if entry is not None and os.path.exists(os.path.join(self.cache_dir, entry["file"])):
+            cached_from = pd.Timestamp(entry["from_time"])
+            cached_to = pd.Timestamp(entry["to_time"])
+            if from_time <= cached_to and to_time >= cached_from:
+                df = pd.read_pickle(os.path.join(self.cache_dir, entry["file"]))
+                parts = [df]
+                if from_time < cached_from:
+                    parts.insert(0, fetch(from_time, cached_from))
+                if to_time > cached_to:
+                    parts.append(fetch(cached_to, to_time))
+                if len(parts) > 1:
+                    df = pd.concat(parts)
+                    df = df[~df.index.duplicated(keep="first")].sort_index()
+                    self._put(key, df, min(from_time, cached_from), max(to_time, cached_to))
+                else:
+                    self._touch(key)
+
+        if df is None:
+            df = fetch(from_time, to_time)
+            self._put(key, df, from_time, to_time)
+
+        first = max(df.index.searchsorted(from_time, side="left") - 1, 0)
+        last = df.index.searchsorted(to_time, side="right") + 1
+        return df.iloc[first:last]
+
+    def _touch(self, key):
+        with self.lock:
+            self.index[key]["last_access"] = time.time()
+            self._write_index()
+
+    def _put(self, key, df, from_time, to_time):
+        file_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in key) + ".pkl"
+        file_path = os.path.join(self.cache_dir, file_name)
+        df.to_pickle(file_path)
+        with self.lock:
+            self.index[key] = {
+                "file": file_name,
+                "from_time": from_time.isoformat(),
+                "to_time": to_time.isoformat(),
+                "size": os.path.getsize(file_path),
+                "last_access": time.time(),
+            }
+            self._evict(keep=key)
+            self._write_index()
+
+    def _evict(self, keep):
+        total_size = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_access"]):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            entry = self.index.pop(key)
+            total_size -= entry["size"]
+            file_path = os.path.join(self.cache_dir, entry["file"])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _write_index(self):
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f, indent=1)
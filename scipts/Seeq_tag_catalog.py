@@ -0,0 +1,169 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import pandas as pd
+from seeq import spy
+
+datasource_name = "DSSHISTLIQ2"
+catalog_columns = ["ID", "Name", "Type", "Value Unit Of Measure", "Datasource Name"]
+
+
+def tag_prefix(tag):
+    """Get the station prefix of a PI tag, e.g. 'HRDSY' for 'HRDSY-A0-Q'.
+
+    Args:
+        tag (str): The PI tag name.
+    Returns:
+        str: The part of the tag before the first '-'.
+    Raises:
+        None
+    """
+    return tag.split("-")[0]
+
+
+class SeeqTagCatalog:
+    def __init__(self, catalog_path, datasource=datasource_name):
+        """Open a local SQLite catalog mapping PI tag names to Seeq IDs, units and datasource.
+
+        The catalog is filled per station prefix: one spy.search returns every signal of a station, which
+        replaces one search per tag. Prefixes are only searched again when they are older than the
+        requested age, so repeated runs resolve tags from the local index.
+
+        Args:
+            catalog_path (str): The path of the SQLite file, created if needed.
+            datasource (str): The Seeq datasource the tags belong to.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.datasource = datasource
+        self.connection = sqlite3.connect(catalog_path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tags (
+                name TEXT NOT NULL,
+                datasource TEXT NOT NULL,
+                id TEXT NOT NULL,
+                type TEXT,
+                unit TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (name, datasource)
+            );
+            CREATE TABLE IF NOT EXISTS prefixes (
+                prefix TEXT NOT NULL,
+                datasource TEXT NOT NULL,
+                refreshed_at TEXT NOT NULL,
+                PRIMARY KEY (prefix, datasource)
+            );
+            """
+        )
+
+    def _search_prefix(self, prefix):
+        search_result = spy.search({"Name": f"{prefix}-*", "Datasource Name": self.datasource, "Type": "Signal"}, quiet=True)
+        if search_result.empty:
+            return search_result
+        return search_result[
+            search_result["Name"].str.startswith(f"{prefix}-")
+            & (search_result["Datasource Name"] == self.datasource)
+        ]
+
+    def refresh(self, prefixes, max_age=None, max_workers=4):
+        """Search Seeq for every signal of the given station prefixes and update the catalog.
+
+        Args:
+            prefixes (list): Station prefixes, e.g. ['HRDSY', 'HRDST'].
+            max_age (timedelta): Prefixes refreshed more recently than this are skipped. None to skip every
+                prefix that was refreshed before.
+            max_workers (int): The number of prefixes searched concurrently.
+        Returns:
+            int: The number of tags added or updated.
+        Raises:
+            Exception: If a search fails.
+        """
+        now = datetime.now(timezone.utc)
+        refreshed = dict(self.connection.execute(
+            "SELECT prefix, refreshed_at FROM prefixes WHERE datasource = ?", (self.datasource,)
+        ).fetchall())
+        stale_prefixes = []
+        for prefix in dict.fromkeys(prefixes):
+            if prefix not in refreshed:
+                stale_prefixes.append(prefix)
+            elif max_age is not None and now - datetime.fromisoformat(refreshed[prefix]) > max_age:
+                stale_prefixes.append(prefix)
+        if not stale_prefixes:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self._search_prefix, stale_prefixes))
+
+        n_tags = 0
+        with self.connection:
+            for prefix, search_result in zip(stale_prefixes, results):
+                rows = [
+                    (row["Name"], self.datasource, row["ID"], row.get("Type"), row.get("Value Unit Of Measure"), now.isoformat())
+                    for _, row in search_result.iterrows()
+                ]
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO tags (name, datasource, id, type, unit, updated_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO prefixes (prefix, datasource, refreshed_at) VALUES (?, ?, ?)",
+                    (prefix, self.datasource, now.isoformat()),
+                )
+                n_tags += len(rows)
+        return n_tags
+
+    def lookup(self, tags):
+        """Look up tags in the catalog without searching Seeq.
+
+        Args:
+            tags (list): PI tag names.
+        Returns:
+            tuple: A DataFrame with the columns of found_pi_tags_KS.csv ('ID', 'Name', 'Type',
+                'Value Unit Of Measure', 'Datasource Name') in the order of tags, and a list of the tags not found.
+        Raises:
+            None
+        """
+        tags = list(dict.fromkeys(tags))
+        found = {}
+        for start in range(0, len(tags), 500):
+            batch = tags[start:start + 500]
+            query = "SELECT id, name, type, unit, datasource FROM tags WHERE datasource = ? AND name IN (%s)" % ",".join("?" * len(batch))
+            for row in self.connection.execute(query, [self.datasource] + batch):
+                found[row[1]] = row
+        df_pi_tags = pd.DataFrame([found[tag] for tag in tags if tag in found], columns=catalog_columns)
+        missing_tags = [tag for tag in tags if tag not in found]
+        return df_pi_tags, missing_tags
+
+    def resolve(self, tags, max_age=None):
+        """Look up tags, refreshing the station prefixes of tags that are not in the catalog yet.
+
+        Args:
+            tags (list): PI tag names.
+            max_age (timedelta): Prefixes refreshed more recently than this are not searched again. None to
+                only search prefixes that were never refreshed.
+        Returns:
+            tuple: A DataFrame of the found tags and a list of the tags not found, as returned by lookup.
+        Raises:
+            Exception: If a search fails.
+        """
+        if max_age is not None:
+            self.refresh([tag_prefix(tag) for tag in tags], max_age=max_age)
+            return self.lookup(tags)
+        df_pi_tags, missing_tags = self.lookup(tags)
+        if missing_tags and self.refresh([tag_prefix(tag) for tag in missing_tags]) > 0:
+            return self.lookup(tags)
+        return df_pi_tags, missing_tags
+
+    def close(self):
+        """Close the catalog.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.connection.close()
@@ -2,30 +2,176 @@ from seeq import spy
 from dotenv import load_dotenv
 import os
 import pandas as pd
+import numpy as np
+import json
+import codecs
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 import urllib.parse
 import os
 from datetime import datetime, timedelta, timezone
 import time
-import pickle
 import re
-import multiprocessing
+import fnmatch
+import random
+import threading
+import contextlib
+from Seeq_sample_cache import SeeqSampleCache
+from RTU_writer import write_rtu_file, write_rtu_partitions, cov_deadbands, cov_heartbeat
+from PI_data_store import write_store
+from Seeq_tag_catalog import SeeqTagCatalog
 
 env_path = r"C:\Users\zixiang.chen\.env"
 rtu_file_path = r"..\data\test.rtu"
-tag_list_found_path = r"..\data\found_pi_tags_KS.csv"
+tag_list_path = r"..\data\all_pi_tags_KS.txt"
+tag_catalog_path = r"..\data\pi_tag_catalog.sqlite"
+pi_data_store_path = r"..\data\PI_data_for_linefill_all"
+cache_dir = r"..\data\seeq_cache"
+cache_max_size = 20e9 # bytes
 from_time = datetime(2025, 1, 1, 7, 0, 0, tzinfo=timezone.utc)
 to_time = datetime(2025, 7, 31, 7, 0, 0, tzinfo=timezone.utc)
 deltaT = '60s'
+n_workers = 10 # number of tags fetched concurrently over the shared session
+chunk_size = timedelta(days=7) # length of the sub-windows a tag is fetched in, None to fetch in one request
+n_chunk_workers = 4 # number of sub-windows of one tag fetched concurrently
+max_retries = 3 # number of times a throttled or failed request is retried
+max_backoff = 60 # seconds, upper bound of the jittered backoff between retries
+# Errors of a dropped connection, while sending the request or while reading the response body
+retryable_errors = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+    urllib3.exceptions.ProtocolError,
+)
+target_latency = 10 # seconds, the governor stops adding requests in flight above this latency
+stream = True # parse responses incrementally into arrays instead of loading the whole JSON body
+stream_batch_size = 100000 # number of samples parsed before they are converted to arrays
+raw_discrete_tags = True # fetch discrete tags as raw change events and forward-fill them locally
+discrete_tag_patterns = ['*-MOV*'] # tag name patterns of discrete tags, besides tags with 'string' units
+rtu_deadbands = None # e.g. cov_deadbands to write tags only when they change by more than their deadband, None to write every sample
+rtu_heartbeat = cov_heartbeat # longest time between records of a tag when rtu_deadbands is set
+rtu_partition = None # 'D' or 'M' to write daily or monthly rtugen files with a manifest to rtu_partition_dir, None for one file
+rtu_partition_dir = r"..\data\rtu_partitions"
+n_rtu_workers = 4 # number of rtugen partitions written concurrently
+
+class ThroughputGovernor:
+    def __init__(self, max_in_flight, initial_in_flight=None, target_latency=target_latency):
+        """Initialize an AIMD limit on the number of requests in flight.
+
+        The limit grows by about one request per round trip while responses are fast and successful, and is
+        halved when the server answers 429 or 5xx, a request fails, or the latency exceeds target_latency.
+        At most one decrease is applied per target_latency, so a burst of throttled responses from the same
+        round trip only halves the limit once.
+
+        Args:
+            max_in_flight (int): The upper bound of the limit, e.g. the HTTP connection pool size.
+            initial_in_flight (int): The starting limit. Defaults to max_in_flight.
+            target_latency (float): The latency in seconds above which the limit is decreased.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.max_in_flight = max_in_flight
+        self.limit = float(initial_in_flight or max_in_flight)
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.last_decrease = 0.0
+        self.start_time = time.time()
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.n_bytes = 0
+
+    def acquire(self):
+        """Wait until a request may be sent.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, status_code, n_bytes=0):
+        """Record the outcome of a request and adjust the limit.
+
+        Args:
+            latency (float): The time in seconds until the response headers were received.
+            status_code (int): The HTTP status code, None if the request failed without a response.
+            n_bytes (int): The size of the response body, if it has been read.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.n_requests += 1
+            self.n_bytes += n_bytes
+            throttled = status_code is None or status_code == 429 or status_code >= 500
+            if throttled:
+                self.n_throttled += 1
+            now = time.time()
+            if throttled or latency > self.target_latency:
+                if now - self.last_decrease > self.target_latency:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            elif status_code == 200:
+                self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def add_bytes(self, n_bytes):
+        """Record bytes of a streamed response body read after the request was released.
+
+        Args:
+            n_bytes (int): The number of bytes read.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.condition:
+            self.n_bytes += n_bytes
+
+    def report(self):
+        """Get the achieved throughput since the governor was created.
+
+        Args:
+            None
+        Returns:
+            dict: requests/s, MB/s, the number of requests and throttled requests, and the current limit.
+        Raises:
+            None
+        """
+        with self.condition:
+            elapsed_time = max(time.time() - self.start_time, 1e-9)
+            return {
+                'requests_per_s': self.n_requests / elapsed_time,
+                'MB_per_s': self.n_bytes / 1e6 / elapsed_time,
+                'n_requests': self.n_requests,
+                'n_throttled': self.n_throttled,
+                'in_flight_limit': int(self.limit),
+            }
+
 
 class SeeqAPIClient:
-    def __init__(self):
+    def __init__(self, pool_size=n_workers, max_retries=max_retries):
         """Initialize the Seeq API client by storing the base URL, username, and password from environment variables.
         This method also sets up a session for making authenticated requests to the Seeq API.
 
         Args:
-            None
+            pool_size (int): The maximum number of pooled HTTP connections kept open to the Seeq server.
+                Should be at least the number of threads sharing this client.
+            max_retries (int): The number of times a throttled, failed or unauthorized request is retried.
         Returns:
             None
         Raises:
@@ -45,14 +191,25 @@ class SeeqAPIClient:
 
         # Initialize the session and authenticate
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.max_retries = max_retries
+        self.governor = ThroughputGovernor(pool_size)
+        self.login_lock = threading.Lock()
+        self.session.headers.update({
+            "accept": "application/vnd.seeq.v1+json",
+            "Content-Type": "application/vnd.seeq.v1+json",
+        })
+        # Authenticate, the token is added to the session headers
         self._login()
 
-        # Update session headers with authentication token
-        self.session.headers.update(self.get_headers())
-
     def _login(self):
         """Authenticate with the Seeq API and store the authentication token.
 
+        The token in the session headers is replaced with one item assignment after the login succeeds, so
+        requests sent by other threads in the meantime keep a complete set of headers.
+
         Args:
             None
         Returns:
@@ -62,26 +219,127 @@ class SeeqAPIClient:
         """
         login_url = f"{self.base_url}/api/auth/login"
 
-        self.session.headers = {
-            "accept": "application/vnd.seeq.v1+json",
-            "Content-Type": "application/vnd.seeq.v1+json",
-        }
-
         payload = {"username": self.username, "password": self.password}
 
+        # The login is sent without the stale token, a None header is dropped from the session headers
         response = self.session.post(
-            login_url, json=payload, headers=self.session.headers
+            login_url, json=payload, headers={"x-sq-auth": None}
         )
 
         if response.status_code == 200:
-            self.auth_token = response.headers.get("x-sq-auth")
-            if not self.auth_token:
+            auth_token = response.headers.get("x-sq-auth")
+            if not auth_token:
                 # If the token is not found, raise an exception
                 raise Exception("Login succeeded, but no x-sq-auth token found!")
+            self.auth_token = auth_token
+            self.session.headers["x-sq-auth"] = auth_token
             #print("Login successful")
         else:
             raise Exception(f"Login failed: {response.status_code} - {response.text}")
 
+    def _refresh_login(self, stale_token):
+        """Log in again after a 401, unless another thread already replaced the stale token.
+
+        Args:
+            stale_token (str): The token the unauthorized request was sent with.
+        Returns:
+            None
+        Raises:
+            Exception: If the login fails.
+        """
+        with self.login_lock:
+            if self.auth_token == stale_token:
+                print("Authentication token expired, logging in again")
+                self._login()
+
+    def _send(self, method, url, stream=False, **kwargs):
+        """Send a request through the throughput governor, retrying throttled and failed requests.
+
+        429 and 5xx responses and retryable_errors are retried after a jittered exponential backoff, or
+        after the Retry-After delay if the server sends one. A 401 logs in again once for all threads
+        and retries the request. A streamed body is read by the caller, so get_time_series_arrays retries
+        the errors of reading it, other callers do not retry failed requests.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL of the request.
+            stream (bool): If True, the response body is not read before returning, and the returned response
+                keeps its place in the governor until the caller releases it, see _stream.
+            **kwargs: Passed to requests.Session.request.
+        Returns:
+            tuple: The last response received and its latency in seconds until the headers were received.
+        Raises:
+            requests.exceptions.RequestException: If the request still fails without a response after max_retries retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            token = self.auth_token
+            self.governor.acquire()
+            start_time = time.time()
+            try:
+                response = self.session.request(method, url, stream=stream, **kwargs)
+            except retryable_errors:
+                self.governor.release(time.time() - start_time, None)
+                if last_attempt:
+                    raise
+                time.sleep(random.uniform(0, min(max_backoff, 2**attempt)))
+                continue
+            latency = time.time() - start_time
+            retry = not last_attempt and (response.status_code in (401, 429) or response.status_code >= 500)
+            if not (stream and not retry):
+                self.governor.release(latency, response.status_code, 0 if stream else len(response.content))
+
+            if not retry:
+                return response, latency
+            if response.status_code == 401:
+                response.close()
+                self._refresh_login(token)
+            else:
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                if retry_after is not None and retry_after.isdigit():
+                    time.sleep(min(max_backoff, int(retry_after)))
+                else:
+                    time.sleep(random.uniform(0, min(max_backoff, 2**attempt)))
+
+    def _request(self, method, url, **kwargs):
+        """Send a request and read its response body, see _send.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL of the request.
+            **kwargs: Passed to requests.Session.request.
+        Returns:
+            requests.Response: The last response received.
+        Raises:
+            requests.exceptions.RequestException: If the request still fails without a response after max_retries retries.
+        """
+        response, _ = self._send(method, url, **kwargs)
+        return response
+
+    @contextlib.contextmanager
+    def _stream(self, method, url, **kwargs):
+        """Send a request whose response body is read by the caller, see _send.
+
+        The request counts as in flight in the governor until the body has been read and the response is
+        closed when the with block exits, so the limit bounds concurrent downloads and not only round trips.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL of the request.
+            **kwargs: Passed to requests.Session.request.
+        Yields:
+            requests.Response: The last response received, with the body not read yet.
+        Raises:
+            requests.exceptions.RequestException: If the request still fails without a response after max_retries retries.
+        """
+        response, latency = self._send(method, url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+            self.governor.release(latency, response.status_code)
+
     def get_session(self):
         """Get the authenticated session for making requests to the Seeq API.
 
@@ -110,6 +368,10 @@ class SeeqAPIClient:
             "x-sq-auth": self.auth_token,
         }
 
+    def _samples_url(self, signal_id, from_time, to_time, dt):
+        period = "" if dt is None else f"&period={dt}"
+        return f"{self.base_url}/api/signals/{signal_id}/samples?start={from_time}&end={to_time}{period}&inflate=false&boundaryValues=Outside&limit=1000000"
+
     def get_latest_signal_sample(
         self, signal_id, key=datetime.now().isoformat() + "Z", lookup="AtOrBefore"
     ):
@@ -128,8 +390,8 @@ class SeeqAPIClient:
             "lookup": lookup,
         }
 
-        response = self.session.get(
-            f"{self.base_url}/api/signals/{signal_id}/sample/{key}", params=params
+        response = self._request(
+            "GET", f"{self.base_url}/api/signals/{signal_id}/sample/{key}", params=params
         )
 
         if response.status_code == 200:
@@ -158,9 +420,9 @@ class SeeqAPIClient:
         params = {
             "lookup": lookup,
         }
-        print(f"{self.base_url}/api/signals/{signal_id}/samples?start={from_time}&end={to_time}&period={dt}&inflate=false&boundaryValues=Outside&limit=1000000")
-        response = self.session.get(
-            f"{self.base_url}/api/signals/{signal_id}/samples?start={from_time}&end={to_time}&period={dt}&inflate=false&boundaryValues=Outside&limit=1000000", params=params
+        print(self._samples_url(signal_id, from_time, to_time, dt))
+        response = self._request(
+            "GET", self._samples_url(signal_id, from_time, to_time, dt), params=params
         )
 
         if response.status_code == 200:
@@ -171,6 +433,159 @@ class SeeqAPIClient:
                 f"Failed to retrieve samples for signal: {response.status_code} - {response.text}"
             )
 
+    def iter_time_series(
+        self, signal_id, from_time, to_time, dt, batch_size=stream_batch_size, metadata=None, lookup="AtOrBefore"
+    ):
+        """Retrieve samples for a specific signal by its ID from the Seeq API, reading the response incrementally.
+
+        The response body is streamed and parsed with StreamingSamplesParser, so at most batch_size samples
+        are held as Python objects at any time.
+
+        Args:
+            signal_id (str): The ID of the signal to retrieve samples for.
+            from_time (str): The start time, encoded with encode_time.
+            to_time (str): The end time, encoded with encode_time.
+            dt (str): The sampling period, e.g. '60s', None for the raw recorded samples.
+            batch_size (int): The number of samples converted to arrays at a time.
+            metadata (dict): If given, updated with the fields of the response other than 'samples' once the
+                response has been read completely.
+            lookup (str): The lookup method for the sample, default is "AtOrBefore".
+        Yields:
+            tuple: int64 epoch timestamps in ns, the values and a bool missing-value mask of each batch, as
+                returned by decode_sample_arrays.
+        Raises:
+            Exception: If the request fails.
+            ValueError: If the response ends before the samples are complete.
+        """
+        params = {
+            "lookup": lookup,
+        }
+        with self._stream(
+            "GET", self._samples_url(signal_id, from_time, to_time, dt), params=params
+        ) as response:
+            if response.status_code != 200:
+                raise Exception(
+                    f"Failed to retrieve samples for signal: {response.status_code} - {response.text}"
+                )
+            parser = StreamingSamplesParser()
+            text_decoder = codecs.getincrementaldecoder("utf-8")()
+            batch = []
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                self.governor.add_bytes(len(chunk))
+                batch.extend(parser.feed(text_decoder.decode(chunk)))
+                if len(batch) >= batch_size:
+                    yield decode_sample_arrays(batch, is_string_samples(batch))
+                    batch = []
+            batch.extend(parser.feed(text_decoder.decode(b"", final=True)))
+            response_metadata = parser.close()
+            if batch:
+                yield decode_sample_arrays(batch, is_string_samples(batch))
+            if metadata is not None:
+                metadata.update(response_metadata)
+
+    def get_time_series_arrays(
+        self, signal_id, from_time, to_time, dt, batch_size=stream_batch_size, lookup="AtOrBefore"
+    ):
+        """Retrieve samples for a specific signal as arrays, streaming the response into growable arrays.
+
+        If the connection drops while the body is read, the samples read so far are discarded and the request
+        is sent again after the jittered exponential backoff of _send, up to max_retries times.
+
+        Args:
+            signal_id (str): The ID of the signal to retrieve samples for.
+            from_time (str): The start time, encoded with encode_time.
+            to_time (str): The end time, encoded with encode_time.
+            dt (str): The sampling period, e.g. '60s', None for the raw recorded samples.
+            batch_size (int): The number of samples converted to arrays at a time.
+            lookup (str): The lookup method for the sample, default is "AtOrBefore".
+        Returns:
+            tuple: int64 epoch timestamps in ns, int64 or float64 values, a bool missing-value mask, and True if the
+                signal values are strings.
+        Raises:
+            Exception: If the request fails.
+            requests.exceptions.RequestException: If reading the body still fails after max_retries retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            arrays = SampleArrays()
+            metadata = {}
+            try:
+                for timestamps, values, missing in self.iter_time_series(signal_id, from_time, to_time, dt, batch_size, metadata, lookup):
+                    arrays.append(timestamps, values, missing)
+                break
+            except retryable_errors:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, min(max_backoff, 2**attempt)))
+        return arrays.timestamps, arrays.values, arrays.missing, metadata.get('valueUnitOfMeasure') == 'string'
+
+    def get_time_series_chunked(
+        self, signal_id, from_time, to_time, dt, chunk_size=chunk_size, n_workers=n_chunk_workers, stream=False, lookup="AtOrBefore"
+    ):
+        """Retrieve samples for a specific signal by splitting the time window into sub-windows fetched in parallel.
+
+        The sub-window responses are stitched back in time order. Because of boundaryValues=Outside each
+        sub-window also returns the samples just outside its bounds, so samples that are not later than the
+        last stitched sample are dropped. Throttled and failed requests of a sub-window are retried by _send,
+        and a streamed body that drops while it is read is retried by get_time_series_arrays, so only the
+        failing sub-window is fetched again.
+
+        Args:
+            signal_id (str): The ID of the signal to retrieve samples for.
+            from_time (datetime): The timezone aware start of the time window.
+            to_time (datetime): The timezone aware end of the time window.
+            dt (str): The sampling period, e.g. '60s', None for the raw recorded samples.
+            chunk_size (timedelta): The length of each sub-window.
+            n_workers (int): The maximum number of sub-windows fetched concurrently.
+            stream (bool): If True, each sub-window is streamed with get_time_series_arrays.
+            lookup (str): The lookup method for the sample, default is "AtOrBefore".
+        Returns:
+            dict: The response of the first sub-window with 'samples' replaced by the stitched samples, without
+                samples if from_time is not before to_time. If stream is True, the stitched arrays as returned by
+                get_time_series_arrays instead.
+        Raises:
+            Exception: If a sub-window fails.
+        """
+        chunk_bounds = []
+        chunk_start = from_time
+        while chunk_start < to_time:
+            chunk_end = min(chunk_start + chunk_size, to_time)
+            chunk_bounds.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+        def get_chunk(chunk_start, chunk_end):
+            if stream:
+                return self.get_time_series_arrays(signal_id, encode_time(chunk_start), encode_time(chunk_end), dt, lookup=lookup)
+            return self.get_time_series(signal_id, encode_time(chunk_start), encode_time(chunk_end), dt, lookup=lookup)
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            responses = list(executor.map(lambda bounds: get_chunk(*bounds), chunk_bounds))
+
+        if stream:
+            arrays = SampleArrays()
+            for timestamps, values, missing, _ in responses:
+                if len(arrays.timestamps) > 0:
+                    keep = timestamps > arrays.timestamps[-1]
+                    timestamps, values, missing = timestamps[keep], values[keep], missing[keep]
+                arrays.append(timestamps, values, missing)
+            return arrays.timestamps, arrays.values, arrays.missing, any(response[3] for response in responses)
+
+        samples = []
+        last_time = None
+        for response in responses:
+            chunk_samples = response['samples']
+            first = 0
+            if last_time is not None:
+                while first < len(chunk_samples) and pd.Timestamp(chunk_samples[first]['key']) <= last_time:
+                    first += 1
+            if first < len(chunk_samples):
+                samples.extend(chunk_samples[first:])
+                last_time = pd.Timestamp(samples[-1]['key'])
+
+        # An empty window has no sub-window response to take the other fields from
+        result = dict(responses[0]) if responses else {'valueUnitOfMeasure': None}
+        result['samples'] = samples
+        return result
+
     def close(self):
         """Close the session when done.
 
@@ -185,64 +600,419 @@ class SeeqAPIClient:
         print("Session closed")
 
 
-def search_tag(tag):
-    try:
-        search_result = spy.search({"Name": tag})
-        filtered = search_result[
-            (search_result["Name"] == tag)
-            & (search_result["Datasource Name"] == "DSSHISTLIQ2")
-        ]
- 
-        if filtered.empty:
-            return None, tag  # No exact match found
-        else:
-            return filtered, None
-    except Exception as e:
-        print(f"Error processing tag '{tag}': {e}")
-        return None, tag
-    
 def encode_time(dt):
     iso = dt.isoformat().replace("+00:00", "Z")
     return urllib.parse.quote(iso, safe="-TZ")  # exclude ':' from safe characters
 
 
-def fetch_data(idx, df_pi_tags, from_time_encoded_string, to_time_encoded_string, deltaT):
-    client = SeeqAPIClient()  # Create a new client instance per process for safety
-    
-    seeq_ID = df_pi_tags.loc[idx, 'ID']
-    pi_tag = df_pi_tags.loc[idx, 'Name']
-    print('Getting data for %s | %s' % (pi_tag, seeq_ID))
-    start_time = time.time()
-    
-    response = client.get_time_series(seeq_ID, from_time_encoded_string, to_time_encoded_string, deltaT)
-    
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f"Elapsed time: {elapsed_time:.3f} seconds for {len(response['samples'])} sample points.")
-    print('')
-    
-    timestamps = []
-    values = []
-    for item in response['samples']:
-        assert 'key' in item.keys(), '"key" not found in %s' % (item)
-        timestamps.append(item['key'])
-        if 'value' not in item.keys():
-            values.append(int(-9999))
+string_value_lookup = {} # integer state of each string sample value seen so far
+
+
+def string_value_to_integer(value):
+    """Convert a string sample value, e.g. 'OPEN 1', to the integer it contains, using a lookup table of known values.
+
+    Args:
+        value (str): The string sample value.
+    Returns:
+        int: The integer contained in the value.
+    Raises:
+        ValueError: If the value does not contain exactly one integer.
+    """
+    integer = string_value_lookup.get(value)
+    if integer is None:
+        integers = re.findall(r'\d+', value)
+        if len(integers) != 1:
+            raise ValueError('Expected one integer in %s but found %d' % (value, len(integers)))
+        integer = int(integers[0])
+        string_value_lookup[value] = integer
+    return integer
+
+
+def decode_sample_arrays(samples, is_string=False):
+    """Convert a list of Seeq samples to typed arrays in bulk.
+
+    Args:
+        samples (list): The 'samples' of a Seeq samples response.
+        is_string (bool): True if the sample values are strings holding an integer state, e.g. valve status.
+    Returns:
+        tuple: int64 epoch timestamps in ns, the values, and a bool mask of the samples without a value. The
+            values are int64 with missing samples set to -9999 if every value is a JSON integer, so they are
+            written like the JSON values, and float64 with missing samples set to NaN otherwise.
+    Raises:
+        KeyError: If a sample has no 'key'.
+        ValueError: If a string sample does not contain exactly one integer.
+    """
+    keys = [item['key'] for item in samples]
+    raw_values = [item.get('value') for item in samples]
+    if keys and keys[0].endswith('Z'):
+        # UTC keys parse much faster with numpy once the 'Z' is dropped
+        timestamps = np.array([key[:-1] for key in keys], dtype='datetime64[ns]').view(np.int64)
+    else:
+        timestamps = pd.to_datetime(keys, utc=True, format='ISO8601').as_unit('ns').asi8
+    if is_string:
+        codes, uniques = pd.factorize(np.array(raw_values, dtype=object))
+        lookup = np.array([string_value_to_integer(value) for value in uniques] + [np.nan], dtype=np.float64)
+        values = lookup[codes]
+    else:
+        values = np.array(raw_values, dtype=np.float64)
+    missing = np.isnan(values)
+    if not is_string and set(map(type, raw_values)) <= {int, type(None)}:
+        values = np.where(missing, -9999, values).astype(np.int64)
+    return timestamps, values, missing
+
+
+def is_string_samples(samples):
+    """Check whether the values of a list of Seeq samples are strings.
+
+    Args:
+        samples (list): Seeq samples.
+    Returns:
+        bool: True if the first sample with a value has a string value.
+    Raises:
+        None
+    """
+    for item in samples:
+        if 'value' in item:
+            return isinstance(item['value'], str)
+    return False
+
+
+class StreamingSamplesParser:
+    def __init__(self):
+        """Initialize an incremental parser of a Seeq samples response.
+
+        The text of the response is fed in pieces. Complete sample objects of the 'samples' array are
+        returned as soon as they are available, and the remaining fields of the response are kept to be
+        parsed when the response is complete.
+
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.head = ''
+        self.tail = ''
+        self.state = 'head'
+
+    def feed(self, text):
+        """Parse the next piece of the response.
+
+        Args:
+            text (str): The next piece of the response text.
+        Returns:
+            list: The sample objects completed by this piece.
+        Raises:
+            None
+        """
+        self.buffer += text
+        samples = []
+        if self.state == 'head':
+            match = re.search(r'"samples"\s*:\s*\[', self.buffer)
+            if match is None:
+                return samples
+            self.head = self.buffer[:match.start()]
+            self.buffer = self.buffer[match.end():]
+            self.state = 'samples'
+        if self.state == 'samples':
+            pos = 0
+            n = len(self.buffer)
+            while True:
+                while pos < n and self.buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos == n:
+                    break
+                if self.buffer[pos] == ']':
+                    self.state = 'tail'
+                    pos += 1
+                    break
+                try:
+                    sample, pos = self.decoder.raw_decode(self.buffer, pos)
+                except json.JSONDecodeError:
+                    break # incomplete sample, wait for the next piece
+                samples.append(sample)
+            self.buffer = self.buffer[pos:]
+        if self.state == 'tail':
+            self.tail += self.buffer
+            self.buffer = ''
+        return samples
+
+    def close(self):
+        """Finish parsing and return the fields of the response other than 'samples'.
+
+        Args:
+            None
+        Returns:
+            dict: The response without its samples.
+        Raises:
+            ValueError: If the response ended before the samples array was complete.
+        """
+        if self.state != 'tail':
+            raise ValueError('Samples response ended before the samples array was complete.')
+        return json.loads(self.head + '"samples": []' + self.tail)
+
+
+class SampleArrays:
+    def __init__(self, capacity=1024):
+        """Initialize growable timestamp, value and missing-value arrays.
+
+        Args:
+            capacity (int): The initial number of samples allocated.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty(capacity, dtype=np.int64)
+        self._missing = np.empty(capacity, dtype=bool)
+        self.size = 0
+
+    def append(self, timestamps, values, missing):
+        """Append a batch of samples, doubling the allocation when needed.
+
+        The values stay int64 while every batch is int64, and are converted to float64 with the first float64
+        batch, as a single response of the same samples would be decoded.
+
+        Args:
+            timestamps (np.ndarray): int64 epoch timestamps in ns.
+            values (np.ndarray): int64 or float64 values, as returned by decode_sample_arrays.
+            missing (np.ndarray): bool missing-value mask.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if values.dtype == np.float64 and self._values.dtype != np.float64:
+            converted = np.empty(len(self._values), dtype=np.float64)
+            converted[:self.size] = np.where(self._missing[:self.size], np.nan, self._values[:self.size])
+            self._values = converted
+        end = self.size + len(timestamps)
+        if end > len(self._timestamps):
+            capacity = max(end, 2 * len(self._timestamps))
+            for name in ('_timestamps', '_values', '_missing'):
+                array = getattr(self, name)
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                setattr(self, name, grown)
+        self._timestamps[self.size:end] = timestamps
+        self._values[self.size:end] = values
+        self._missing[self.size:end] = missing
+        self.size = end
+
+    @property
+    def timestamps(self):
+        return self._timestamps[:self.size]
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    @property
+    def missing(self):
+        return self._missing[:self.size]
+
+
+def samples_to_frame(timestamps, values, missing, is_string):
+    """Convert sample arrays to a DataFrame.
+
+    Args:
+        timestamps (np.ndarray): int64 epoch timestamps in ns.
+        values (np.ndarray): int64 or float64 values.
+        missing (np.ndarray): bool missing-value mask.
+        is_string (bool): True if the signal values are strings holding an integer state.
+    Returns:
+        pd.DataFrame: A DataFrame with a 'values' column indexed by timestamp, missing values are set to -9999.
+            Values of string signals and of signals with only integer values are integers. attrs['is_string']
+            is set for string signals, so the RTU file is written like the baseline writer.
+    Raises:
+        None
+    """
+    values = np.where(missing, -9999, values)
+    if is_string:
+        values = values.astype(np.int64)
+    df = pd.DataFrame({'values': values}, index=pd.to_datetime(timestamps, utc=True))
+    df.attrs['is_string'] = bool(is_string)
+    return df
+
+
+def decode_samples(response):
+    """Convert a Seeq samples response to a DataFrame.
+
+    Args:
+        response (dict): The response of SeeqAPIClient.get_time_series.
+    Returns:
+        pd.DataFrame: A DataFrame with a 'values' column indexed by timestamp, missing values are set to -9999.
+            Values of string signals are integers.
+    Raises:
+        KeyError: If a sample has no 'key'.
+        ValueError: If a string sample does not contain exactly one integer.
+    """
+    is_string = response['valueUnitOfMeasure'] == 'string'
+    timestamps, values, missing = decode_sample_arrays(response['samples'], is_string)
+    return samples_to_frame(timestamps, values, missing, is_string)
+
+
+def fetch_data(client, seeq_ID, pi_tag, from_time, to_time, deltaT, chunk_size=chunk_size, cache=None, stream=stream):
+    """Retrieve the time series of one tag and convert it to a DataFrame.
+
+    Args:
+        client (SeeqAPIClient): An authenticated client, may be shared between threads.
+        seeq_ID (str): The Seeq ID of the signal.
+        pi_tag (str): The PI tag name of the signal.
+        from_time (datetime): The timezone aware start time.
+        to_time (datetime): The timezone aware end time.
+        deltaT (str): The sampling period, e.g. '60s', None for the raw recorded samples.
+        chunk_size (timedelta): Length of the sub-windows fetched in parallel, None to fetch in one request.
+        cache (SeeqSampleCache): If given, only the intervals missing from the cache are fetched.
+        stream (bool): If True, responses are parsed incrementally into arrays.
+    Returns:
+        tuple: The PI tag name and a DataFrame with a 'values' column indexed by timestamp.
+    Raises:
+        Exception: If the request fails.
+        ValueError: If a string sample does not contain exactly one integer.
+    """
+    def fetch(from_time, to_time):
+        print('Getting data for %s | %s from %s to %s' % (pi_tag, seeq_ID, from_time, to_time))
+        start_time = time.time()
+        if stream:
+            if chunk_size is None:
+                arrays = client.get_time_series_arrays(seeq_ID, encode_time(from_time), encode_time(to_time), deltaT)
+            else:
+                arrays = client.get_time_series_chunked(seeq_ID, from_time, to_time, deltaT, chunk_size=chunk_size, stream=True)
+            n_samples = len(arrays[0])
         else:
-            if response['valueUnitOfMeasure'] == 'string':
-                integer = re.findall(r'\d+', item['value'])
-                if len(integer) > 1:
-                    raise ValueError('Expected one integer but found %d' % (len(integer)))
-                else:
-                    values.append(integer[0])
+            if chunk_size is None:
+                response = client.get_time_series(seeq_ID, encode_time(from_time), encode_time(to_time), deltaT)
             else:
-                values.append(item['value'])
-    datetime_index = pd.to_datetime(timestamps)
-    df = pd.DataFrame(values, columns=['values'], index=datetime_index)
+                response = client.get_time_series_chunked(seeq_ID, from_time, to_time, deltaT, chunk_size=chunk_size)
+            n_samples = len(response['samples'])
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        print(f"Elapsed time: {elapsed_time:.3f} seconds for {n_samples} sample points of {pi_tag}.")
+        if stream:
+            return samples_to_frame(*arrays)
+        return decode_samples(response)
+
+    if cache is None:
+        df = fetch(from_time, to_time)
+    else:
+        df = cache.get(seeq_ID, deltaT, from_time, to_time, fetch)
     
     return pi_tag, df
 
 
+def discrete_tags(df_pi_tags, patterns=discrete_tag_patterns):
+    """Get the tags of a tag table that only change at discrete events, e.g. valve status.
+
+    Args:
+        df_pi_tags (pd.DataFrame): Tag table with a 'Name' and optionally a 'Value Unit Of Measure' column.
+        patterns (list): fnmatch patterns of discrete tag names.
+    Returns:
+        list: The names of the tags with 'string' units or matching a pattern.
+    Raises:
+        None
+    """
+    units = df_pi_tags['Value Unit Of Measure'] if 'Value Unit Of Measure' in df_pi_tags else pd.Series(None, index=df_pi_tags.index)
+    return [
+        pi_tag for pi_tag, unit in zip(df_pi_tags['Name'], units)
+        if unit == 'string' or any(fnmatch.fnmatchcase(pi_tag, pattern) for pattern in patterns)
+    ]
+
+
+def densify(df, grid):
+    """Forward-fill raw samples onto a time grid.
+
+    Args:
+        df (pd.DataFrame): Raw samples with a 'values' column indexed by timezone aware timestamps in time order.
+        grid (pd.DatetimeIndex): The timezone aware grid.
+    Returns:
+        pd.DataFrame: The last sample at or before each grid time, -9999 before the first sample.
+    Raises:
+        None
+    """
+    values = df['values'].to_numpy()
+    positions = np.searchsorted(df.index.as_unit('ns').asi8, grid.as_unit('ns').asi8, side='right') - 1
+    dense_values = values[np.maximum(positions, 0)] if len(values) else np.zeros(len(grid), dtype=values.dtype)
+    dense_values = np.where(positions >= 0, dense_values, -9999).astype(values.dtype)
+    df_dense = pd.DataFrame({'values': dense_values}, index=grid)
+    df_dense.attrs.update(df.attrs)
+    return df_dense
+
+
+def densify_tags(data, raw_tags, from_time, to_time, deltaT):
+    """Forward-fill the raw tags of fetched data onto the grid of the other tags.
+
+    Args:
+        data (dict): DataFrames with a 'values' column indexed by timezone aware timestamps, keyed by PI tag.
+        raw_tags (list): The tags in data that were fetched as raw samples.
+        from_time (datetime): The timezone aware start time.
+        to_time (datetime): The timezone aware end time.
+        deltaT (str): The sampling period, e.g. '60s'.
+    Returns:
+        dict: data with the raw tags on the union of the timestamps of the other tags, or on a deltaT grid
+            from from_time to to_time if every tag is raw.
+    Raises:
+        None
+    """
+    raw_tags = set(raw_tags)
+    grid_timestamps = [df.index.as_unit('ns').asi8 for pi_tag, df in data.items() if pi_tag not in raw_tags]
+    if grid_timestamps:
+        grid = pd.to_datetime(np.unique(np.concatenate(grid_timestamps)), utc=True)
+    else:
+        grid = pd.date_range(pd.Timestamp(from_time).ceil(deltaT), pd.Timestamp(to_time).floor(deltaT), freq=deltaT)
+    return {pi_tag: densify(df, grid) if pi_tag in raw_tags else df for pi_tag, df in data.items()}
+
+
+def fetch_all_data(client, df_pi_tags, from_time, to_time, deltaT, n_workers=n_workers, chunk_size=chunk_size, cache=None, stream=stream, raw_tags=()):
+    """Retrieve the time series of every tag in a tag table concurrently.
+
+    All workers share the session of a single authenticated client, so the login is done once
+    and the pooled HTTP connections are reused between tags.
+
+    Args:
+        client (SeeqAPIClient): An authenticated client with pool_size >= n_workers * n_chunk_workers.
+        df_pi_tags (pd.DataFrame): Tag table with 'ID' and 'Name' columns, e.g. from SeeqTagCatalog.resolve.
+        from_time (datetime): The timezone aware start time.
+        to_time (datetime): The timezone aware end time.
+        deltaT (str): The sampling period, e.g. '60s'.
+        n_workers (int): The maximum number of tags fetched concurrently.
+        chunk_size (timedelta): Length of the sub-windows fetched in parallel per tag, None to fetch in one request.
+        cache (SeeqSampleCache): If given, only the intervals missing from the cache are fetched.
+        stream (bool): If True, responses are parsed incrementally into arrays.
+        raw_tags (list): Tags fetched as raw recorded samples in one request instead of on the deltaT grid.
+    Returns:
+        tuple: A dict of DataFrames keyed by PI tag in tag table order, and a list of the tags that failed.
+    Raises:
+        None
+    """
+    results = {}
+    failed_tags = []
+    raw_tags = set(raw_tags)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {}
+        for _, row in df_pi_tags.iterrows():
+            if row['Name'] in raw_tags:
+                future = executor.submit(fetch_data, client, row['ID'], row['Name'], from_time, to_time, None, None, cache, stream)
+            else:
+                future = executor.submit(fetch_data, client, row['ID'], row['Name'], from_time, to_time, deltaT, chunk_size, cache, stream)
+            futures[future] = row['Name']
+        for future in as_completed(futures):
+            pi_tag = futures[future]
+            try:
+                _, df = future.result()
+                results[pi_tag] = df
+            except Exception as e:
+                print(f"Error fetching tag '{pi_tag}': {e}")
+                failed_tags.append(pi_tag)
+
+    data = {pi_tag: results[pi_tag] for pi_tag in df_pi_tags['Name'] if pi_tag in results}
+    return data, failed_tags
+
+
 if __name__ == "__main__":
     load_dotenv(env_path)
  
@@ -253,7 +1023,13 @@ if __name__ == "__main__":
         password=os.getenv("TC_SEEQ_ACCESS_KEY_PASSWORD"),
     )
  
-    df_pi_tags = pd.read_csv(tag_list_found_path)
+    with open(tag_list_path, "r") as file:
+        tag_names = [line.strip() for line in file if line.strip()]
+    catalog = SeeqTagCatalog(tag_catalog_path)
+    df_pi_tags, missing_tags = catalog.resolve(tag_names)
+    catalog.close()
+    if missing_tags:
+        print(f"Tags not found in Seeq: {missing_tags}")
     
     from_time_encoded_string = encode_time(from_time)
     to_time_encoded_string = encode_time(to_time)
@@ -261,72 +1037,40 @@ if __name__ == "__main__":
     
     print('Getting data from %s to %s with a %s interval'%(from_time_encoded_string, to_time_encoded_string, deltaT))
 
-    # Make a GET request to the Seeq API to retrieve signals
-    client = SeeqAPIClient()
+    # One authenticated client shared by all workers
+    client = SeeqAPIClient(pool_size=n_workers * n_chunk_workers)
+    cache = SeeqSampleCache(cache_dir, cache_max_size)
 
-    data = {}
-    indices = range(100)
-    overall_start_time = time.time()
-#    with multiprocessing.Pool(processes=10) as pool:  # Adjust processes as needed, e.g., 10 for rate limits
-#        results = pool.starmap(fetch_data, [(idx, df_pi_tags, from_time_encoded_string, to_time_encoded_string, deltaT) for idx in indices])
-#        
-#        for pi_tag, df in results:
-#            data[pi_tag] = df
-#    overall_end_time = time.time()
-#    overall_elapsed_time = overall_end_time - overall_start_time
-#    print(f"Total elapsed time for multiprocessing: {overall_elapsed_time:.3f} seconds")
-
-    for idx in indices:
-        seeq_ID = df_pi_tags.loc[idx, 'ID']
-        pi_tag = df_pi_tags.loc[idx, 'Name']
-        print('Getting data for %s | %s'%(pi_tag, seeq_ID))
-        start_time = time.time()
-        
-        response = client.get_time_series(seeq_ID, from_time_encoded_string, to_time_encoded_string, deltaT)
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"Elapsed time: {elapsed_time:.3f} seconds for {len(response['samples'])} sample points.")
-        print('')
-        
-        timestamps = []
-        values = []
-        for item in response['samples']:
-            assert 'key' in item.keys(), '"key" not found in %s'%(item)
-            timestamps.append(item['key'])
-            if 'value' not in item.keys():
-                values.append(int(-9999))
-            else:
-                if response['valueUnitOfMeasure'] == 'string':
-                    integer = re.findall(r'\d+', item['value'])
-                    if len(integer)>1:
-                        raise(ValueError('Expected one integer but found %d'%(len(integer))))
-                    else:
-                        values.append(integer[0])
-                else:
-                    values.append(item['value'])
-        datetime_index = pd.to_datetime(timestamps)
-        data[pi_tag] = pd.DataFrame(values, columns=['values'], index=datetime_index)
+    raw_tags = discrete_tags(df_pi_tags) if raw_discrete_tags else []
+    print('Fetching %d discrete tags as raw samples' % (len(raw_tags)))
 
+    overall_start_time = time.time()
+    data, failed_tags = fetch_all_data(client, df_pi_tags, from_time, to_time, deltaT, n_workers=n_workers, chunk_size=chunk_size, cache=cache, stream=stream, raw_tags=raw_tags)
     overall_end_time = time.time()
     overall_elapsed_time = overall_end_time - overall_start_time
-    print(f"Total elapsed time for multiprocessing: {overall_elapsed_time:.3f} seconds")
+    print(f"Total elapsed time for {len(data)} tags with {n_workers} workers: {overall_elapsed_time:.3f} seconds")
+    if failed_tags:
+        print(f"Failed tags: {failed_tags}")
+    report = client.governor.report()
+    print(f"Achieved {report['requests_per_s']:.2f} requests/s and {report['MB_per_s']:.2f} MB/s over {report['n_requests']} requests, "
+          f"{report['n_throttled']} throttled, final limit of {report['in_flight_limit']} requests in flight")
 
     # Close the session
     client.close()
 
-    print('Converting data to generate input file for rtugen...')
-    for pi_tag in data.keys():
-        data[pi_tag].insert(0,'tag_name',[pi_tag]*len(data[pi_tag]))
-        data[pi_tag].insert(2,'quality',['GOOD']*len(data[pi_tag]))
-        data[pi_tag].loc[data[pi_tag]['values']==int(-9999),'quality'] = 'BAD'
-        data[pi_tag].index = data[pi_tag].index.tz_convert('MST').tz_localize(None)
-    
-    df = pd.concat([data[key] for key in data.keys()])
-    df.insert(0,'date_string', df.index.strftime('%Y/%m/%d'))
-    df.insert(1,'time_string', df.index.strftime('%H:%M:%S'))
-    df.sort_index(inplace=True)
-    print('Saving rtugen input file to %s...'%(rtu_file_path))
-    df.to_csv(rtu_file_path, index=False, header=False, sep=" ")
-    print('DONE.')
+    # The store and the RTU file are written on a common grid from from_time to to_time. In change-of-value mode
+    # the grid gives the heartbeat a sample to fire at between the change events of the raw tags.
+    dense_data = densify_tags(data, raw_tags, from_time, to_time, deltaT)
+
+    print('Saving PI data store to %s...'%(pi_data_store_path))
+    write_store(pi_data_store_path, dense_data)
 
+    if rtu_partition is None:
+        print('Saving rtugen input file to %s...'%(rtu_file_path))
+        n_records = write_rtu_file(dense_data, rtu_file_path, deadbands=rtu_deadbands, heartbeat=rtu_heartbeat)
+        print('Wrote %d records.'%(n_records))
+    else:
+        print('Saving rtugen input partitions to %s...'%(rtu_partition_dir))
+        manifest = write_rtu_partitions(dense_data, rtu_partition_dir, rtu_partition, deadbands=rtu_deadbands, heartbeat=rtu_heartbeat, n_workers=n_rtu_workers)
+        print('Wrote %d records in %d partitions.'%(sum(entry['n_records'] for entry in manifest['partitions']), len(manifest['partitions'])))
+    print('DONE.')